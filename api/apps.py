@@ -10,3 +10,6 @@ class ApiConfig(AppConfig):
     Define api app config
     """
     name = 'api'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
@@ -0,0 +1,131 @@
+"""
+Define api response caching
+Rendered responses are keyed by a version of the packages they show, so
+bumping the version on writes invalidates them without deleting entries.
+"""
+
+import hashlib
+import time
+from functools import wraps
+
+from django.core.cache import (
+    DEFAULT_CACHE_ALIAS,
+    cache,
+    caches,
+)
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.http import (
+    HttpResponse,
+    HttpResponseNotModified,
+)
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+from .routers import (
+    get_read_alias,
+    replica_epoch,
+)
+
+ALL_PACKAGES = 'all'
+
+
+def is_shared():
+    """
+    Check if the cache is shared by workers, local memory is per process
+    """
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache)
+
+
+def version_key(scope):
+    """
+    Cache key holding the version of a package or all packages
+    """
+    return 'api:version:{0}'.format(scope)
+
+
+def new_version():
+    """
+    Version unlikely to repeat one evicted from the cache
+    """
+    return int(time.time() * 1000000)
+
+
+def get_version(scope):
+    """
+    Get current version of a package or all packages
+    """
+    key = version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        version = new_version()
+        cache.add(key, version, None)
+        version = cache.get(key, version)
+    return version
+
+
+def bump_versions(package_ids):
+    """
+    Bump version of packages and all packages
+    """
+    for scope in list(package_ids) + [ALL_PACKAGES]:
+        try:
+            cache.incr(version_key(scope))
+        except ValueError:
+            cache.set(version_key(scope), new_version(), None)
+
+
+def invalidate(package_ids):
+    """
+    Invalidate cached responses showing packages
+    again on commit so readers can not cache data from before the write
+    """
+    package_ids = set(package_ids)
+    bump_versions(package_ids)
+    transaction.on_commit(lambda: bump_versions(package_ids))
+
+
+def cached_response(package_scoped=True):
+    """
+    Cache rendered GET responses of a view action with ETag support
+    package scoped responses are invalidated by writes to the package
+    in the pk url kwarg, others by writes to any package
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            # browsable api responses vary by user so are not cached
+            if request.method != 'GET' or \
+                    request.accepted_renderer.format == 'api':
+                return handler(view, request, *args, **kwargs)
+
+            scope = kwargs.get('pk') if package_scoped else ALL_PACKAGES
+            # replicas may lag behind the version so their reads are
+            # only cached for the current epoch
+            identity = '{0}|{1}|{2}|{3}|{4}'.format(
+                scope, get_version(scope), request.accepted_media_type,
+                request.build_absolute_uri(),
+                replica_epoch() if get_read_alias() else '')
+            key = hashlib.md5(identity.encode('utf-8')).hexdigest()
+            etag = '"{0}"'.format(key)
+
+            if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+                response = HttpResponseNotModified()
+            else:
+                cached = cache.get('api:response:{0}'.format(key))
+                if cached is not None:
+                    content, content_type = cached
+                    response = HttpResponse(content, content_type=content_type)
+                else:
+                    response = handler(view, request, *args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+                    response.add_post_render_callback(
+                        lambda rendered: cache.set(
+                            'api:response:{0}'.format(key),
+                            (rendered.content, rendered['Content-Type'])))
+            response['ETag'] = etag
+            patch_vary_headers(response, ['Accept'])
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,29 @@
+"""
+Define api system checks
+"""
+
+from django.conf import settings
+from django.core.checks import (
+    Warning,
+    register,
+)
+
+from .cache import is_shared
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Warn when the cache is local to each process outside of debug
+    cached responses and their ETags outlive writes on other workers
+    """
+    if settings.DEBUG or is_shared():
+        return []
+    return [Warning(
+        'Cache backend is local to each process, workers serve cached '
+        'responses and ETags of other workers\' writes until they expire '
+        'and permissions are not cached',
+        hint='Set CACHE_BACKEND to a shared backend such as memcached '
+             'when serving with more than one worker',
+        id='api.W001',
+    )]
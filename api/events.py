@@ -0,0 +1,379 @@
+"""
+Define live status events
+Statuses are published to subscribers of their package once the write
+commits, each event carrying the position of its change in the change log
+so clients that miss events can resume from the log.
+The EVENT_BROKER setting names the broker class, the default LocalBroker
+only reaches subscribers served by the process that saved the status.
+Streams served by an event loop await their events on it, so an idle
+stream holds no thread.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import (
+    Change,
+    Status,
+)
+from .serializers import StatusValuesSerializer
+
+
+class Subscription:
+    """
+    Bounded queue of events for the packages of one connection
+    A subscriber that falls max_pending events behind is overflowed,
+    further events are dropped and it should resume from the change log
+    """
+
+    def __init__(self, broker, package_ids, max_pending):
+        self.broker = broker
+        self.package_ids = frozenset(package_ids)
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.overflowed = False
+        self.closed = False
+        self.ready = threading.Condition(broker.lock)
+
+    def put(self, event):
+        """
+        Queue event unless the subscriber is too far behind
+        must be called with the broker lock held
+        """
+        if self.overflowed:
+            return
+        if len(self.pending) >= self.max_pending:
+            self.overflowed = True
+            self.pending.clear()
+        else:
+            self.pending.append(event)
+        self.ready.notify()
+
+    def wake(self):
+        """
+        Wake the waiting reader once closed
+        must be called with the broker lock held
+        """
+        self.ready.notify_all()
+
+    def get(self, timeout=None):
+        """
+        Wait for the next event, None if there is none before the timeout
+        or the subscription is closed or overflowed
+        """
+        with self.ready:
+            if not self.pending and not self.overflowed and not self.closed:
+                self.ready.wait(timeout)
+            if self.pending and not self.overflowed:
+                return self.pending.popleft()
+            return None
+
+    def close(self):
+        """
+        Stop receiving events
+        """
+        self.broker.unsubscribe(self)
+
+
+class AsyncSubscription(Subscription):
+    """
+    Subscription read on an event loop, publishing threads hand events
+    to its asyncio queue with call_soon_threadsafe so no thread waits for
+    the events of an idle subscriber
+    """
+
+    def __init__(self, broker, package_ids, max_pending, loop):
+        super().__init__(broker, package_ids, max_pending)
+        self.loop = loop
+        self.queue = asyncio.Queue(loop=loop)
+
+    def put(self, event):
+        self.call(self.deliver, event)
+
+    def wake(self):
+        self.call(self.deliver, None)
+
+    def call(self, callback, *args):
+        """
+        Schedule callback on the event loop of the subscriber
+        """
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # the loop closed, nothing is left to read the subscription
+            pass
+
+    def deliver(self, event):
+        """
+        Queue event unless the subscriber is too far behind, None wakes
+        the reader, on the event loop
+        """
+        if self.overflowed:
+            return
+        if event is not None and self.queue.qsize() >= self.max_pending:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = None
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        """
+        Await the next event, None if there is none before the timeout
+        or the subscription is closed or overflowed
+        """
+        try:
+            event = await asyncio.wait_for(
+                self.queue.get(), timeout, loop=self.loop)
+        except asyncio.TimeoutError:
+            return None
+        return None if self.overflowed else event
+
+
+class LocalBroker:
+    """
+    In process broker fanning out events to subscriptions by package
+    Only reaches subscribers served by the same process, so it suits a
+    single worker, a shared broker implements the same subscribe and
+    publish to fan out events of all workers and commands
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+
+    def subscribe(self, package_ids, max_pending=100, loop=None):
+        """
+        Subscribe to events of packages, read on an event loop if given
+        """
+        if loop is not None:
+            subscription = AsyncSubscription(
+                self, package_ids, max_pending, loop)
+        else:
+            subscription = Subscription(self, package_ids, max_pending)
+        with self.lock:
+            for package_id in subscription.package_ids:
+                self.subscriptions.setdefault(package_id, set()).add(
+                    subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Remove subscription and wake its waiting reader
+        """
+        with self.lock:
+            subscription.closed = True
+            for package_id in subscription.package_ids:
+                subscribers = self.subscriptions.get(package_id, set())
+                subscribers.discard(subscription)
+                if not subscribers:
+                    self.subscriptions.pop(package_id, None)
+            subscription.wake()
+
+    def publish(self, package_id, event):
+        """
+        Queue event for every subscription to the package
+        never blocks on slow subscribers
+        """
+        with self.lock:
+            for subscription in self.subscriptions.get(package_id, ()):
+                subscription.put(event)
+
+
+BROKER = import_string(settings.EVENT_BROKER)()
+
+
+def status_event(position, status):
+    """
+    Event of a created status, (change position, status values)
+    values are cleaned as they would be read back from the database
+    """
+    values = {}
+    for name in StatusValuesSerializer.values:
+        field = status._meta.get_field(name)
+        values[name] = field.to_python(getattr(status, name))
+    return (position, values)
+
+
+def publish_status(change, status):
+    """
+    Publish created status once the transaction writing it commits
+    and its change is given a position in the log
+    """
+    def publish():
+        position = Change.objects.filter(pk=change.pk).values_list(
+            'position', flat=True).first()
+        if position is not None:
+            BROKER.publish(status.package_id, status_event(position, status))
+    transaction.on_commit(publish)
+
+
+def publish_statuses(statuses):
+    """
+    Publish statuses bulk created with their ids once the transaction
+    writing them commits and their changes are given positions in the log
+    """
+    def publish():
+        positions = dict(Change.objects.filter(
+            model=Status._meta.model_name, action=Change.CREATE,
+            object_id__in=[instance.pk for instance in statuses]).values_list(
+                'object_id', 'position'))
+        for instance in statuses:
+            position = positions.get(instance.pk)
+            if position is not None:
+                BROKER.publish(
+                    instance.package_id, status_event(position, instance))
+    transaction.on_commit(publish)
+
+
+def replay_statuses(package_ids, after, chunk_size=500):
+    """
+    Generate events of statuses of packages created after change position
+    from the change log, skipping statuses since deleted
+    """
+    changes = Change.objects.filter(
+        model=Status._meta.model_name, action=Change.CREATE,
+        package_id__in=package_ids, object_id__isnull=False).order_by(
+            'position')
+    while True:
+        chunk = list(changes.filter(position__gt=after).values_list(
+            'position', 'object_id')[:chunk_size])
+        if not chunk:
+            return
+        statuses = {values['id']: values for values in Status.objects.filter(
+            id__in=[object_id for _, object_id in chunk]).values(
+                *StatusValuesSerializer.values)}
+        for position, object_id in chunk:
+            if object_id in statuses:
+                yield (position, statuses[object_id])
+        after = chunk[-1][0]
+
+
+class StatusStream:
+    """
+    Rows (id, event, data) of statuses of packages replayed after change
+    position then live until the duration passes, None rows when idle for
+    the heartbeat and an overflow event when the subscriber falls behind
+    Read by a thread blocking while idle with rows, or by an event loop
+    with async_rows awaiting live events there and running the database
+    work of the replay through run_sync
+    Subscribed before replaying so no status commits unseen in between,
+    live events up to the last replayed position were replayed already
+    but later ones may arrive out of position order from other writers
+    """
+    replay_chunk_size = 500
+
+    def __init__(self, package_ids, serializer, after=None, max_pending=100,
+                 duration=300, heartbeat=15):
+        self.package_ids = package_ids
+        self.serializer = serializer
+        self.after = self.replayed = after
+        self.max_pending = max_pending
+        self.duration = duration
+        self.heartbeat = heartbeat
+
+    def status_row(self, position, values):
+        """
+        Row of a status event, advancing the position to resume after
+        """
+        self.after = position if self.after is None else max(
+            self.after, position)
+        return (position, 'status', self.serializer.to_representation(values))
+
+    def replay(self):
+        """
+        Generate rows of statuses committed after the position
+        """
+        Change.objects.publish()
+        if self.after is None:
+            return
+        for position, values in replay_statuses(
+                self.package_ids, self.after, self.replay_chunk_size):
+            self.replayed = position
+            yield self.status_row(position, values)
+
+    def live_row(self, event):
+        """
+        Row of a live event, None if it was replayed already
+        """
+        position, values = event
+        if self.replayed is not None and position <= self.replayed:
+            return None
+        return self.status_row(position, values)
+
+    def overflow_row(self):
+        """
+        Row telling an overflowed subscriber where to resume
+        """
+        return (None, 'overflow', {'after': self.after})
+
+    def timeout(self, deadline):
+        """
+        Seconds to wait for the next event
+        """
+        return min(self.heartbeat, max(deadline - time.monotonic(), 0))
+
+    def rows(self):
+        """
+        Generate rows, blocking the thread while waiting on live events
+        """
+        subscription = BROKER.subscribe(self.package_ids, self.max_pending)
+        try:
+            yield from self.replay()
+            deadline = time.monotonic() + self.duration
+            while time.monotonic() < deadline:
+                event = subscription.get(self.timeout(deadline))
+                if event is not None:
+                    row = self.live_row(event)
+                    if row is not None:
+                        yield row
+                elif subscription.overflowed:
+                    yield self.overflow_row()
+                    return
+                elif subscription.closed:
+                    return
+                else:
+                    yield None
+        finally:
+            subscription.close()
+
+    async def async_rows(self, run_sync):
+        """
+        Generate rows on the running event loop, awaiting run_sync(func)
+        to call blocking functions of the replay off the loop
+        """
+        loop = asyncio.get_event_loop()
+        subscription = BROKER.subscribe(
+            self.package_ids, self.max_pending, loop=loop)
+        try:
+            replay = self.replay()
+            while True:
+                rows = await run_sync(
+                    lambda: list(islice(replay, self.replay_chunk_size)))
+                for row in rows:
+                    yield row
+                if len(rows) < self.replay_chunk_size:
+                    break
+            deadline = time.monotonic() + self.duration
+            while time.monotonic() < deadline:
+                event = await subscription.get(self.timeout(deadline))
+                if event is not None:
+                    row = self.live_row(event)
+                    if row is not None:
+                        yield row
+                elif subscription.overflowed:
+                    yield self.overflow_row()
+                    return
+                elif subscription.closed:
+                    return
+                else:
+                    yield None
+        finally:
+            subscription.close()
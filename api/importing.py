@@ -0,0 +1,331 @@
+"""
+Define bulk import of package tracking history
+Dumps map package descriptions to lists of statuses, as in
+data_initial.json, or are newline delimited JSON statuses each naming
+their package description. Both are read incrementally so memory stays
+flat however large the dump, and statuses are bulk created in chunks.
+"""
+
+import json
+from decimal import (
+    Decimal,
+    InvalidOperation,
+)
+
+from django.core.exceptions import ValidationError
+from django.db import (
+    connections,
+    router,
+    transaction,
+)
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .cache import invalidate
+from .models import (
+    Change,
+    LatestStatus,
+    Package,
+    Status,
+)
+from .spatial import (
+    grid_cell,
+    unit_vector,
+)
+from .tracks import (
+    invalidate_stats,
+    stats_window,
+)
+
+READ_SIZE = 64 * 1024
+# values larger than this are assumed invalid rather than read on
+MAX_VALUE_SIZE = 1024 * 1024
+WHITESPACE = ' \t\n\r'
+
+
+class DumpError(ValueError):
+    """
+    Dump can not be read
+    """
+
+
+class JSONScanner:
+    """
+    Incremental reader of JSON values and delimiters from a text stream
+    holding only the unread part of the current read in memory
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = ''
+        self.offset = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder(parse_float=Decimal)
+
+    def fill(self):
+        """
+        Read more of the stream, False at the end of it
+        """
+        if self.eof:
+            return False
+        chunk = self.stream.read(READ_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.offset:] + chunk
+        self.offset = 0
+        return True
+
+    def peek(self):
+        """
+        Next character that is not whitespace, '' at the end
+        """
+        while True:
+            while self.offset < len(self.buffer) and \
+                    self.buffer[self.offset] in WHITESPACE:
+                self.offset += 1
+            if self.offset < len(self.buffer):
+                return self.buffer[self.offset]
+            if not self.fill():
+                return ''
+
+    def expect(self, *delimiters):
+        """
+        Consume the next character if one of the delimiters
+        """
+        char = self.peek()
+        if char not in delimiters or not char:
+            raise DumpError('Expected {0} but found {1!r}'.format(
+                ' or '.join(delimiters), char or 'end of dump'))
+        self.offset += 1
+        return char
+
+    def value(self):
+        """
+        Decode the next JSON value, a string or object here
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.offset)
+            except ValueError as exc:
+                if len(self.buffer) - self.offset < MAX_VALUE_SIZE and \
+                        self.fill():
+                    continue
+                raise DumpError('Invalid JSON - {0}'.format(exc))
+            self.offset = end
+            return value
+
+
+def read_dump(stream):
+    """
+    Generate (description, status) from a {description: [status]} dump
+    """
+    scanner = JSONScanner(stream)
+    scanner.expect('{')
+    if scanner.peek() == '}':
+        scanner.expect('}')
+        return
+    while True:
+        description = scanner.value()
+        if not isinstance(description, str):
+            raise DumpError('Expected a package description')
+        scanner.expect(':')
+        scanner.expect('[')
+        if scanner.peek() == ']':
+            scanner.expect(']')
+            yield description, None
+        else:
+            while True:
+                yield description, scanner.value()
+                if scanner.expect(',', ']') == ']':
+                    break
+        if scanner.expect(',', '}') == '}':
+            return
+
+
+def read_ndjson(stream):
+    """
+    Generate (description, status) from lines of statuses with a package
+    """
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            status = json.loads(line, parse_float=Decimal)
+            description = status.pop('package')
+        except (ValueError, AttributeError, KeyError) as exc:
+            raise DumpError('Invalid status on line {0} - {1}'.format(
+                number, exc))
+        if not isinstance(description, str):
+            raise DumpError(
+                'Expected a package description on line {0}'.format(number))
+        yield description, status
+
+
+class StatusImporter:
+    """
+    Bulk create statuses read from a dump in chunked transactions
+    Packages are matched by description, creating those that are missing.
+    Coordinates are rounded to the decimal places of the model fields and
+    invalid statuses are skipped and reported by their position.
+    """
+
+    def __init__(self, chunk_size=5000, pool=None, max_pending=None):
+        self.chunk_size = chunk_size
+        self.pool = pool
+        self.max_pending = max_pending or 2
+        self.packages = {}
+        self.fields = [Status._meta.get_field(name)
+                       for name in ('latitude', 'longitude', 'elevation')]
+        self.imported = 0
+        self.errors = []
+        # a status time in each stats window written to per package
+        self.windows = {}
+
+    def package_id(self, description):
+        """
+        Get id of package with description creating it if missing
+        """
+        if description not in self.packages:
+            package = Package.objects.filter(
+                description=description).order_by('id').first()
+            if package is None:
+                package = Package.objects.create(description=description)
+            self.packages[description] = package.id
+        return self.packages[description]
+
+    def clean(self, status):
+        """
+        Get (created, latitude, longitude, elevation) of status
+        """
+        if not isinstance(status, dict):
+            raise ValidationError('Expected a status object')
+        try:
+            created = parse_datetime(status.get('created'))
+        except (TypeError, ValueError):
+            created = None
+        if created is None:
+            raise ValidationError('Expected an ISO 8601 created time')
+        if timezone.is_naive(created):
+            created = timezone.make_aware(created)
+        values = [created]
+        for field in self.fields:
+            try:
+                value = Decimal(status[field.name]).quantize(
+                    Decimal(1).scaleb(-field.decimal_places))
+            except (KeyError, TypeError, InvalidOperation):
+                raise ValidationError(
+                    'Expected a number for {0}'.format(field.name))
+            # same bound as the field's validator on a quantized value
+            if not value.is_finite() or abs(value) >= 10 ** (
+                    field.max_digits - field.decimal_places):
+                raise ValidationError('Expected at most {0} digits before '
+                                      'the decimal point for {1}'.format(
+                                          field.max_digits -
+                                          field.decimal_places, field.name))
+            values.append(value)
+        return tuple(values)
+
+    def chunks(self, rows):
+        """
+        Group valid statuses into chunks of (package_id, status values)
+        """
+        chunk = []
+        for index, (description, status) in enumerate(rows):
+            package_id = self.package_id(description)
+            if status is None:
+                continue
+            try:
+                values = self.clean(status)
+            except ValidationError as exc:
+                self.errors.append((index, description, exc.messages))
+                continue
+            chunk.append((package_id,) + values)
+            self.windows.setdefault(
+                (package_id, stats_window(values[0])), values[0])
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def run(self, rows, progress=None):
+        """
+        Import rows of (description, status) calling progress with the
+        number of statuses imported after each chunk
+        Returns ids of packages given statuses
+        pool is a multiprocessing pool forked without open connections
+        Packages of committed chunks are finished even if the import fails
+        """
+        package_ids, pending = set(), []
+        try:
+            for chunk in self.chunks(rows):
+                chunk_package_ids = {values[0] for values in chunk}
+                if self.pool is None:
+                    self.imported += create_statuses(chunk)
+                    package_ids.update(chunk_package_ids)
+                else:
+                    pending.append((chunk_package_ids, self.pool.apply_async(
+                        create_statuses, (chunk,))))
+                    # bound chunks held in memory when the database lags
+                    while len(pending) > self.max_pending:
+                        chunk_package_ids, result = pending.pop(0)
+                        self.imported += result.get()
+                        package_ids.update(chunk_package_ids)
+                if progress is not None:
+                    progress(self.imported)
+            while pending:
+                chunk_package_ids, result = pending.pop(0)
+                self.imported += result.get()
+                package_ids.update(chunk_package_ids)
+            if progress is not None:
+                progress(self.imported)
+        finally:
+            # chunks still inserting may commit after a failed one
+            for chunk_package_ids, result in pending:
+                result.wait()
+                if result.successful():
+                    self.imported += result.get()
+                    package_ids.update(chunk_package_ids)
+            self.finish(package_ids)
+        return package_ids
+
+    def finish(self, package_ids):
+        """
+        Update what bulk creating statuses skips for the packages
+        """
+        with transaction.atomic():
+            LatestStatus.objects.refresh(package_ids)
+            Change.objects.record_bulk_created(package_ids)
+            invalidate(package_ids)
+        invalidate_stats((package_id, created) for (package_id, _), created
+                         in self.windows.items())
+
+
+def create_statuses(chunk):
+    """
+    Insert chunk of (package_id, created, lat, lng, elev) statuses in one
+    transaction, run in the importing or a worker process
+    Values are cleaned already so are inserted with one executemany
+    instead of bulk_create preparing each value through its model field
+    """
+    alias = router.db_for_write(Status)
+    connection = connections[alias]
+    ops = connection.ops
+    columns = [Status._meta.get_field(name).column for name in (
+        'package', 'created', 'latitude', 'longitude', 'elevation', 'grid',
+        'unit_x', 'unit_y', 'unit_z')]
+    sql = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+        ops.quote_name(Status._meta.db_table),
+        ', '.join(ops.quote_name(column) for column in columns),
+        ', '.join(['%s'] * len(columns)))
+    rows = [
+        (package_id, ops.adapt_datetimefield_value(created), str(latitude),
+         str(longitude), str(elevation), grid_cell(latitude, longitude),
+         *unit_vector(latitude, longitude))
+        for package_id, created, latitude, longitude, elevation in chunk
+    ]
+    with transaction.atomic(using=alias), connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+    return len(rows)
@@ -0,0 +1,314 @@
+"""
+Define write behind ingestion of tracking statuses
+Statuses posted in write behind mode are validated and appended to a
+durable queue in a local SQLite file instead of inserted, so request
+workers do not wait on the status table. Workers drain the queue in
+bulk inserts. A client sending back the signed token of its write has
+the writes of the package up to it drained before its next tracking read.
+Statuses are drained at least once, a worker stopped between commit and
+acknowledgement or outliving its lease leaves its batch to be drained
+again, saved statuses keep their queue token so they are skipped.
+"""
+
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.signing import (
+    BadSignature,
+    Signer,
+)
+from django.db import (
+    router,
+    transaction,
+)
+from django.utils.dateparse import parse_datetime
+
+from .cache import invalidate
+from .events import publish_statuses
+from .models import (
+    Change,
+    LatestStatus,
+    Package,
+    Status,
+)
+from .tracks import invalidate_stats
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS queue ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, package_id INTEGER NOT NULL, '
+    'created TEXT NOT NULL, latitude TEXT NOT NULL, '
+    'longitude TEXT NOT NULL, elevation TEXT NOT NULL, claimed REAL)',
+    'CREATE INDEX IF NOT EXISTS queue_package ON queue (package_id, id)',
+    'CREATE TABLE IF NOT EXISTS meta ('
+    'name TEXT PRIMARY KEY, value TEXT NOT NULL)',
+)
+COLUMNS = 'id, package_id, created, latitude, longitude, elevation'
+
+
+class IngestQueue:
+    """
+    Durable queue of statuses in a SQLite file shared by processes
+    Rows are claimed by a drain for a lease and deleted once saved, so
+    rows of a drain that died are claimed again once the lease expires
+    """
+
+    def __init__(self, path, lease=60):
+        self.path = path
+        self.lease = lease
+        self.local = threading.local()
+        self._id = None
+
+    @property
+    def connection(self):
+        """
+        Connection of this thread in autocommit mode
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # a write is synced to disk before it is acknowledged
+            connection.execute('PRAGMA synchronous=FULL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            connection.execute(
+                "INSERT OR IGNORE INTO meta (name, value) VALUES ('id', ?)",
+                [uuid.uuid4().hex])
+            self.local.connection = connection
+        return connection
+
+    @property
+    def id(self):
+        """
+        Random id of the queue file, tokens are only unique within it
+        """
+        if self._id is None:
+            self._id = self.connection.execute(
+                "SELECT value FROM meta WHERE name = 'id'").fetchone()[0]
+        return self._id
+
+    def status_token(self, token):
+        """
+        Token kept by the status drained from a queued row, unique across
+        queue files
+        """
+        return '{0}:{1}'.format(self.id, token)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Hold the write lock of the queue for reads then writes
+        """
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def put(self, package_id, created, latitude, longitude, elevation):
+        """
+        Append a status, returns its token
+        """
+        return self.connection.execute(
+            'INSERT INTO queue (package_id, created, latitude, longitude, '
+            'elevation) VALUES (?, ?, ?, ?, ?)', (
+                package_id, created.isoformat(), str(latitude),
+                str(longitude), str(elevation))).lastrowid
+
+    @staticmethod
+    def filters(package_id, through):
+        """
+        Get where clause and params of rows of a package up to a token
+        """
+        clauses, params = [], []
+        if package_id is not None:
+            clauses.append('package_id = ?')
+            params.append(package_id)
+        if through is not None:
+            clauses.append('id <= ?')
+            params.append(through)
+        return clauses, params
+
+    def claim(self, limit, package_id=None, through=None):
+        """
+        Claim oldest unclaimed statuses, returns rows of COLUMNS
+        optionally only of a package up to a token
+        """
+        now = time.time()
+        clauses, params = self.filters(package_id, through)
+        clauses.append('(claimed IS NULL OR claimed < ?)')
+        params.append(now - self.lease)
+        with self.transaction() as connection:
+            rows = connection.execute(
+                'SELECT {0} FROM queue WHERE {1} ORDER BY id LIMIT ?'.format(
+                    COLUMNS, ' AND '.join(clauses)),
+                params + [limit]).fetchall()
+            if rows:
+                connection.execute(
+                    'UPDATE queue SET claimed = ? WHERE id IN ({0})'.format(
+                        ', '.join(['?'] * len(rows))),
+                    [now] + [row[0] for row in rows])
+        return rows
+
+    def ack(self, ids):
+        """
+        Delete saved statuses
+        """
+        self.connection.execute('DELETE FROM queue WHERE id IN ({0})'.format(
+            ', '.join(['?'] * len(ids))), list(ids))
+
+    def release(self, ids):
+        """
+        Return claimed statuses to the queue
+        """
+        self.connection.execute(
+            'UPDATE queue SET claimed = NULL WHERE id IN ({0})'.format(
+                ', '.join(['?'] * len(ids))), list(ids))
+
+    def pending(self, package_id=None, through=None):
+        """
+        Count statuses not yet saved, claimed or not
+        """
+        clauses, params = self.filters(package_id, through)
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM queue{0}'.format(
+                ' WHERE ' + ' AND '.join(clauses) if clauses else ''),
+            params).fetchone()[0]
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_queue():
+    """
+    Get queue at the TRACKING_QUEUE path of the settings
+    """
+    path = settings.TRACKING_QUEUE
+    with _queues_lock:
+        if path not in _queues:
+            _queues[path] = IngestQueue(path)
+        return _queues[path]
+
+
+def sign_token(queue, package_id, token):
+    """
+    Tracking token handed to a client for a status queued in a queue,
+    signed so only issued tokens make reads drain the queue
+    """
+    return Signer(salt='api.ingest').sign('{0}:{1}:{2}'.format(
+        package_id, queue.id, token))
+
+
+def unsign_token(value):
+    """
+    Get package id, queue id and queue token of a tracking token
+    raises ValueError for tokens that were not issued
+    """
+    try:
+        package_id, queue_id, token = Signer(salt='api.ingest').unsign(
+            value).split(':')
+    except BadSignature:
+        raise ValueError('Bad signature')
+    return int(package_id), queue_id, int(token)
+
+
+def save_statuses(statuses):
+    """
+    Bulk create located statuses of existing packages in one transaction
+    updating what bulk creating skips for their packages
+    Statuses with a queue token are logged and published one by one
+    """
+    with transaction.atomic():
+        Status.objects.bulk_create(statuses)
+        # bulk create sends no signals to update latest status
+        package_ids = {pkg_status.package_id for pkg_status in statuses}
+        LatestStatus.objects.refresh(package_ids)
+        invalidate(package_ids)
+        queued = [pkg_status for pkg_status in statuses
+                  if pkg_status.token is not None]
+        if queued:
+            # bulk inserts do not return ids, they are read back by token
+            ids = dict(Status.objects.using(
+                router.db_for_write(Status)).filter(token__in=[
+                    pkg_status.token for pkg_status in queued]).values_list(
+                        'token', 'id'))
+            for pkg_status in queued:
+                pkg_status.id = ids[pkg_status.token]
+            Change.objects.record_created(queued)
+            publish_statuses(queued)
+        unqueued = {pkg_status.package_id for pkg_status in statuses
+                    if pkg_status.token is None}
+        if unqueued:
+            Change.objects.record_bulk_created(unqueued)
+        invalidate_stats((pkg_status.package_id, pkg_status.created)
+                         for pkg_status in statuses)
+
+
+def drain(queue, limit, package_id=None, through=None):
+    """
+    Save a batch of queued statuses, returns the number drained
+    Statuses of packages deleted since they were queued are dropped and
+    statuses already saved by an earlier drain of the batch are skipped
+    """
+    rows = queue.claim(limit, package_id, through)
+    if not rows:
+        return 0
+    ids = [row[0] for row in rows]
+    try:
+        alias = router.db_for_write(Status)
+        package_ids = set(Package.objects.using(alias).filter(
+            id__in={row[1] for row in rows}).values_list('id', flat=True))
+        saved = set(Status.objects.using(alias).filter(token__in=[
+            queue.status_token(token) for token in ids]).values_list(
+                'token', flat=True))
+        statuses = []
+        for token, row_package_id, created, latitude, longitude, \
+                elevation in rows:
+            token = queue.status_token(token)
+            if row_package_id not in package_ids or token in saved:
+                continue
+            pkg_status = Status(
+                package_id=row_package_id, created=parse_datetime(created),
+                latitude=Decimal(latitude), longitude=Decimal(longitude),
+                elevation=Decimal(elevation), token=token)
+            pkg_status.locate()
+            statuses.append(pkg_status)
+        if statuses:
+            save_statuses(statuses)
+    except BaseException:
+        queue.release(ids)
+        raise
+    queue.ack(ids)
+    return len(rows)
+
+
+def flush(queue, queue_id, package_id, through, limit=1000, timeout=5):
+    """
+    Drain at most limit statuses of a package up to a token of a queue,
+    waiting on those being drained by workers, returns False if some are
+    still queued or the token is of another queue so they may be
+    """
+    if queue_id != queue.id:
+        return False
+    deadline = time.monotonic() + timeout
+    drained = 0
+    while queue.pending(package_id, through):
+        if drained >= limit:
+            return False
+        count = drain(queue, limit - drained, package_id, through)
+        if not count:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        drained += count
+    return True
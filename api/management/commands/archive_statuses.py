@@ -0,0 +1,39 @@
+"""
+Move statuses older than the hot window into the archive table
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.utils import timezone
+
+from api.models import ArchivedStatus
+
+
+class Command(BaseCommand):
+    """
+    Archive statuses created before the hot window in chunked
+    transactions, safe to run while the api is serving
+    """
+    help = 'Move statuses older than the hot window into the archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=settings.STATUS_HOT_DAYS,
+                            help='days statuses stay in the status table')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='statuses moved per transaction')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['chunk_size'] < 1:
+            raise CommandError('Expected positive days and chunk size')
+        before = timezone.now() - timezone.timedelta(days=options['days'])
+        start = time.perf_counter()
+        moved = ArchivedStatus.objects.archive(before, options['chunk_size'])
+        self.stdout.write(
+            'Archived {0} statuses created before {1} in {2:.1f}s'.format(
+                moved, before.isoformat(), time.perf_counter() - start))
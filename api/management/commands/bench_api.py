@@ -0,0 +1,278 @@
+"""
+Benchmark latency and throughput of api endpoints on synthetic fleets
+"""
+
+import json
+import math
+import time
+from collections import OrderedDict
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from api.models import (
+    LatestStatus,
+    Package,
+    Status,
+)
+
+
+def percentile(timings, fraction):
+    """
+    Nearest rank percentile of sorted timings
+    """
+    return timings[max(int(math.ceil(fraction * len(timings))) - 1, 0)]
+
+
+class Command(BaseCommand):
+    """
+    Seed fleets of packages with tracking histories at each scale and time
+    requests to the list, detail, tracking and status endpoints through
+    the full middleware and view stack
+    Benchmark data is created in a test database destroyed afterwards,
+    flushed between scales, so writes commit and run their on commit work
+    Fails when the p95 latency of an endpoint is over its budget or has
+    regressed from a previous run
+    """
+    help = 'Benchmark api endpoint latency on synthetic fleets'
+    endpoints = ('list', 'detail', 'tracking', 'tracking_post',
+                 'status_delete')
+    # p95 latency budgets in ms
+    budgets = {
+        'list': 150,
+        'detail': 250,
+        'tracking': 50,
+        'tracking_post': 50,
+        'status_delete': 50,
+    }
+    seed_chunk_size = 5000
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='10x100,100x1000',
+                            help='comma separated packages x statuses '
+                            'per package to seed')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='requests timed per endpoint and scale')
+        parser.add_argument('--endpoints', default=','.join(self.endpoints))
+        parser.add_argument('--cached', action='store_true',
+                            help='keep cached responses between requests')
+        parser.add_argument('--budgets', help='json file of p95 ms '
+                            'budgets by endpoint overriding the defaults')
+        parser.add_argument('--output', help='json file to store results')
+        parser.add_argument('--compare', help='json results of a previous '
+                            'run to check for regressions')
+        parser.add_argument('--tolerance', type=float, default=1.5,
+                            help='allowed ratio of p95 to the previous run')
+
+    def handle(self, *args, **options):
+        scales = self.parse_scales(options['scales'])
+        endpoints = options['endpoints'].split(',')
+        unknown = set(endpoints) - set(self.endpoints)
+        if unknown:
+            raise CommandError('Unknown endpoints {0}'.format(
+                ', '.join(sorted(unknown))))
+        budgets = dict(self.budgets)
+        if options['budgets']:
+            budgets.update(self.load(options['budgets']))
+
+        results = []
+        name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for packages, statuses in scales:
+                results.extend(self.benchmark(
+                    packages, statuses, endpoints, options))
+                call_command('flush', interactive=False, verbosity=0)
+        finally:
+            connection.creation.destroy_test_db(name, verbosity=0)
+            # cached responses of the benchmark data
+            cache.clear()
+
+        failures = []
+        for result in results:
+            result['budget_ms'] = budgets.get(result['endpoint'])
+            if result['budget_ms'] is not None and \
+                    result['p95_ms'] > result['budget_ms']:
+                failures.append('{scale} {endpoint} p95 {p95_ms:.2f} ms over '
+                                'budget of {budget_ms} ms'.format(**result))
+        if options['compare']:
+            failures.extend(self.compare(
+                self.load(options['compare']), results, options['tolerance']))
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(OrderedDict([
+                    ('created', timezone.now().isoformat()),
+                    ('database', connection.vendor),
+                    ('requests', options['requests']),
+                    ('cached', options['cached']),
+                    ('results', results),
+                ]), output, indent=2)
+        if failures:
+            raise CommandError('\n'.join(failures))
+
+    @staticmethod
+    def parse_scales(value):
+        """
+        Get list of (packages, statuses per package) from 10x100,100x10
+        """
+        try:
+            scales = [tuple(int(part) for part in scale.split('x'))
+                      for scale in value.split(',')]
+        except ValueError:
+            scales = []
+        if not scales or any(len(scale) != 2 or min(scale) < 1
+                             for scale in scales):
+            raise CommandError(
+                'Expected scales like 10x100, got {0}'.format(value))
+        return scales
+
+    @staticmethod
+    def load(path):
+        """
+        Read json file
+        """
+        try:
+            with open(path) as source:
+                return json.load(source)
+        except (OSError, ValueError) as exc:
+            raise CommandError('Can not read {0} - {1}'.format(path, exc))
+
+    @staticmethod
+    def compare(previous, results, tolerance):
+        """
+        Regressions of p95 latency from previous results
+        """
+        before = {(result['scale'], result['endpoint']): result['p95_ms']
+                  for result in previous.get('results', [])}
+        regressions = []
+        for result in results:
+            p95 = before.get((result['scale'], result['endpoint']))
+            if p95 and result['p95_ms'] > p95 * tolerance:
+                regressions.append(
+                    '{0} {1} p95 {2:.2f} ms regressed from {3:.2f} ms'.format(
+                        result['scale'], result['endpoint'],
+                        result['p95_ms'], p95))
+        return regressions
+
+    def seed(self, packages, statuses):
+        """
+        Create packages each with a track of statuses a minute apart
+        Returns package ids
+        """
+        last_id = Package.objects.order_by('-id').values_list(
+            'id', flat=True).first() or 0
+        Package.objects.bulk_create([
+            Package(description='benchmark {0}'.format(index))
+            for index in range(packages)
+        ])
+        package_ids = list(Package.objects.filter(
+            id__gt=last_id).values_list('id', flat=True))
+        start = timezone.now() - timezone.timedelta(minutes=statuses)
+        chunk = []
+        for package_id in package_ids:
+            for index in range(statuses):
+                pkg_status = Status(
+                    package_id=package_id,
+                    latitude=round(45 + math.sin(index / 50) / 100, 6),
+                    longitude=round(-75 + index / 10000, 6),
+                    elevation=100 + index % 7,
+                    created=start + timezone.timedelta(minutes=index))
+                pkg_status.locate()
+                chunk.append(pkg_status)
+                if len(chunk) >= self.seed_chunk_size:
+                    Status.objects.bulk_create(chunk)
+                    chunk = []
+        Status.objects.bulk_create(chunk)
+        LatestStatus.objects.refresh(package_ids)
+        return package_ids
+
+    def benchmark(self, packages, statuses, endpoints, options):
+        """
+        Seed a fleet and time each endpoint, returns results
+        """
+        scale = '{0}x{1}'.format(packages, statuses)
+        began = time.perf_counter()
+        package_ids = self.seed(packages, statuses)
+        self.stdout.write('{0} seeded in {1:.1f}s'.format(
+            scale, time.perf_counter() - began))
+        client = APIClient(HTTP_ACCEPT='application/json')
+        client.force_authenticate(User.objects.create_superuser(
+            'benchmark', 'benchmark@example.com', None))
+        # statuses that are not the latest of their package to delete
+        deletable = list(Status.objects.filter(
+            package__in=package_ids).exclude(
+                id__in=LatestStatus.objects.values('status_id')).values_list(
+                    'id', flat=True)[:options['requests']])
+
+        results = []
+        for endpoint in endpoints:
+            requests = options['requests']
+            if endpoint == 'status_delete':
+                requests = min(requests, len(deletable))
+            timings = []
+            for index in range(requests):
+                if not options['cached']:
+                    cache.clear()
+                request = self.request(
+                    endpoint, index, package_ids, deletable)
+                start = time.perf_counter()
+                response = request(client)
+                timings.append(time.perf_counter() - start)
+                if response.status_code >= status.HTTP_400_BAD_REQUEST:
+                    raise CommandError('{0} responded {1}'.format(
+                        endpoint, response.status_code))
+            if not timings:
+                continue
+            timings.sort()
+            result = OrderedDict([
+                ('scale', scale),
+                ('packages', packages),
+                ('statuses', statuses),
+                ('endpoint', endpoint),
+                ('requests', len(timings)),
+                ('p50_ms', round(percentile(timings, 0.5) * 1000, 3)),
+                ('p95_ms', round(percentile(timings, 0.95) * 1000, 3)),
+                ('p99_ms', round(percentile(timings, 0.99) * 1000, 3)),
+                ('max_ms', round(timings[-1] * 1000, 3)),
+                ('rps', round(len(timings) / sum(timings), 1)),
+            ])
+            results.append(result)
+            self.stdout.write(
+                '{scale:<10} {endpoint:<14} p50 {p50_ms:>8.2f} ms  '
+                'p95 {p95_ms:>8.2f} ms  p99 {p99_ms:>8.2f} ms  '
+                '{rps:>7.0f} req/s'.format(**result))
+        return results
+
+    @staticmethod
+    def request(endpoint, index, package_ids, deletable):
+        """
+        Request to make of an endpoint given the client
+        requests cycle through packages, deleting a status each time
+        """
+        package_id = package_ids[index % len(package_ids)]
+        if endpoint == 'list':
+            url = reverse('package-list')
+            offset = index * 10 % len(package_ids)
+            return lambda client: client.get(url, {'offset': offset})
+        if endpoint == 'detail':
+            url = reverse('package-detail', kwargs={'pk': package_id})
+            return lambda client: client.get(url)
+        url = reverse('package-tracking', kwargs={'pk': package_id})
+        if endpoint == 'tracking':
+            return lambda client: client.get(url)
+        if endpoint == 'tracking_post':
+            data = {'latitude': 45, 'longitude': -75, 'elevation': index}
+            return lambda client: client.post(url, data, format='json')
+        url = reverse('status-detail', kwargs={'pk': deletable[index]})
+        return lambda client: client.delete(url)
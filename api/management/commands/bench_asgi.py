@@ -0,0 +1,129 @@
+"""
+Benchmark requests per second of a WSGI worker against an ASGI worker
+"""
+
+import asyncio
+import io
+import statistics
+import time
+from urllib import parse
+
+from django.conf import settings
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.core.wsgi import get_wsgi_application
+from django.urls import reverse
+
+from api.models import Status
+from trackex.asgi import ASGIHandler
+
+
+class Command(BaseCommand):
+    """
+    Time requests served one at a time by a synchronous WSGI worker
+    against concurrent requests served by one ASGI worker offloading
+    them to its thread pool
+    """
+    help = 'Benchmark requests per second of a WSGI and an ASGI worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='uncached url to request, '
+                            'defaults to the first status')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--threads', type=int,
+                            default=settings.ASGI_THREADS)
+
+    def handle(self, *args, **options):
+        url = options['url']
+        if url is None:
+            url = reverse('status-detail',
+                          kwargs={'pk': Status.objects.first().pk})
+        url = parse.urlsplit(url)
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': url.path,
+            'query_string': url.query.encode('latin1'),
+            'headers': [(b'host', b'localhost'),
+                        (b'accept', b'application/json')],
+        }
+        handler = ASGIHandler(
+            get_wsgi_application(), options['threads'], 1)
+        try:
+            for label, benchmark in [
+                    ('wsgi', self.benchmark_wsgi),
+                    ('asgi', self.benchmark_asgi)]:
+                elapsed, timings = benchmark(handler, scope, options)
+                timings.sort()
+                self.stdout.write(
+                    '{0:<5} p50 {1:>7.2f} ms  p95 {2:>7.2f} ms  '
+                    '{3:>7.0f} req/s'.format(
+                        label, statistics.median(timings) * 1000,
+                        timings[int(len(timings) * 0.95)] * 1000,
+                        len(timings) / elapsed))
+        finally:
+            handler.executor.shutdown()
+            handler.stream_executor.shutdown()
+
+    @staticmethod
+    def check_status(scope, status):
+        """
+        Fail on unsuccessful response
+        """
+        if status != 200:
+            raise CommandError('{0} responded {1}'.format(
+                scope['path'], status))
+
+    def benchmark_wsgi(self, handler, scope, options):
+        """
+        Serve requests one after another on this thread
+        """
+        timings = []
+        start = time.perf_counter()
+        for _ in range(options['requests']):
+            began = time.perf_counter()
+            status, _, _, _ = handler.respond(
+                handler.environ(scope, io.BytesIO()))
+            timings.append(time.perf_counter() - began)
+            self.check_status(scope, status)
+        return time.perf_counter() - start, timings
+
+    def benchmark_asgi(self, handler, scope, options):
+        """
+        Serve requests from concurrent clients on one event loop
+        """
+        timings = []
+
+        async def request():
+            sent = []
+
+            async def receive():
+                return {'type': 'http.request'}
+
+            async def send(message):
+                sent.append(message)
+
+            began = time.perf_counter()
+            await handler(scope, receive, send)
+            timings.append(time.perf_counter() - began)
+            self.check_status(scope, sent[0]['status'])
+
+        async def client(requests):
+            for _ in range(requests):
+                await request()
+
+        async def clients():
+            concurrency = max(1, min(options['concurrency'],
+                                     options['requests']))
+            share, extra = divmod(options['requests'], concurrency)
+            await asyncio.gather(*[client(share + (index < extra))
+                                   for index in range(concurrency)])
+
+        loop = asyncio.new_event_loop()
+        try:
+            start = time.perf_counter()
+            loop.run_until_complete(clients())
+            return time.perf_counter() - start, timings
+        finally:
+            loop.close()
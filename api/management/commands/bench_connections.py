@@ -0,0 +1,91 @@
+"""
+Benchmark requests with per request and persistent database connections
+"""
+
+import statistics
+import time
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory
+from django.urls import reverse
+
+from api.models import Status
+
+
+class Command(BaseCommand):
+    """
+    Time requests closing the connection after each one against
+    requests reusing one persistent connection
+    Requests go through the WSGI handler as on a server, so connections
+    are closed by the request started and finished signals
+    """
+    help = 'Benchmark per request against persistent database connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='uncached url to request, '
+                            'defaults to the first status')
+        parser.add_argument('--requests', type=int, default=500)
+
+    def handle(self, *args, **options):
+        url = options['url']
+        if url is None:
+            url = reverse('status-detail',
+                          kwargs={'pk': Status.objects.first().pk})
+        original = connection.settings_dict['CONN_MAX_AGE']
+        try:
+            for label, max_age in [('per request', 0), ('persistent', None)]:
+                connection.close()
+                connection.settings_dict['CONN_MAX_AGE'] = max_age
+                timings, connects = self.benchmark(url, options['requests'])
+                self.stdout.write(
+                    '{0:<12} p50 {1:>7.2f} ms  p95 {2:>7.2f} ms  '
+                    '{3:>7.0f} req/s  {4} connections'.format(
+                        label, statistics.median(timings) * 1000,
+                        timings[int(len(timings) * 0.95)] * 1000,
+                        len(timings) / sum(timings), connects))
+        finally:
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = original
+
+    @staticmethod
+    def benchmark(url, requests):
+        """
+        Get sorted request times for url and connections opened
+        """
+        application = get_wsgi_application()
+        factory = RequestFactory()
+        connects = []
+
+        def count(sender, connection, **kwargs):
+            connects.append(connection.alias)
+
+        def start_response(status, headers, exc_info=None):
+            statuses.append(status)
+
+        timings = []
+        connection_created.connect(count)
+        try:
+            for _ in range(requests):
+                environ = factory.get(
+                    url, HTTP_ACCEPT='application/json').environ
+                statuses = []
+                start = time.perf_counter()
+                response = application(environ, start_response)
+                try:
+                    b''.join(response)
+                finally:
+                    # finishes the request as a server would
+                    response.close()
+                timings.append(time.perf_counter() - start)
+                if not statuses[0].startswith('200'):
+                    raise CommandError('{0} responded {1}'.format(
+                        url, statuses[0]))
+        finally:
+            connection_created.disconnect(count)
+        return sorted(timings), len(connects)
@@ -0,0 +1,86 @@
+"""
+Benchmark size and encode time of packed statuses against JSON
+"""
+
+import gzip
+import math
+import timeit
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api.management.commands.bench_serializers import Rollback
+from api.models import (
+    Package,
+    Status,
+)
+from api.renderers import PackedStatusRenderer
+from api.serializers import PackageStatusValuesSerializer
+
+
+class Command(BaseCommand):
+    """
+    Render a page of tracking as JSON and packed statuses
+    Benchmark data is created in a transaction that is rolled back
+    """
+    help = 'Benchmark bytes and encode time of packed statuses against JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.benchmark(options['rows'], options['repeat'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def benchmark(self, rows, repeat):
+        """
+        Seed a track reported every few seconds and report each encoding
+        """
+        package = Package.objects.create(description='benchmark')
+        start = timezone.now()
+        Status.objects.bulk_create([
+            Status(package=package, latitude=45 + math.sin(i / 50) / 100,
+                   longitude=-75 + i / 10000, elevation=100 + i % 7,
+                   created=start + timezone.timedelta(seconds=5 * i))
+            for i in range(rows)
+        ])
+        request = APIRequestFactory().get('/')
+        statuses = Status.objects.filter(package=package).values(
+            *PackageStatusValuesSerializer.values)
+        page = OrderedDict([
+            ('count', rows),
+            ('next', 'http://testserver/packages/{0}/tracking'
+                     '?limit={1}&offset={1}'.format(package.pk, rows)),
+            ('previous', None),
+            ('results', PackageStatusValuesSerializer(
+                list(statuses), many=True,
+                context={'request': request}).data),
+        ])
+
+        json_renderer = JSONRenderer()
+        packed_renderer = PackedStatusRenderer()
+        results = [
+            ('json', lambda: json_renderer.render(page)),
+            ('packed', lambda: packed_renderer.render(page)),
+        ]
+        sizes = {}
+        for name, func in results:
+            content = func()
+            sizes[name] = len(content)
+            timing = min(timeit.repeat(func, number=1, repeat=repeat))
+            self.stdout.write(
+                '{0:<8} {1:>8} bytes {2:>6.1f} bytes/row {3:>8} gzipped  '
+                '{4:>7.2f} ms / {5} rows'.format(
+                    name, len(content), len(content) / max(rows, 1),
+                    len(gzip.compress(content)), timing * 1000, rows))
+        self.stdout.write('size {0:.1f}x smaller'.format(
+            sizes['json'] / sizes['packed']))
@@ -0,0 +1,82 @@
+"""
+Benchmark status serializers against fast values serializers
+"""
+
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api.models import (
+    Package,
+    Status,
+)
+from api.serializers import (
+    PackageStatusSerializer,
+    PackageStatusValuesSerializer,
+)
+
+
+class Rollback(Exception):
+    """
+    Raised to discard benchmark data
+    """
+
+
+class Command(BaseCommand):
+    """
+    Time rendering a page of tracking with each serializer
+    Benchmark data is created in a transaction that is rolled back
+    """
+    help = 'Benchmark tracking serializers on a page of statuses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.benchmark(options['rows'], options['repeat'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def benchmark(self, rows, repeat):
+        """
+        Seed statuses and report best time of each serializer
+        """
+        package = Package.objects.create(description='benchmark')
+        Status.objects.bulk_create([
+            Status(package=package, latitude=i % 90,
+                   longitude=i % 180, elevation=i)
+            for i in range(rows)
+        ])
+        statuses = Status.objects.filter(package=package)
+        context = {'request': APIRequestFactory().get('/')}
+        renderer = JSONRenderer()
+
+        def model_serializer():
+            return renderer.render(PackageStatusSerializer(
+                list(statuses), many=True, context=context).data)
+
+        def values_serializer():
+            return renderer.render(PackageStatusValuesSerializer(
+                list(statuses.values(*PackageStatusValuesSerializer.values)),
+                many=True, context=context).data)
+
+        if model_serializer() != values_serializer():
+            self.stderr.write('Serializers render different json')
+        results = [
+            ('PackageStatusSerializer', model_serializer),
+            ('PackageStatusValuesSerializer', values_serializer),
+        ]
+        timings = {}
+        for name, func in results:
+            timings[name] = min(timeit.repeat(func, number=1, repeat=repeat))
+            self.stdout.write('{0:<32} {1:>8.2f} ms / {2} rows'.format(
+                name, timings[name] * 1000, rows))
+        self.stdout.write('speedup {0:.1f}x'.format(
+            timings[results[0][0]] / timings[results[1][0]]))
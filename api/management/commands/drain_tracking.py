@@ -0,0 +1,73 @@
+"""
+Save statuses queued by write behind tracking posts
+"""
+
+import threading
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import connections
+
+from api.ingest import (
+    drain,
+    get_queue,
+)
+
+
+class Command(BaseCommand):
+    """
+    Drain the tracking queue with a pool of worker threads each bulk
+    creating batches of statuses, polling while the queue is empty
+    """
+    help = 'Save statuses queued by write behind tracking posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help='threads draining the queue')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='statuses bulk created per transaction')
+        parser.add_argument('--interval', type=float, default=0.2,
+                            help='seconds to wait while the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='stop once the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('Expected positive workers and batch size')
+        queue = get_queue()
+        stopping = threading.Event()
+        drained = [0] * options['workers']
+
+        def work(index):
+            while not stopping.is_set():
+                count = drain(queue, options['batch_size'])
+                drained[index] += count
+                if not count:
+                    if options['once']:
+                        return
+                    stopping.wait(options['interval'])
+
+        def worker(index):
+            try:
+                work(index)
+            finally:
+                connections.close_all()
+
+        if options['workers'] == 1:
+            work(0)
+        else:
+            threads = [threading.Thread(target=worker, args=(index,))
+                       for index in range(options['workers'])]
+            for thread in threads:
+                thread.start()
+            try:
+                for thread in threads:
+                    thread.join()
+            except KeyboardInterrupt:
+                stopping.set()
+                for thread in threads:
+                    thread.join()
+        self.stdout.write('Drained {0} statuses, {1} queued'.format(
+            sum(drained), queue.pending()))
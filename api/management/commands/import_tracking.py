@@ -0,0 +1,90 @@
+"""
+Import package tracking history from JSON or NDJSON dumps
+"""
+
+import multiprocessing
+import sys
+import time
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.db import connections
+
+from api.importing import (
+    DumpError,
+    StatusImporter,
+    read_dump,
+    read_ndjson,
+)
+
+
+class Command(BaseCommand):
+    """
+    Stream statuses from dumps into chunked bulk inserts, optionally
+    inserting chunks from a pool of worker processes
+    """
+    help = 'Import package tracking history dumps like data_initial.json'
+    readers = {'json': read_dump, 'ndjson': read_ndjson}
+    max_errors_shown = 20
+    progress_interval = 1
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', metavar='path',
+                            help='dump to import, - for standard input')
+        parser.add_argument('--format', choices=sorted(self.readers),
+                            help='defaults to ndjson for .ndjson and '
+                            '.jsonl paths, json otherwise')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='statuses inserted per transaction')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='processes inserting chunks')
+
+    def handle(self, *args, **options):
+        pool = None
+        if options['workers'] > 1:
+            # forked workers open their own connections
+            connections.close_all()
+            pool = multiprocessing.get_context('fork').Pool(
+                options['workers'])
+        importer = StatusImporter(options['chunk_size'], pool,
+                                  max_pending=options['workers'] * 2)
+        start = time.perf_counter()
+        reported = [start]
+
+        def progress(imported):
+            now = time.perf_counter()
+            if now - reported[0] >= self.progress_interval:
+                reported[0] = now
+                self.stdout.write('{0} statuses, {1:.0f} rows/s'.format(
+                    imported, imported / (now - start)))
+
+        try:
+            for path in options['paths']:
+                reader = self.readers[options['format'] or (
+                    'ndjson' if path.endswith(('.ndjson', '.jsonl'))
+                    else 'json')]
+                if path == '-':
+                    importer.run(reader(sys.stdin), progress)
+                    continue
+                with open(path, encoding='utf-8') as stream:
+                    importer.run(reader(stream), progress)
+        except (DumpError, OSError) as exc:
+            raise CommandError(exc)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        for index, description, messages in \
+                importer.errors[:self.max_errors_shown]:
+            self.stderr.write('Skipped status {0} of {1!r}: {2}'.format(
+                index, description, ' '.join(messages)))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            'Imported {0} statuses for {1} packages in {2:.1f}s '
+            '({3:.0f} rows/s), skipped {4} invalid'.format(
+                importer.imported, len(importer.packages), elapsed,
+                importer.imported / elapsed if elapsed else 0,
+                len(importer.errors)))
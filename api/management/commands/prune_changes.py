@@ -0,0 +1,39 @@
+"""
+Delete changes older than the retention window from the change log
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+from django.utils import timezone
+
+from api.models import Change
+
+
+class Command(BaseCommand):
+    """
+    Prune changes created before the retention window in chunked
+    transactions, safe to run while the api is serving
+    """
+    help = 'Delete changes older than the retention window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=settings.CHANGE_RETENTION_DAYS,
+                            help='days changes stay in the change log')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='changes deleted per transaction')
+
+    def handle(self, *args, **options):
+        if options['days'] < 0 or options['chunk_size'] < 1:
+            raise CommandError('Expected positive days and chunk size')
+        before = timezone.now() - timezone.timedelta(days=options['days'])
+        start = time.perf_counter()
+        pruned = Change.objects.prune(before, options['chunk_size'])
+        self.stdout.write(
+            'Pruned {0} changes created before {1} in {2:.1f}s'.format(
+                pruned, before.isoformat(), time.perf_counter() - start))
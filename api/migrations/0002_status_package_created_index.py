@@ -0,0 +1,21 @@
+# Generated by Django 2.0.13 on 2026-10-18 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='status',
+            options={'ordering': ('-created', '-id')},
+        ),
+        migrations.AddIndex(
+            model_name='status',
+            index=models.Index(fields=['package', '-created', '-id'], name='api_status_pkg_created_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.0.3 on 2026-10-18 14:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_latest_status(apps, schema_editor):
+    Package = apps.get_model('api', 'Package')
+    Status = apps.get_model('api', 'Status')
+    LatestStatus = apps.get_model('api', 'LatestStatus')
+    for package in Package.objects.all():
+        status = Status.objects.filter(package=package).order_by(
+            '-created', '-id').first()
+        if status is not None:
+            LatestStatus.objects.create(
+                package=package, status=status, created=status.created)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_status_package_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestStatus',
+            fields=[
+                ('package', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='latest_status', serialize=False, to='api.Package')),
+                ('created', models.DateTimeField()),
+                ('status', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.Status')),
+            ],
+        ),
+        migrations.RunPython(populate_latest_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 2.0.3 on 2026-10-18 14:25
+
+import math
+
+from django.db import migrations, models
+
+CELL_DEGREES = 0.1
+GRID_ROWS = 1800
+GRID_COLUMNS = 3600
+BATCH_SIZE = 500
+
+
+def grid_cell(latitude, longitude):
+    row = int(math.floor((float(latitude) + 90) / CELL_DEGREES))
+    column = int(math.floor((float(longitude) + 180) / CELL_DEGREES))
+    return min(max(row, 0), GRID_ROWS - 1) * GRID_COLUMNS + min(
+        max(column, 0), GRID_COLUMNS - 1)
+
+
+def populate_grid(apps, schema_editor):
+    """
+    Set grid cells of statuses in batches of one update each, then of
+    latest statuses from their statuses in one update
+    """
+    Status = apps.get_model('api', 'Status')
+    LatestStatus = apps.get_model('api', 'LatestStatus')
+    quote = schema_editor.quote_name
+    rows = Status.objects.using(schema_editor.connection.alias).order_by(
+        'id').values_list('id', 'latitude', 'longitude')
+    last = None
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            chunk = list((rows if last is None else rows.filter(
+                id__gt=last))[:BATCH_SIZE])
+            if not chunk:
+                break
+            last = chunk[-1][0]
+            params = []
+            for pk, lat, lng in chunk:
+                params += [pk, grid_cell(lat, lng)]
+            params += [pk for pk, _, _ in chunk]
+            cursor.execute(
+                'UPDATE {0} SET {1} = CASE {2} {3} END WHERE {2} IN ({4})'.format(
+                    quote(Status._meta.db_table), quote('grid'), quote('id'),
+                    ' '.join(['WHEN %s THEN %s'] * len(chunk)),
+                    ', '.join(['%s'] * len(chunk))), params)
+        cursor.execute(
+            'UPDATE {0} SET {1} = (SELECT {1} FROM {2} WHERE {2}.{3} = '
+            '{0}.{4})'.format(
+                quote(LatestStatus._meta.db_table), quote('grid'),
+                quote(Status._meta.db_table), quote('id'),
+                quote('status_id')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_lateststatus'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lateststatus',
+            name='grid',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='status',
+            name='grid',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='status',
+            index=models.Index(fields=['package', 'grid'], name='api_status_pkg_grid_idx'),
+        ),
+        migrations.RunPython(populate_grid, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.0.3 on 2026-10-18 14:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedStatus',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(editable=False)),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=8)),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('elevation', models.DecimalField(decimal_places=3, max_digits=8)),
+                ('grid', models.IntegerField(default=0, editable=False)),
+                ('package', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='archived_tracking', to='api.Package')),
+            ],
+            options={
+                'ordering': ('-created', '-id'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedstatus',
+            index=models.Index(fields=['package', '-created', '-id'], name='api_archive_pkg_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedstatus',
+            index=models.Index(fields=['package', 'grid'], name='api_archive_pkg_grid_idx'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 2.0.13 on 2026-10-18 15:16
+
+import math
+
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+COLUMNS = ('unit_x', 'unit_y', 'unit_z')
+
+
+def unit_vector(latitude, longitude):
+    lat, lng = math.radians(float(latitude)), math.radians(float(longitude))
+    return (math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng),
+            math.sin(lat))
+
+
+def populate_model(model, schema_editor):
+    """
+    Set unit vectors of rows in batches of one update each
+    """
+    quote = schema_editor.quote_name
+    rows = model.objects.using(schema_editor.connection.alias).order_by(
+        'id').values_list('id', 'latitude', 'longitude')
+    last = None
+    while True:
+        chunk = list((rows if last is None else rows.filter(id__gt=last))[
+            :BATCH_SIZE])
+        if not chunk:
+            return
+        last = chunk[-1][0]
+        vectors = [unit_vector(lat, lng) for _, lat, lng in chunk]
+        cases, params = [], []
+        for index, column in enumerate(COLUMNS):
+            cases.append('{0} = CASE {1} {2} END'.format(
+                quote(column), quote('id'),
+                ' '.join(['WHEN %s THEN %s'] * len(chunk))))
+            for (pk, _, _), vector in zip(chunk, vectors):
+                params += [pk, vector[index]]
+        params += [pk for pk, _, _ in chunk]
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('UPDATE {0} SET {1} WHERE {2} IN ({3})'.format(
+                quote(model._meta.db_table), ', '.join(cases), quote('id'),
+                ', '.join(['%s'] * len(chunk))), params)
+
+
+def populate_unit_vectors(apps, schema_editor):
+    for name in ('Status', 'ArchivedStatus'):
+        populate_model(apps.get_model('api', name), schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_archivedstatus'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedstatus',
+            name='unit_x',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='archivedstatus',
+            name='unit_y',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='archivedstatus',
+            name='unit_z',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='status',
+            name='unit_x',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='status',
+            name='unit_y',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='status',
+            name='unit_z',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_unit_vectors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.0.13 on 2026-10-18 15:23
+
+from django.db import migrations, models
+
+
+def publish_changes(apps, schema_editor):
+    """
+    Give logged changes their id as position, the tokens handed out
+    """
+    Change = apps.get_model('api', 'Change')
+    ChangeSequence = apps.get_model('api', 'ChangeSequence')
+    alias = schema_editor.connection.alias
+    Change.objects.using(alias).update(position=models.F('id'))
+    last = Change.objects.using(alias).aggregate(
+        last=models.Max('position'))['last']
+    ChangeSequence.objects.using(alias).create(pk=1, last=last or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_status_unit_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last', models.BigIntegerField(default=0)),
+                ('pruned', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='change',
+            name='position',
+            field=models.BigIntegerField(null=True, unique=True),
+        ),
+        migrations.RunPython(publish_changes, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='change',
+            name='api_change_pkg_idx',
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['package_id', 'position'], name='api_change_pkg_pos_idx'),
+        ),
+    ]
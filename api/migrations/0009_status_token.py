@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-18 15:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_change_position'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='status',
+            name='token',
+            field=models.CharField(editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -2,9 +2,29 @@
 Define api models
 """
 
-from django.db import models
+import heapq
+from itertools import islice
+
+from django.db import (
+    IntegrityError,
+    connections,
+    models,
+    router,
+    transaction,
+)
+from django.db.models import (
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+)
 from django.utils import timezone
 
+from .spatial import (
+    grid_cell,
+    unit_vector,
+)
+
 
 class Package(models.Model):
     """
@@ -22,6 +42,50 @@ class Package(models.Model):
         ordering = ('id',)
 
 
+class StatusQuerySet(models.QuerySet):
+    """
+    Queryset for package statuses
+    """
+
+    def latest_per_package(self, limit):
+        """
+        Restrict to the latest `limit` statuses of each package in one query
+        by comparing against the creation time of each package's nth status
+        """
+        cutoff = self.model._default_manager.filter(
+            package=OuterRef('package')).order_by(
+                '-created', '-id').values('created')[limit - 1:limit]
+        return self.annotate(cutoff=Subquery(cutoff)).filter(
+            Q(cutoff__isnull=True) | Q(created__gte=F('cutoff'))).order_by(
+                '-created', '-id')
+
+    def iterate_recent(self, chunk_size, oldest_first=False):
+        """
+        Iterate statuses newest first fetching chunks by seeking past the
+        (created, id) of the last row, so memory stays constant even on
+        database drivers that buffer whole result sets
+        """
+        if oldest_first:
+            queryset = self.order_by('created', 'id')
+            lookups = ('created__gt', 'id__gt')
+        else:
+            queryset = self.order_by('-created', '-id')
+            lookups = ('created__lt', 'id__lt')
+        chunk = list(queryset[:chunk_size])
+        while chunk:
+            yield from chunk
+            if len(chunk) < chunk_size:
+                break
+            last = chunk[-1]
+            if isinstance(last, dict):
+                created, pk = last['created'], last['id']
+            else:
+                created, pk = last.created, last.id
+            chunk = list(queryset.filter(
+                Q(**{lookups[0]: created}) | Q(created=created, **{
+                    lookups[1]: pk}))[:chunk_size])
+
+
 class Status(models.Model):
     """
     Status of a package
@@ -30,6 +94,11 @@ class Status(models.Model):
     .latitude = Latitude of package to 6 decimal places
     .longitude = Longitude of package to 6 decimal places
     .elevation = Vertical elevation of package in metres to 3 decimal places (millimetre)
+    .grid = Spatial grid cell containing the position
+    .unit_x, .unit_y, .unit_z = Position as a unit vector from the centre of
+                                the earth for radius queries
+    .token = Write behind queue and token the status was drained from, so
+             a batch drained twice is not saved twice, null otherwise
     """
 
     created = models.DateTimeField(editable=False, default=timezone.now)
@@ -38,10 +107,474 @@ class Status(models.Model):
     latitude = models.DecimalField(max_digits=8, decimal_places=6)
     longitude = models.DecimalField(max_digits=9, decimal_places=6)
     elevation = models.DecimalField(max_digits=8, decimal_places=3)
+    grid = models.IntegerField(editable=False, default=0)
+    unit_x = models.FloatField(editable=False, default=0)
+    unit_y = models.FloatField(editable=False, default=0)
+    unit_z = models.FloatField(editable=False, default=0)
+    token = models.CharField(
+        max_length=64, editable=False, null=True, unique=True)
+
+    objects = StatusQuerySet.as_manager()
+
+    def locate(self):
+        """
+        Place status in the grid cell of its position
+        done on save but must be called before bulk creating statuses
+        """
+        self.grid = grid_cell(self.latitude, self.longitude)
+        self.unit_x, self.unit_y, self.unit_z = unit_vector(
+            self.latitude, self.longitude)
 
     def __str__(self):
         return "{0} at lat({1}) lng({2}), {3} metres high".format(
             self.created, self.latitude, self.longitude, self.elevation)
 
     class Meta:
-        ordering = ('-created',)
+        ordering = ('-created', '-id')
+        indexes = [
+            models.Index(fields=['package', '-created', '-id'],
+                         name='api_status_pkg_created_idx'),
+            models.Index(fields=['package', 'grid'],
+                         name='api_status_pkg_grid_idx'),
+        ]
+
+
+class ArchivedStatusManager(models.Manager.from_queryset(StatusQuerySet)):
+    """
+    Manager moving statuses older than the hot window into the archive
+    """
+
+    def archive(self, before, chunk_size=5000):
+        """
+        Move statuses created before a time into the archive in chunked
+        transactions, oldest first, returns the number moved
+        Latest statuses of packages stay so their projection is kept and
+        moving is not a change of the package so nothing is logged
+        """
+        alias = router.db_for_write(Status)
+        connection = connections[alias]
+        fields = [field.attname for field in self.model._meta.concrete_fields]
+        statuses = Status.objects.using(alias).filter(
+            created__lt=before).exclude(
+                id__in=LatestStatus.objects.values('status_id')).order_by(
+                    'created', 'id')
+        sql = 'DELETE FROM {0} WHERE {1} IN ({{0}})'.format(
+            connection.ops.quote_name(Status._meta.db_table),
+            connection.ops.quote_name(Status._meta.pk.column))
+        moved = 0
+        while True:
+            with transaction.atomic(using=alias):
+                chunk = list(statuses.select_for_update().values(
+                    *fields)[:chunk_size])
+                if not chunk:
+                    return moved
+                self.using(alias).bulk_create(
+                    [self.model(**values) for values in chunk])
+                # deleted without signals, the statuses still exist
+                with connection.cursor() as cursor:
+                    cursor.execute(sql.format(', '.join(
+                        ['%s'] * len(chunk))), [
+                            values['id'] for values in chunk])
+            moved += len(chunk)
+
+
+class ArchivedStatus(models.Model):
+    """
+    Status of a package moved out of the hot status table once older than
+    the hot window
+    .id = Id of the status before it was archived
+    Other fields are those of the status but its write behind token
+    """
+
+    id = models.IntegerField(primary_key=True)
+    created = models.DateTimeField(editable=False)
+    package = models.ForeignKey(
+        Package, on_delete=models.PROTECT, related_name="archived_tracking")
+    latitude = models.DecimalField(max_digits=8, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    elevation = models.DecimalField(max_digits=8, decimal_places=3)
+    grid = models.IntegerField(editable=False, default=0)
+    unit_x = models.FloatField(editable=False, default=0)
+    unit_y = models.FloatField(editable=False, default=0)
+    unit_z = models.FloatField(editable=False, default=0)
+
+    objects = ArchivedStatusManager()
+
+    def __str__(self):
+        return Status.__str__(self)
+
+    class Meta:
+        ordering = ('-created', '-id')
+        indexes = [
+            models.Index(fields=['package', '-created', '-id'],
+                         name='api_archive_pkg_created_idx'),
+            models.Index(fields=['package', 'grid'],
+                         name='api_archive_pkg_grid_idx'),
+        ]
+
+
+class TieredStatuses:
+    """
+    Statuses read from both the hot and archive tiers in order
+    Supports the queryset methods tracking reads use, each applied to
+    both tiers with rows merged by their ordering so an index is used
+    on either table and no more rows are fetched than a slice needs
+    Slices past seek_offset bisect for where the slice starts in each
+    tier instead of fetching every row before it
+    """
+    seek_offset = 1000
+
+    def __init__(self, hot, archived, ordering=('-created', '-id')):
+        self.hot = hot
+        self.archived = archived
+        self.ordering = ordering
+
+    @classmethod
+    def of_package(cls, package_id, *fields, since=None):
+        """
+        Values of fields of statuses of a package, only merged with the
+        archive when it has statuses of the package created since a time
+        """
+        hot = Status.objects.filter(package=package_id).values(*fields)
+        archived = ArchivedStatus.objects.filter(package=package_id)
+        if not (archived if since is None else archived.filter(
+                created__gte=since)).exists():
+            return hot
+        return cls(hot, archived.values(*fields))
+
+    def filter(self, *args, **kwargs):
+        return TieredStatuses(self.hot.filter(*args, **kwargs),
+                              self.archived.filter(*args, **kwargs),
+                              self.ordering)
+
+    def order_by(self, *ordering):
+        return TieredStatuses(self.hot.order_by(*ordering),
+                              self.archived.order_by(*ordering),
+                              ordering or self.ordering)
+
+    def count(self):
+        return self.hot.count() + self.archived.count()
+
+    @staticmethod
+    def sort_key(ordering):
+        """
+        Get key of rows by the ordering
+        ordering fields must all be ascending or all descending
+        """
+        names = [name.lstrip('-') for name in ordering]
+
+        def key(row):
+            if isinstance(row, dict):
+                return tuple(row[name] for name in names)
+            return tuple(getattr(row, name) for name in names)
+
+        return key
+
+    def merge(self, hot, archived, ordering=None):
+        """
+        Merge rows of both tiers each sorted by the ordering
+        """
+        ordering = ordering or self.ordering
+        return heapq.merge(hot, archived, key=self.sort_key(ordering),
+                           reverse=ordering[0].startswith('-'))
+
+    def split(self, hot, archived, start):
+        """
+        Get number of hot rows among the first start rows merged
+        bisecting with single row reads of each ordered tier
+        """
+        key = self.sort_key(self.ordering)
+        reverse = self.ordering[0].startswith('-')
+
+        def row(rows, index):
+            return next(iter(rows[index:index + 1]), None)
+
+        low, high = 0, start
+        while low < high:
+            middle = (low + high) // 2
+            hot_row = row(hot, middle)
+            archived_row = row(archived, start - middle - 1)
+            # hot row before the last archived row taken, take more hot
+            if hot_row is not None and (archived_row is None or (
+                    key(hot_row) > key(archived_row) if reverse
+                    else key(hot_row) < key(archived_row))):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __iter__(self):
+        return self.merge(self.hot.order_by(*self.ordering),
+                          self.archived.order_by(*self.ordering))
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return list(self[key:key + 1])[0]
+        start, stop = key.start or 0, key.stop
+        if stop is None:
+            return list(islice(self, start, None))
+        hot = self.hot.order_by(*self.ordering)
+        archived = self.archived.order_by(*self.ordering)
+        if self.seek_offset < start < stop:
+            hot_start = self.split(hot, archived, start)
+            hot, archived = hot[hot_start:], archived[start - hot_start:]
+            start, stop = 0, stop - start
+        return list(islice(self.merge(hot[:stop], archived[:stop]),
+                           start, stop))
+
+    def iterate_recent(self, chunk_size, oldest_first=False):
+        """
+        Iterate statuses of both tiers seeking through each in chunks
+        """
+        return self.merge(
+            self.hot.iterate_recent(chunk_size, oldest_first),
+            self.archived.iterate_recent(chunk_size, oldest_first),
+            ('created', 'id') if oldest_first else ('-created', '-id'))
+
+
+class LatestStatusManager(models.Manager):
+    """
+    Manager keeping latest status projection in sync with statuses
+    """
+
+    def track(self, status):
+        """
+        Make status the latest of its package if it is the most recent
+        """
+        newer = Q(created__lt=status.created) | Q(
+            created=status.created, status_id__lt=status.id)
+        latest = self.filter(package_id=status.package_id)
+        values = {'status': status, 'created': status.created,
+                  'grid': status.grid}
+        if latest.filter(newer).update(**values):
+            return
+        try:
+            with transaction.atomic():
+                self.create(package_id=status.package_id, **values)
+        except IntegrityError:
+            # projection created concurrently so compare against it
+            latest.filter(newer).update(**values)
+
+    def refresh(self, package_ids):
+        """
+        Recompute latest status of packages from their statuses
+        """
+        package_ids = set(package_ids)
+        latest = {}
+        for status in Status.objects.filter(
+                package_id__in=package_ids).latest_per_package(1):
+            latest.setdefault(status.package_id, status)
+        with transaction.atomic():
+            self.filter(package_id__in=package_ids).delete()
+            self.bulk_create([
+                self.model(package_id=package_id, status=status,
+                           created=status.created, grid=status.grid)
+                for package_id, status in latest.items()
+            ])
+
+
+class LatestStatus(models.Model):
+    """
+    Latest status of a package, updated as statuses are created or deleted
+    .package = Package the status belongs to (package_id)
+    .status = Most recent status of the package (status_id)
+    .created = Server time of the most recent status
+    .grid = Spatial grid cell of the most recent status
+    """
+
+    package = models.OneToOneField(
+        Package, on_delete=models.CASCADE, primary_key=True,
+        related_name='latest_status')
+    status = models.OneToOneField(
+        Status, on_delete=models.CASCADE, related_name='+')
+    created = models.DateTimeField()
+    grid = models.IntegerField(db_index=True, default=0)
+
+    objects = LatestStatusManager()
+
+    def __str__(self):
+        return str(self.status)
+
+
+class ChangeManager(models.Manager):
+    """
+    Manager recording changes of packages and statuses
+    """
+    publish_size = 1000
+
+    def record(self, instance, action):
+        """
+        Log change of a package or status instance
+        written in the transaction of the change so rolled back
+        changes are never logged, published once it commits
+        """
+        change = self.create(
+            model=instance._meta.model_name, object_id=instance.pk,
+            package_id=instance.pk if isinstance(instance, Package)
+            else instance.package_id, action=action)
+        transaction.on_commit(self.publish)
+        return change
+
+    def record_bulk_created(self, package_ids):
+        """
+        Log statuses bulk created for packages
+        bulk inserts do not return ids so one change is logged per package
+        """
+        self.bulk_create([
+            self.model(model=Status._meta.model_name, object_id=None,
+                       package_id=package_id, action=Change.CREATE)
+            for package_id in sorted(set(package_ids))
+        ])
+        transaction.on_commit(self.publish)
+
+    def record_created(self, statuses):
+        """
+        Log statuses bulk created with their ids
+        """
+        self.bulk_create([
+            self.model(model=Status._meta.model_name, object_id=instance.pk,
+                       package_id=instance.package_id, action=Change.CREATE)
+            for instance in statuses
+        ])
+        transaction.on_commit(self.publish)
+
+    def publish(self):
+        """
+        Give committed changes without a position the next positions of
+        the log, returns the last position
+        Ids are taken at insert so transactions commit out of id order,
+        positions are given under the sequence lock to committed changes
+        only so a change never appears before a position already read
+        """
+        alias = router.db_for_write(Change)
+        pending = self.using(alias).filter(position__isnull=True)
+        while True:
+            with transaction.atomic(using=alias):
+                sequence = ChangeSequence.objects.using(
+                    alias).select_for_update().get_or_create(pk=1)[0]
+                ids = list(pending.select_for_update().order_by(
+                    'id').values_list('id', flat=True)[:self.publish_size])
+                if not ids:
+                    return sequence.last
+                # keeps id order within the batch, after the last position
+                offset = sequence.last - ids[0] + 1
+                pending.filter(id__in=ids).update(position=F('id') + offset)
+                sequence.last = ids[-1] + offset
+                sequence.save(update_fields=['last'])
+            if len(ids) < self.publish_size:
+                return sequence.last
+
+    def prune(self, before, chunk_size=5000):
+        """
+        Delete published changes created before a time in chunked
+        transactions, oldest first, returns the number deleted
+        The last pruned position is kept so older tokens are refused
+        """
+        alias = router.db_for_write(Change)
+        self.publish()
+        changes = self.using(alias).filter(
+            created__lt=before, position__isnull=False).order_by('position')
+        pruned = 0
+        while True:
+            with transaction.atomic(using=alias):
+                chunk = list(changes.select_for_update().values_list(
+                    'id', 'position')[:chunk_size])
+                if not chunk:
+                    return pruned
+                ChangeSequence.objects.using(alias).filter(pk=1).update(
+                    pruned=chunk[-1][1])
+                self.using(alias).filter(
+                    id__in=[change_id for change_id, _ in chunk]).delete()
+            pruned += len(chunk)
+
+
+class ChangeSequence(models.Model):
+    """
+    Single row counter of the change log positions
+    .last = Last position given to a committed change
+    .pruned = Last position of the changes pruned from the log
+    """
+
+    last = models.BigIntegerField(default=0)
+    pruned = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return "{0} pruned {1}".format(self.last, self.pruned)
+
+
+class Change(models.Model):
+    """
+    Entry in the monotonic log of package and status changes
+    .id = Id of the change, in insert order
+    .position = Position of the change in the log in commit order, used
+                as the feed token, null until published
+    .model = Name of the changed model, package or status
+    .object_id = Id of the changed package or status, null for statuses
+                 bulk created for the package
+    .package_id = Id of the package changed, kept after it is deleted
+    .action = Kind of change, create, update or delete
+    .created = Server time of the change
+    """
+
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    ACTIONS = ((CREATE, 'Create'), (UPDATE, 'Update'), (DELETE, 'Delete'))
+
+    position = models.BigIntegerField(null=True, unique=True)
+    model = models.CharField(max_length=16)
+    object_id = models.IntegerField(null=True)
+    package_id = models.IntegerField()
+    action = models.CharField(max_length=6, choices=ACTIONS)
+    created = models.DateTimeField(editable=False, default=timezone.now)
+
+    objects = ChangeManager()
+
+    def __str__(self):
+        return "{0} {1} {2}".format(self.action, self.model, self.object_id)
+
+    class Meta:
+        ordering = ('id',)
+        indexes = [
+            models.Index(fields=['package_id', 'position'],
+                         name='api_change_pkg_pos_idx'),
+        ]
+
+
+class HeartbeatManager(models.Manager):
+    """
+    Manager beating the heartbeat on the primary
+    """
+
+    def beat(self):
+        """
+        Count a beat at the current time, returns the heartbeat
+        written in its own transaction so replicas receive it in commit
+        order after every write committed before it
+        """
+        alias = router.db_for_write(self.model)
+        now = timezone.now()
+        with transaction.atomic(using=alias):
+            heartbeat, _ = self.using(alias).select_for_update().get_or_create(
+                pk=1)
+            heartbeat.beat += 1
+            heartbeat.created = now
+            heartbeat.save(using=alias)
+        return heartbeat
+
+
+class Heartbeat(models.Model):
+    """
+    Single row beaten on the primary, a replica is as old as the last
+    beat it received whatever else was written
+    .beat = Number of the last beat
+    .created = Server time of the last beat
+    """
+
+    beat = models.BigIntegerField(default=0)
+    created = models.DateTimeField(default=timezone.now)
+
+    objects = HeartbeatManager()
+
+    def __str__(self):
+        return "{0} at {1}".format(self.beat, self.created)
@@ -0,0 +1,215 @@
+"""
+Define the packed columnar encoding of statuses
+A page of statuses is encoded as
+
+    magic    b'TRK\\x01'
+    columns  byte of flags for the optional id, package and created columns
+    count    varint of total count + 1, 0 when not known
+    next     string link, varint of utf-8 length + 1 then bytes, 0 for null
+    previous string link
+    rows     varint of number of rows
+    then for each column present, in the order id, package, created,
+    latitude, longitude, elevation, the zigzag varint of the difference
+    of each row's value from the row before it (the first from zero)
+
+created is in microseconds since the epoch and coordinates are integers
+scaled by the decimal places of the model fields, so sorted ids and
+times and nearby positions mostly encode in one or two bytes each.
+"""
+
+from datetime import (
+    datetime,
+    timedelta,
+)
+from decimal import Decimal
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Status
+
+MAGIC = b'TRK\x01'
+HAS_ID = 1
+HAS_PACKAGE = 2
+HAS_CREATED = 4
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# (name, flag, fixed point places) in encoded order
+COLUMNS = (
+    ('id', HAS_ID, None),
+    ('package', HAS_PACKAGE, None),
+    ('created', HAS_CREATED, None),
+    ('latitude', 0, Status._meta.get_field('latitude').decimal_places),
+    ('longitude', 0, Status._meta.get_field('longitude').decimal_places),
+    ('elevation', 0, Status._meta.get_field('elevation').decimal_places),
+)
+
+
+class PackingError(ValueError):
+    """
+    Data can not be packed or unpacked
+    """
+
+
+def write_varint(buffer, value):
+    """
+    Append unsigned integer in 7 bit groups, low group first
+    """
+    while value > 0x7f:
+        buffer.append(value & 0x7f | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data, offset):
+    """
+    Read unsigned integer at offset, returns (value, next offset)
+    """
+    value = shift = 0
+    while True:
+        try:
+            byte = data[offset]
+        except IndexError:
+            raise PackingError('Truncated packed data')
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def write_string(buffer, value):
+    """
+    Append nullable utf-8 string
+    """
+    if value is None:
+        write_varint(buffer, 0)
+        return
+    encoded = value.encode('utf-8')
+    write_varint(buffer, len(encoded) + 1)
+    buffer.extend(encoded)
+
+
+def read_string(data, offset):
+    """
+    Read nullable utf-8 string at offset, returns (value, next offset)
+    """
+    length, offset = read_varint(data, offset)
+    if not length:
+        return None, offset
+    end = offset + length - 1
+    if end > len(data):
+        raise PackingError('Truncated packed data')
+    return bytes(data[offset:end]).decode('utf-8'), end
+
+
+def to_fixed(value, places):
+    """
+    Scale decimal or number to an integer with the decimal places
+    """
+    if isinstance(value, Decimal):
+        return int(value.scaleb(places).to_integral_value())
+    return int(round(float(value) * 10 ** places))
+
+
+def to_micros(value):
+    """
+    Microseconds since the epoch of a datetime or ISO 8601 string
+    """
+    if isinstance(value, str):
+        if len(value) in (20, 27) and value[-1] == 'Z' and value[10] == 'T':
+            # fast path for the utc times serializers render
+            try:
+                value = datetime(
+                    int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                    int(value[11:13]), int(value[14:16]), int(value[17:19]),
+                    int(value[20:26]) if len(value) == 27 else 0,
+                    timezone.utc)
+            except ValueError:
+                value = parse_datetime(value)
+        else:
+            value = parse_datetime(value)
+    if value is None:
+        raise PackingError('Invalid created time')
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + \
+        delta.microseconds
+
+
+def pack(rows, count=None, next_link=None, previous_link=None):
+    """
+    Encode status rows with optional page links
+    """
+    rows = list(rows)
+    first = rows[0] if rows else {}
+    flags = 0
+    for name, flag, _ in COLUMNS:
+        if not flag or first.get(name) is None:
+            continue
+        # package hyperlinks are left out, only ids are packed
+        if name != 'package' or isinstance(first[name], int):
+            flags |= flag
+    buffer = bytearray(MAGIC)
+    buffer.append(flags)
+    write_varint(buffer, 0 if count is None else count + 1)
+    write_string(buffer, next_link)
+    write_string(buffer, previous_link)
+    write_varint(buffer, len(rows))
+    try:
+        for name, flag, places in COLUMNS:
+            if flag and not flags & flag:
+                continue
+            if name == 'created':
+                values = [to_micros(row[name]) for row in rows]
+            elif places is None:
+                values = [int(row[name]) for row in rows]
+            else:
+                values = [to_fixed(row[name], places) for row in rows]
+            previous = 0
+            for value in values:
+                delta = value - previous
+                previous = value
+                write_varint(buffer, delta << 1 if delta >= 0
+                             else (-delta << 1) - 1)
+    except (KeyError, TypeError, ValueError) as exc:
+        raise PackingError('Can not pack statuses - {0}'.format(exc))
+    return bytes(buffer)
+
+
+def unpack(data):
+    """
+    Decode packed statuses, returns (rows, count, next, previous)
+    with decimal coordinates and aware created datetimes
+    """
+    data = memoryview(data)
+    if bytes(data[:len(MAGIC)]) != MAGIC:
+        raise PackingError('Not packed statuses')
+    try:
+        flags = data[len(MAGIC)]
+    except IndexError:
+        raise PackingError('Truncated packed data')
+    count, offset = read_varint(data, len(MAGIC) + 1)
+    next_link, offset = read_string(data, offset)
+    previous_link, offset = read_string(data, offset)
+    size, offset = read_varint(data, offset)
+    # every row takes at least a byte for each coordinate
+    if size * 3 > len(data) - offset:
+        raise PackingError('Truncated packed data')
+    rows = [{} for _ in range(size)]
+    for name, flag, places in COLUMNS:
+        if flag and not flags & flag:
+            continue
+        value = 0
+        for row in rows:
+            delta, offset = read_varint(data, offset)
+            value += -(delta >> 1) - 1 if delta & 1 else delta >> 1
+            if name == 'created':
+                row[name] = EPOCH + timedelta(microseconds=value)
+            elif places is None:
+                row[name] = value
+            else:
+                row[name] = Decimal(value).scaleb(-places)
+    if offset != len(data):
+        raise PackingError('Trailing bytes after packed data')
+    return rows, (count - 1 if count else None), next_link, previous_link
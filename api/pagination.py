@@ -0,0 +1,232 @@
+"""
+Define api pagination styles
+"""
+
+from base64 import (
+    b64decode,
+    b64encode,
+)
+from collections import OrderedDict
+from urllib import parse
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.exceptions import (
+    APIException,
+    NotFound,
+    ValidationError,
+)
+from rest_framework.pagination import (
+    BasePagination,
+    _positive_int,
+)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import (
+    remove_query_param,
+    replace_query_param,
+)
+
+from .models import ChangeSequence
+
+
+class StatusCursorPagination(BasePagination):
+    """
+    Keyset pagination over statuses ordered by recency
+    Pages are fetched by seeking past the (created, id) of the last row seen
+    so deep pages cost the same as the first and no total count is made.
+    The previous link returns statuses newer than the first row of the page,
+    which polling clients can follow to fetch only new statuses.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.cursor = self.decode_cursor(request)
+
+        if self.cursor is None:
+            self.reverse = False
+            queryset = queryset.order_by('-created', '-id')
+        else:
+            created, pk, self.reverse = self.cursor
+            if self.reverse:
+                queryset = queryset.filter(
+                    Q(created__gt=created) | Q(created=created, id__gt=pk))
+                queryset = queryset.order_by('created', 'id')
+            else:
+                queryset = queryset.filter(
+                    Q(created__lt=created) | Q(created=created, id__lt=pk))
+                queryset = queryset.order_by('-created', '-id')
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_following = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+        return self.page
+
+    def get_page_size(self, request):
+        """
+        Get page size from request limited by the max page size
+        """
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_next_link(self):
+        """
+        Link to statuses older than the last on this page
+        """
+        if self.page and (self.has_following or self.reverse):
+            return self.encode_cursor(*self.get_position(self.page[-1]), False)
+        if not self.page and self.reverse:
+            return self.encode_cursor(self.cursor[0], self.cursor[1], False)
+        return None
+
+    def get_previous_link(self):
+        """
+        Link to statuses newer than the first on this page
+        """
+        if self.page:
+            return self.encode_cursor(*self.get_position(self.page[0]), True)
+        if self.cursor is not None:
+            return self.encode_cursor(self.cursor[0], self.cursor[1], True)
+        return None
+
+    @staticmethod
+    def get_position(item):
+        """
+        Get (created, id) of a status or status values
+        """
+        if isinstance(item, dict):
+            return (item['created'], item['id'])
+        return (item.created, item.id)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def decode_cursor(self, request):
+        """
+        Given a request with a cursor, return a (created, id, reverse) tuple
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            created = parse_datetime(tokens['c'][0])
+            pk = int(tokens['i'][0])
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if created is None:
+            raise NotFound(self.invalid_cursor_message)
+        return (created, pk, reverse)
+
+    def encode_cursor(self, created, pk, reverse):
+        """
+        Given a status position, return a url with an encoded cursor
+        """
+        tokens = OrderedDict([('c', created.isoformat()), ('i', pk)])
+        if reverse:
+            tokens['r'] = '1'
+        querystring = parse.urlencode(tokens, doseq=True)
+        encoded = b64encode(querystring.encode('ascii')).decode('ascii')
+        url = remove_query_param(self.base_url, self.cursor_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+
+class ChangesPruned(APIException):
+    """
+    Error for change tokens older than the changes kept in the log
+    """
+    status_code = status.HTTP_410_GONE
+    default_detail = ('Changes after this token were pruned, '
+                      'reload and poll from a new token.')
+    default_code = 'changes_pruned'
+
+
+class ChangeFeedPagination(BasePagination):
+    """
+    Pagination of the change log by the position of the last change seen
+    Every page links to the changes after it, so polling clients follow
+    the link and only receive changes committed since their last poll.
+    """
+    after_query_param = 'after'
+    page_size_query_param = 'limit'
+    page_size = 100
+    max_page_size = 1000
+    invalid_after_message = 'Invalid change token'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.after = self.decode_after(request)
+        results = list(queryset.filter(
+            position__gt=self.after).order_by('position')[:self.page_size + 1])
+        self.has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.page:
+            self.after = self.page[-1].position
+        return self.page
+
+    def get_page_size(self, request):
+        """
+        Get page size from request limited by the max page size
+        """
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def decode_after(self, request):
+        """
+        Get position of the last change seen by the client
+        refused once changes after it were pruned
+        """
+        if self.after_query_param not in request.query_params:
+            return 0
+        try:
+            after = _positive_int(request.query_params[self.after_query_param])
+        except ValueError:
+            raise ValidationError({
+                self.after_query_param: [self.invalid_after_message]})
+        if ChangeSequence.objects.filter(pruned__gt=after).exists():
+            raise ChangesPruned()
+        return after
+
+    def get_next_link(self):
+        """
+        Link to changes after the last on this page
+        """
+        return replace_query_param(
+            self.base_url, self.after_query_param, self.after)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('after', self.after),
+            ('more', self.has_more),
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
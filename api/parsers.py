@@ -0,0 +1,50 @@
+"""
+Define api request parsers
+"""
+
+import codecs
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from .packing import (
+    PackingError,
+    unpack,
+)
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline delimited JSON into a list of objects
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        items = []
+        try:
+            for number, line in enumerate(
+                    codecs.getreader(encoding)(stream), start=1):
+                if line.strip():
+                    items.append(json.loads(line))
+        except ValueError as exc:
+            raise ParseError(
+                'NDJSON parse error on line {0} - {1}'.format(number, exc))
+        return items
+
+
+class PackedStatusParser(BaseParser):
+    """
+    Parses statuses in the packed columnar encoding into a list of objects
+    """
+    media_type = 'application/vnd.trackex.packed'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            rows, _, _, _ = unpack(stream.read())
+        except PackingError as exc:
+            raise ParseError('Packed parse error - {0}'.format(exc))
+        return rows
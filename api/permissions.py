@@ -0,0 +1,106 @@
+"""
+Define api permission checks
+Resolved permissions of each user are cached so authenticated writes do
+not query user and group permissions on every request. Cached sets are
+keyed by a version bumped when group or permission assignments change.
+Only a cache shared by the workers is used, as a revoked permission would
+still be granted from the per process caches of the other workers.
+Superusers are granted every permission so their sets are not cached.
+"""
+
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.permissions import DjangoModelPermissionsOrAnonReadOnly
+
+from .cache import (
+    get_version,
+    is_shared,
+    new_version,
+    version_key,
+)
+
+ALL_USERS = 'permissions'
+
+
+def permissions_key(user_id):
+    """
+    Cache key of the resolved permissions of a user
+    """
+    return 'api:permissions:{0}:{1}'.format(
+        user_id, get_version(ALL_USERS))
+
+
+def get_permissions(user, backend=None):
+    """
+    Get set of 'app_label.codename' permissions of an active user
+    resolved by the model backend on a cache miss, or on every request
+    when the cache is not shared or the user is a superuser
+    """
+    if not hasattr(user, '_perm_cache'):
+        shared = is_shared() and not user.is_superuser
+        permissions = cache.get(permissions_key(user.pk)) if shared else None
+        if permissions is None:
+            backend = backend or ModelBackend()
+            permissions = {
+                *backend.get_user_permissions(user),
+                *backend.get_group_permissions(user),
+            }
+            if shared:
+                cache.set(permissions_key(user.pk), permissions)
+        user._perm_cache = permissions
+    return user._perm_cache
+
+
+def drop_permissions(user_ids):
+    """
+    Drop cached permissions of users, of all users when None
+    """
+    if user_ids is None:
+        try:
+            cache.incr(version_key(ALL_USERS))
+        except ValueError:
+            cache.set(version_key(ALL_USERS), new_version(), None)
+    else:
+        cache.delete_many([permissions_key(user_id) for user_id in user_ids])
+
+
+def invalidate_permissions(user_ids=None):
+    """
+    Invalidate cached permissions of users, of all users when None
+    again on commit so no request caches assignments from before it
+    """
+    user_ids = None if user_ids is None else set(user_ids)
+    drop_permissions(user_ids)
+    transaction.on_commit(lambda: drop_permissions(user_ids))
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    Model backend reading each user's permissions from the cache
+    """
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or \
+                obj is not None:
+            return set()
+        return get_permissions(user_obj, self)
+
+
+class CachedModelPermissionsOrAnonReadOnly(
+        DjangoModelPermissionsOrAnonReadOnly):
+    """
+    Model permissions checked against the cached permissions of the user
+    instead of asking every authentication backend for each permission
+    """
+
+    def has_permission(self, request, view):
+        user = request.user
+        if getattr(view, '_ignore_model_permissions', False) or \
+                not (user and user.is_authenticated) or \
+                not user.is_active or user.is_superuser:
+            return super().has_permission(request, view)
+        queryset = self._queryset(view)
+        required = self.get_required_permissions(
+            request.method, queryset.model)
+        return set(required) <= get_permissions(user)
@@ -0,0 +1,159 @@
+"""
+Define api response renderers
+Each renderer can also stream rows for exports
+"""
+
+import csv
+import json
+
+from rest_framework.renderers import (
+    BaseRenderer,
+    JSONRenderer,
+)
+from rest_framework.utils.encoders import JSONEncoder
+
+from .packing import (
+    PackingError,
+    pack,
+)
+
+
+class Echo:
+    """
+    File like object returning what is written to it
+    """
+
+    def write(self, value):
+        """
+        Return value instead of buffering it
+        """
+        return value
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renders rows as newline delimited JSON
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(self.stream(rows)).encode(self.charset)
+
+    def stream(self, rows):
+        """
+        Generate a line for each row
+        """
+        for row in rows:
+            yield json.dumps(row, cls=JSONEncoder, ensure_ascii=False,
+                             separators=(',', ':')) + '\n'
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    Renders rows as comma separated values with a header
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(self.stream(rows)).encode(self.charset)
+
+    def stream(self, rows):
+        """
+        Generate a header from the first row then a line for each row
+        """
+        writer = csv.writer(Echo())
+        header = None
+        for row in rows:
+            if header is None:
+                header = list(row)
+                yield writer.writerow(header)
+            yield writer.writerow([row.get(key) for key in header])
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Renders server sent events, rows are (id, event, data) tuples
+    and None rows are keep alive comments
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # only error responses are rendered whole
+        return ''.join(self.stream([(None, 'error', data)])).encode(
+            self.charset)
+
+    @staticmethod
+    def message(row):
+        """
+        Event message of a row
+        """
+        if row is None:
+            return ':\n\n'
+        event_id, event, data = row
+        lines = []
+        if event_id is not None:
+            lines.append('id: {0}'.format(event_id))
+        lines.append('event: {0}'.format(event))
+        lines.append('data: {0}'.format(json.dumps(
+            data, cls=JSONEncoder, ensure_ascii=False,
+            separators=(',', ':'))))
+        return '\n'.join(lines) + '\n\n'
+
+    def stream(self, rows):
+        """
+        Generate an event message for each row
+        closing the rows with the messages so their cleanup runs
+        """
+        try:
+            for row in rows:
+                yield self.message(row)
+        finally:
+            if hasattr(rows, 'close'):
+                rows.close()
+
+    async def stream_async(self, rows):
+        """
+        Generate encoded event messages of rows read on an event loop
+        closing the rows with the messages
+        """
+        try:
+            async for row in rows:
+                yield self.message(row).encode(self.charset)
+        finally:
+            await rows.aclose()
+
+
+class PackedStatusRenderer(BaseRenderer):
+    """
+    Renders a status or page of statuses in the packed columnar encoding
+    hyperlinks are left out as they can be built from the ids, and
+    responses that are not statuses such as errors are rendered as JSON
+    """
+    media_type = 'application/vnd.trackex.packed'
+    format = 'packed'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        response = renderer_context.get('response')
+        try:
+            if response is not None and response.exception:
+                raise PackingError('Error response')
+            if isinstance(data, dict) and 'results' in data:
+                return pack(data['results'], data.get('count'),
+                            data.get('next'), data.get('previous'))
+            return pack([data])
+        except PackingError:
+            renderer = JSONRenderer()
+            if response is not None:
+                response['Content-Type'] = renderer.media_type
+            return renderer.render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,165 @@
+"""
+Define database routing to read replicas
+Safe requests of api read actions are served from a replica that is not
+lagging too far behind the primary. Writes, and reads of a client soon
+after its own writes, stay on the primary database.
+Lag is measured by a heartbeat row on the primary and clients are marked
+as recent writers by a signed cookie, so any worker sees both.
+"""
+
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.signing import BadSignature
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    DatabaseError,
+    connections,
+)
+from django.utils import timezone
+
+from .models import Heartbeat
+
+_local = threading.local()
+
+
+def get_read_alias():
+    """
+    Replica reads of this thread are routed to, None for the primary
+    """
+    return getattr(_local, 'alias', None)
+
+
+def set_read_alias(alias):
+    """
+    Route reads of this thread to a replica, to the primary when None
+    """
+    _local.alias = alias
+
+
+def replica_epoch():
+    """
+    Period of DB_REPLICA_MAX_LAG seconds, responses read from replicas
+    are only cached and tagged for their period so staleness is bounded
+    """
+    return int(time.time() // max(settings.DB_REPLICA_MAX_LAG, 1))
+
+
+class LagMonitor:
+    """
+    Seconds each replica is behind the primary, none when it has the last
+    heartbeat or the age of its heartbeat, None while unreachable
+    Each measurement beats the heartbeat again, so beats are at most
+    DB_REPLICA_CHECK_INTERVAL seconds apart while requests are served
+    Lag is measured at most every DB_REPLICA_CHECK_INTERVAL seconds by
+    the request finding it expired, others use the last measurement
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Drop all measurements
+        """
+        self.checked = {}
+        self.lags = {}
+
+    @staticmethod
+    def measure(alias):
+        """
+        Query lag of a replica, None before it received a heartbeat
+        """
+        last = Heartbeat.objects.using(DEFAULT_DB_ALIAS).values_list(
+            'beat', flat=True).first()
+        replicated = Heartbeat.objects.using(alias).values_list(
+            'beat', 'created').first()
+        Heartbeat.objects.beat()
+        if replicated is None:
+            return None
+        beat, created = replicated
+        if beat >= last:
+            return 0
+        return max((timezone.now() - created).total_seconds(), 0)
+
+    def lag(self, alias):
+        """
+        Get last measured lag of a replica, measuring it when expired
+        """
+        now = time.monotonic()
+        checked = self.checked.get(alias)
+        if (checked is None or
+                now - checked >= settings.DB_REPLICA_CHECK_INTERVAL) and \
+                self.lock.acquire(blocking=False):
+            try:
+                try:
+                    self.lags[alias] = self.measure(alias)
+                except DatabaseError:
+                    self.lags[alias] = None
+                    connections[alias].close()
+                self.checked[alias] = now
+            finally:
+                self.lock.release()
+        return self.lags.get(alias)
+
+
+MONITOR = LagMonitor()
+
+
+def choose_replica():
+    """
+    Get a random replica within the allowed lag, None when all lag
+    """
+    replicas = []
+    for alias in settings.DATABASE_REPLICAS:
+        lag = MONITOR.lag(alias)
+        if lag is not None and lag <= settings.DB_REPLICA_MAX_LAG:
+            replicas.append(alias)
+    return random.choice(replicas) if replicas else None
+
+
+STICKY_COOKIE = 'primary'
+
+
+def stick_to_primary(response, user_id):
+    """
+    Read from the primary for the client of a user for DB_REPLICA_STICKY
+    seconds, marked in a cookie signed for the user
+    """
+    response.set_signed_cookie(
+        STICKY_COOKIE, user_id, salt='api.routers',
+        max_age=settings.DB_REPLICA_STICKY, httponly=True)
+
+
+def is_sticky(request, user_id):
+    """
+    Check if the client of a user wrote recently
+    """
+    try:
+        return request.get_signed_cookie(
+            STICKY_COOKIE, salt='api.routers',
+            max_age=settings.DB_REPLICA_STICKY) == str(user_id)
+    except (KeyError, BadSignature):
+        return False
+
+
+class ReplicaRouter:
+    """
+    Route reads to the replica chosen for the thread and all writes to
+    the primary, objects of any database may relate as they are copies
+    """
+
+    def db_for_read(self, model, **hints):
+        return get_read_alias()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
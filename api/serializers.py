@@ -2,8 +2,16 @@
 Define api model serializers
 """
 
+import decimal
+import heapq
+from collections import OrderedDict
+from itertools import islice
+
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from .models import (
+    Change,
     Package,
     Status,
 )
@@ -37,15 +45,131 @@ class PackageStatusSerializer(StatusSerializer):
         return ret
 
 
+class ChangeSerializer(serializers.ModelSerializer):
+    """
+    Serializer for entries of the change log
+    """
+    package = serializers.IntegerField(source='package_id', read_only=True)
+
+    class Meta:
+        model = Change
+        fields = ('id', 'position', 'model', 'object_id', 'package', 'action',
+                  'created')
+
+
+class StatusValuesSerializer(serializers.BaseSerializer):
+    """
+    Read only serializer for status rows from `.values(*values)`
+    Renders the same as StatusSerializer without per row field machinery
+    hyperlinks are built from url templates resolved once per serializer
+    """
+    values = ('id', 'package_id', 'latitude',
+              'longitude', 'elevation', 'created')
+    include_package = True
+
+    def url_template(self, view_name):
+        """
+        Resolve detail url once with a placeholder for the pk
+        """
+        url = reverse(view_name, kwargs={'pk': 0},
+                      request=self.context.get('request'))
+        index = url.rindex('0')
+        return url[:index] + '{0}' + url[index + 1:]
+
+    def prepare(self):
+        """
+        Precompute everything shared by all rows
+        """
+        context = decimal.getcontext().copy()
+        self.quantizers = []
+        for name in ('latitude', 'longitude', 'elevation'):
+            field = Status._meta.get_field(name)
+            field_context = context.copy()
+            field_context.prec = field.max_digits
+            self.quantizers.append((
+                name, decimal.Decimal('.1') ** field.decimal_places,
+                field_context))
+        self.timezone = timezone.get_current_timezone()
+        self.status_url = self.url_template('status-detail')
+        self.package_url = self.url_template('package-detail')
+
+    def to_representation(self, instance):
+        if not hasattr(self, 'quantizers'):
+            self.prepare()
+        ret = OrderedDict()
+        ret['id'] = instance['id']
+        if self.include_package:
+            ret['package'] = self.package_url.format(instance['package_id'])
+        for name, exp, context in self.quantizers:
+            ret[name] = instance[name].quantize(exp, context=context)
+        created = instance['created'].astimezone(self.timezone).isoformat()
+        if created.endswith('+00:00'):
+            created = created[:-6] + 'Z'
+        ret['created'] = created
+        ret['url'] = self.status_url.format(instance['id'])
+        return ret
+
+
+class PackageStatusValuesSerializer(StatusValuesSerializer):
+    """
+    Read only serializer for package status rows
+    Renders the same as PackageStatusSerializer
+    """
+    include_package = False
+
+
+class StatusBatchItemSerializer(serializers.ModelSerializer):
+    """
+    Serializer for validating one status of a batch upload
+    package is an id checked in bulk for the whole batch
+    created is optional so buffered device readings keep their time
+    """
+    package = serializers.IntegerField()
+    created = serializers.DateTimeField(required=False)
+
+    class Meta:
+        model = Status
+        fields = ('package', 'latitude', 'longitude', 'elevation', 'created')
+
+
 class PackageSerializer(serializers.ModelSerializer):
     """
     Serializer for package
     """
 
-    tracking = PackageStatusSerializer(many=True, read_only=True)
+    tracking = serializers.SerializerMethodField()
+    latest_status = PackageStatusSerializer(
+        source='latest_status.status', read_only=True)
     status = serializers.HyperlinkedIdentityField(
         view_name='package-tracking')
 
     class Meta:
         model = Package
-        fields = ('id', 'description', 'status', 'tracking', 'url')
+        fields = ('id', 'description', 'status',
+                  'latest_status', 'tracking', 'url')
+
+    def get_tracking(self, instance):
+        """
+        Statuses of the package from the hot and archive tiers newest
+        first, only the latest when the view sets a tracking limit
+        """
+        hot = instance.tracking.all()
+        archived = instance.archived_tracking.all()
+        limit = self.context.get('tracking_limit')
+        if limit is not None:
+            # statuses sharing the cutoff time can exceed the tracking limit
+            hot, archived = hot[:limit], archived[:limit]
+        statuses = heapq.merge(
+            hot, archived, key=lambda status: (status.created, status.id),
+            reverse=True)
+        if limit is not None:
+            statuses = islice(statuses, limit)
+        # rendered as by PackageStatusSerializer, urls resolved once
+        if not hasattr(self, 'tracking_serializer'):
+            self.tracking_serializer = PackageStatusValuesSerializer(
+                context=self.context)
+        fields = [name for name in PackageStatusValuesSerializer.values
+                  if name != 'package_id']
+        return [self.tracking_serializer.to_representation(
+            {name: getattr(status, name) for name in fields})
+                for status in statuses]
@@ -0,0 +1,156 @@
+"""
+Define api model signal handlers
+"""
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import (
+    Group,
+    Permission,
+)
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from .cache import invalidate
+from .events import publish_status
+from .models import (
+    Change,
+    LatestStatus,
+    Package,
+    Status,
+)
+from .permissions import invalidate_permissions
+from .tracks import invalidate_stats
+
+M2M_CHANGES = ('post_add', 'post_remove', 'post_clear')
+USER_FLAGS = {'is_active', 'is_superuser'}
+
+
+@receiver(pre_save, sender=Status)
+def locate_status(sender, instance, **kwargs):
+    """
+    Place status in the grid cell of its position before saving
+    """
+    instance.locate()
+
+
+@receiver(post_save, sender=Status)
+def track_latest_status(sender, instance, created, **kwargs):
+    """
+    Update latest status of package when a status is created
+    """
+    if created:
+        LatestStatus.objects.track(instance)
+
+
+@receiver(post_delete, sender=Status)
+def untrack_latest_status(sender, instance, **kwargs):
+    """
+    Recompute latest status of package when its latest status is deleted
+    """
+    latest = LatestStatus.objects.filter(package_id=instance.package_id)
+    if not latest.exists():
+        LatestStatus.objects.refresh([instance.package_id])
+
+
+@receiver(post_save, sender=Package)
+@receiver(post_delete, sender=Package)
+def invalidate_package(sender, instance, **kwargs):
+    """
+    Invalidate cached responses showing a changed package
+    """
+    invalidate([instance.id])
+
+
+@receiver(post_save, sender=Status)
+@receiver(post_delete, sender=Status)
+def invalidate_status(sender, instance, **kwargs):
+    """
+    Invalidate cached responses showing the package of a changed status
+    """
+    invalidate([instance.package_id])
+
+
+@receiver(post_save, sender=Status)
+@receiver(post_delete, sender=Status)
+def invalidate_status_stats(sender, instance, **kwargs):
+    """
+    Drop cached track stats of the window of a changed status
+    """
+    invalidate_stats([(instance.package_id, instance.created)])
+
+
+@receiver(post_save, sender=Package)
+@receiver(post_save, sender=Status)
+def log_saved(sender, instance, created, raw=False, **kwargs):
+    """
+    Log package or status created or updated
+    and publish created statuses to live subscribers
+    """
+    if not raw:
+        change = Change.objects.record(
+            instance, Change.CREATE if created else Change.UPDATE)
+        if created and sender is Status:
+            publish_status(change, instance)
+
+
+@receiver(post_delete, sender=Package)
+@receiver(post_delete, sender=Status)
+def log_deleted(sender, instance, **kwargs):
+    """
+    Log package or status deleted
+    """
+    Change.objects.record(instance, Change.DELETE)
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+@receiver(m2m_changed, sender=get_user_model().user_permissions.through)
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set,
+                                **kwargs):
+    """
+    Invalidate cached permissions of users given groups or permissions
+    """
+    if action not in M2M_CHANGES:
+        return
+    if not reverse:
+        invalidate_permissions([instance.pk])
+    else:
+        # cleared from the group or permission side without user ids
+        invalidate_permissions(pk_set)
+
+
+@receiver(post_save, sender=get_user_model())
+def invalidate_user_flags(sender, instance, created, update_fields,
+                          **kwargs):
+    """
+    Invalidate cached permissions of a user saved with its active or
+    superuser flags, so a demoted user loses what it was granted
+    """
+    if created or update_fields is not None and \
+            not USER_FLAGS.intersection(update_fields):
+        return
+    invalidate_permissions([instance.pk])
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_permissions(sender, action, **kwargs):
+    """
+    Invalidate cached permissions of all users when a group changes
+    """
+    if action in M2M_CHANGES:
+        invalidate_permissions()
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def invalidate_all_permissions(sender, **kwargs):
+    """
+    Invalidate cached permissions of all users when groups or
+    permissions are deleted or renamed
+    """
+    invalidate_permissions()
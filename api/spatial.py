@@ -0,0 +1,197 @@
+"""
+Define spatial filtering of statuses
+Statuses are bucketed into an indexed grid of cells so a bounding box is
+read as one index range per row of cells it covers, then filtered by the
+exact coordinates and for radius queries by great circle distance, all
+in the database so pages and counts only hold matching statuses.
+"""
+
+import math
+
+from django.db.models import (
+    F,
+    Q,
+)
+from rest_framework.exceptions import ValidationError
+
+CELL_DEGREES = 0.1
+GRID_ROWS = int(round(180 / CELL_DEGREES))
+GRID_COLUMNS = int(round(360 / CELL_DEGREES))
+# beyond this many rows of cells the grid ranges cost more than they save
+MAX_GRID_ROWS = 200
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def grid_row(latitude):
+    """
+    Row of cells containing latitude
+    """
+    row = int(math.floor((float(latitude) + 90) / CELL_DEGREES))
+    return min(max(row, 0), GRID_ROWS - 1)
+
+
+def grid_column(longitude):
+    """
+    Column of cells containing longitude
+    """
+    column = int(math.floor((float(longitude) + 180) / CELL_DEGREES))
+    return min(max(column, 0), GRID_COLUMNS - 1)
+
+
+def grid_cell(latitude, longitude):
+    """
+    Grid cell containing position
+    """
+    return grid_row(latitude) * GRID_COLUMNS + grid_column(longitude)
+
+
+def unit_vector(latitude, longitude):
+    """
+    Position as a vector of unit length from the centre of the earth
+    """
+    lat, lng = math.radians(float(latitude)), math.radians(float(longitude))
+    return (math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng),
+            math.sin(lat))
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """
+    Great circle distance between two positions in kilometres
+    """
+    lat1, lng1, lat2, lng2 = map(
+        math.radians, (float(lat1), float(lng1), float(lat2), float(lng2)))
+    root = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(
+        lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1, math.sqrt(root)))
+
+
+def parse_floats(value, count, name):
+    """
+    Parse comma separated list of floats
+    """
+    try:
+        floats = [float(part) for part in value.split(',')]
+    except ValueError:
+        floats = []
+    if len(floats) != count or not all(map(math.isfinite, floats)):
+        raise ValidationError({name: [
+            'Expected {0} comma separated numbers.'.format(count)]})
+    return floats
+
+
+class SpatialQuery:
+    """
+    Bounding box or radius around a position parsed from query params
+    `bbox=min_lat,min_lng,max_lat,max_lng` where min_lng > max_lng crosses
+    the antimeridian, or `near=lat,lng&radius=km`
+    """
+    bbox_query_param = 'bbox'
+    near_query_param = 'near'
+    radius_query_param = 'radius'
+
+    def __init__(self, boxes, center=None, radius=None):
+        self.boxes = boxes
+        self.center = center
+        self.radius = radius
+
+    @classmethod
+    def from_params(cls, query_params):
+        """
+        Get spatial query from request params or None if not filtered
+        """
+        bbox = query_params.get(cls.bbox_query_param)
+        near = query_params.get(cls.near_query_param)
+        if near:
+            center = parse_floats(near, 2, cls.near_query_param)
+            radius, = parse_floats(
+                query_params.get(cls.radius_query_param, ''), 1,
+                cls.radius_query_param)
+            if radius <= 0:
+                raise ValidationError({cls.radius_query_param: [
+                    'Radius must be positive.']})
+            return cls(cls.radius_boxes(center, radius), center, radius)
+        if bbox:
+            min_lat, min_lng, max_lat, max_lng = parse_floats(
+                bbox, 4, cls.bbox_query_param)
+            if min_lat > max_lat:
+                raise ValidationError({cls.bbox_query_param: [
+                    'Minimum latitude is above maximum latitude.']})
+            return cls(cls.split_box(min_lat, min_lng, max_lat, max_lng))
+        return None
+
+    @staticmethod
+    def split_box(min_lat, min_lng, max_lat, max_lng):
+        """
+        Split box crossing the antimeridian into boxes that do not
+        """
+        if min_lng <= max_lng:
+            return [(min_lat, min_lng, max_lat, max_lng)]
+        return [(min_lat, min_lng, max_lat, 180),
+                (min_lat, -180, max_lat, max_lng)]
+
+    @classmethod
+    def radius_boxes(cls, center, radius):
+        """
+        Boxes bounding the circle of radius kilometres around center
+        """
+        lat, lng = center
+        span = radius / KM_PER_DEGREE
+        min_lat, max_lat = max(lat - span, -90), min(lat + span, 90)
+        cos_lat = min(math.cos(math.radians(min_lat)),
+                      math.cos(math.radians(max_lat)))
+        if min_lat <= -90 or max_lat >= 90 or span >= 180 * cos_lat:
+            return [(min_lat, -180, max_lat, 180)]
+        lng_span = span / cos_lat
+        min_lng = (lng - lng_span + 180) % 360 - 180
+        max_lng = (lng + lng_span + 180) % 360 - 180
+        return cls.split_box(min_lat, min_lng, max_lat, max_lng)
+
+    def filter(self, queryset, prefix='', grid='grid'):
+        """
+        Filter queryset to statuses inside the boxes using the grid index
+        and for radius queries within the great circle distance
+        prefix is the lookup path to the status coordinates
+        grid is the lookup of the indexed grid cell
+        """
+        query = Q()
+        for min_lat, min_lng, max_lat, max_lng in self.boxes:
+            box = Q(**{
+                prefix + 'latitude__gte': min_lat,
+                prefix + 'latitude__lte': max_lat,
+                prefix + 'longitude__gte': min_lng,
+                prefix + 'longitude__lte': max_lng,
+            })
+            rows = range(grid_row(min_lat), grid_row(max_lat) + 1)
+            if len(rows) <= MAX_GRID_ROWS:
+                first, last = grid_column(min_lng), grid_column(max_lng)
+                cells = Q()
+                for row in rows:
+                    start = row * GRID_COLUMNS
+                    cells |= Q(**{grid + '__range': (
+                        start + first, start + last)})
+                box &= cells
+            query |= box
+        if self.center is not None:
+            query &= self.within_radius(prefix)
+        return queryset.filter(query)
+
+    def within_radius(self, prefix=''):
+        """
+        Condition of unit vectors within the radius of the center
+        Positions are within the radius when the dot product of their
+        unit vectors is at least the cosine of the angle the radius spans,
+        written as a bound on the largest component of the center vector
+        so the condition is a plain lookup
+        """
+        center = unit_vector(*self.center)
+        threshold = math.cos(min(self.radius / EARTH_RADIUS_KM, math.pi))
+        axis = max(range(3), key=lambda index: abs(center[index]))
+        names = [prefix + name for name in ('unit_x', 'unit_y', 'unit_z')]
+        bound = threshold
+        for index in range(3):
+            if index != axis:
+                bound = bound - F(names[index]) * center[index]
+        bound = bound / center[axis]
+        lookup = '__gte' if center[axis] > 0 else '__lte'
+        return Q(**{names[axis] + lookup: bound})
@@ -4,22 +4,84 @@ Test functionality in api module
 
 import os
 import decimal
+import csv
+import io
+import json
+import re
+import asyncio
+import tempfile
+import threading
+import time
+from unittest import mock
 
-from django.test import SimpleTestCase
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TransactionTestCase,
+)
 from django.core import exceptions
+from django.core.cache import cache
+from django.core.management import (
+    CommandError,
+    call_command,
+)
+from django.core.wsgi import get_wsgi_application
 from django.db import (
+    DatabaseError,
+    connection,
+    connections,
     transaction,
     utils,
 )
-from django.contrib.auth.models import User
+from django.contrib.auth.models import (
+    Group,
+    Permission,
+    User,
+)
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import (
+    APIClient,
+    APIRequestFactory,
+    APITestCase,
+)
+from trackex import metrics
+from trackex.asgi import ASGIHandler
+from trackex.cache import LRUMemCache
+from trackex.middleware import ConnectionHealthMiddleware
 
+from . import (
+    checks,
+    events,
+    ingest,
+    packing,
+    permissions,
+    routers,
+    spatial,
+    tracks,
+)
 from .models import (
+    ArchivedStatus,
+    Change,
+    Heartbeat,
+    LatestStatus,
     Package,
     Status,
+    TieredStatuses,
+)
+from .views import PackageViewSet
+from .serializers import (
+    PackageStatusSerializer,
+    PackageStatusValuesSerializer,
+    StatusSerializer,
+    StatusValuesSerializer,
 )
+from .renderers import PackedStatusRenderer
 
 
 class EnviromentTest(SimpleTestCase):
@@ -42,12 +104,389 @@ class EnviromentTest(SimpleTestCase):
                 self.assertIsNot(value, '', fail_msg)
 
 
+class ConnectionHealthTest(SimpleTestCase):
+    """
+    Test persistent connections are checked before requests
+    """
+
+    def get_middleware(self):
+        """
+        Build connection health middleware returning empty responses
+        """
+        return ConnectionHealthMiddleware(lambda request: HttpResponse())
+
+    def test_closes_unusable_connection(self):
+        """
+        Test dropped connection is closed and usable one kept
+        """
+        request = RequestFactory().get('/')
+        conn = mock.Mock(connection=object())
+        with mock.patch('trackex.middleware.connections') as connections:
+            connections.all.return_value = [conn]
+            conn.is_usable.return_value = True
+            self.get_middleware()(request)
+            conn.close.assert_not_called()
+            conn.is_usable.return_value = False
+            self.get_middleware()(request)
+            conn.close.assert_called_once_with()
+
+    def test_can_disable_health_checks(self):
+        """
+        Test middleware is skipped when health checks are disabled
+        """
+        with self.settings(DB_HEALTH_CHECKS=False):
+            with self.assertRaises(exceptions.MiddlewareNotUsed):
+                self.get_middleware()
+
+
+class ASGIHandlerTest(SimpleTestCase):
+    """
+    Test serving the api over ASGI
+    """
+
+    def serve(self, application, scope, messages, streams=0):
+        """
+        Serve scope with the ASGI handler, returns messages sent
+        """
+        handler = ASGIHandler(application, threads=2, stream_threads=2)
+        handler.streams = streams
+        messages, sent = list(messages), []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            return await asyncio.Future()
+
+        async def send(message):
+            sent.append(message)
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(handler(dict({
+                'type': 'http', 'method': 'GET', 'path': '/',
+                'headers': [(b'host', b'testserver')]}, **scope),
+                receive, send))
+            loop.run_until_complete(asyncio.sleep(0))
+        finally:
+            loop.close()
+            handler.executor.shutdown()
+            handler.stream_executor.shutdown()
+        return sent
+
+    def test_serves_django_application(self):
+        """
+        Test requests are routed by the django application
+        """
+        sent = self.serve(get_wsgi_application(), {'headers': [
+            (b'host', b'testserver'), (b'accept', b'application/json')]},
+                          [{'type': 'http.request'}])
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'application/json'),
+                      sent[0]['headers'])
+        self.assertIn('packages', json.loads(sent[1]['body'].decode()))
+
+    def test_streams_response(self):
+        """
+        Test request body is read and streaming response sent in chunks
+        """
+        def application(environ, start_response):
+            start_response('201 Created', [('X-Method', 'POST')])
+            yield environ['wsgi.input'].read()
+            yield b''
+            yield environ['QUERY_STRING'].encode('latin1')
+
+        sent = self.serve(application, {
+            'method': 'POST', 'query_string': b'a=1'}, [
+                {'type': 'http.request', 'body': b'da', 'more_body': True},
+                {'type': 'http.request', 'body': b'ta'}])
+        self.assertEqual(sent[0], {'type': 'http.response.start',
+                                   'status': 201,
+                                   'headers': [(b'x-method', b'POST')]})
+        self.assertEqual([(m['body'], m.get('more_body')) for m in sent[1:]],
+                         [(b'data', True), (b'a=1', True), (b'', None)])
+
+    def test_stops_stream_on_disconnect(self):
+        """
+        Test endless stream is closed when the client disconnects
+        """
+        closed = []
+
+        def application(environ, start_response):
+            start_response('200 OK', [])
+            try:
+                while True:
+                    yield b'.'
+            finally:
+                closed.append(True)
+
+        sent = self.serve(application, {}, [
+            {'type': 'http.request'}, {'type': 'http.disconnect'}])
+        self.assertEqual(closed, [True], 'Stream not closed')
+        self.assertEqual(sent[-1], {'type': 'http.response.body', 'body': b''})
+
+    def test_refuses_stream_when_busy(self):
+        """
+        Test stream is refused and closed once every stream thread is busy
+        """
+        closed = []
+
+        def application(environ, start_response):
+            start_response('200 OK', [])
+            try:
+                yield b'.'
+            finally:
+                closed.append(True)
+
+        sent = self.serve(application, {}, [{'type': 'http.request'}],
+                          streams=2)
+        self.assertEqual(sent[0]['status'], 503)
+        self.assertIn((b'retry-after', b'5'), sent[0]['headers'])
+        self.assertEqual(len(sent), 2, 'Refused stream sent chunks')
+        self.assertEqual(closed, [True], 'Refused stream not closed')
+
+    def test_streams_async_response_on_event_loop(self):
+        """
+        Test async streams are served on the event loop while every
+        stream thread is busy, with their blocking calls on a stream thread
+        """
+        class Response(list):
+            streaming = True
+            closed = False
+
+            def close(self):
+                self.closed = True
+
+            async def async_stream(self, run_sync):
+                threaded = await run_sync(
+                    lambda: threading.current_thread() is not main)
+                yield 'threaded {0}'.format(threaded).encode()
+                yield b''
+                yield b'live'
+
+        main = threading.current_thread()
+        response = Response()
+
+        def application(environ, start_response):
+            start_response('200 OK', [])
+            return response
+
+        sent = self.serve(application, {}, [{'type': 'http.request'}],
+                          streams=2)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual([m['body'] for m in sent[1:]],
+                         [b'threaded True', b'live', b''])
+        self.assertTrue(response.closed, 'Response not closed')
+
+
+class SpatialQueryTest(SimpleTestCase):
+    """
+    Test spatial grid and query parsing
+    """
+
+    def test_grid_cell(self):
+        """
+        Test positions fall in cells of the grid
+        """
+        self.assertEqual(spatial.grid_cell(-90, -180), 0)
+        self.assertEqual(spatial.grid_cell(90, 180),
+                         spatial.GRID_ROWS * spatial.GRID_COLUMNS - 1)
+        self.assertEqual(spatial.grid_cell(0.05, 0.05),
+                         spatial.grid_cell(0.01, 0.09))
+        self.assertNotEqual(spatial.grid_cell(0.05, 0.05),
+                            spatial.grid_cell(0.05, 0.15))
+
+    def test_haversine(self):
+        """
+        Test great circle distance of one degree along the equator
+        """
+        self.assertAlmostEqual(spatial.haversine_km(0, 0, 0, 1),
+                               spatial.KM_PER_DEGREE, places=6)
+        self.assertAlmostEqual(spatial.haversine_km(0, 179.5, 0, -179.5),
+                               spatial.KM_PER_DEGREE, places=6)
+
+    def test_parse_params(self):
+        """
+        Test bbox and radius params are parsed into boxes
+        Test boxes crossing the antimeridian are split
+        """
+        query = spatial.SpatialQuery.from_params({'bbox': '1,2,3,4'})
+        self.assertEqual(query.boxes, [(1, 2, 3, 4)])
+        query = spatial.SpatialQuery.from_params({'bbox': '1,170,3,-170'})
+        self.assertEqual(query.boxes, [(1, 170, 3, 180), (1, -180, 3, -170)])
+        query = spatial.SpatialQuery.from_params(
+            {'near': '0,179.9', 'radius': '50'})
+        self.assertEqual(len(query.boxes), 2)
+        self.assertEqual(query.center, [0, 179.9])
+        self.assertIsNone(spatial.SpatialQuery.from_params({}))
+        for params in [{'bbox': '1,2,3'}, {'bbox': '3,2,1,4'},
+                       {'near': '1,2'}, {'near': '1,2', 'radius': '-1'},
+                       {'near': 'a,b', 'radius': '1'}]:
+            with self.assertRaises(ValidationError, msg=params):
+                spatial.SpatialQuery.from_params(params)
+
+
+class EventBrokerTest(SimpleTestCase):
+    """
+    Test fan out of live events
+    """
+
+    def test_publish_to_subscribers(self):
+        """
+        Test events reach only subscribers of the package
+        Test closed subscriptions stop receiving events
+        """
+        broker = events.LocalBroker()
+        first = broker.subscribe([1, 2])
+        second = broker.subscribe([2])
+        broker.publish(1, 'a')
+        broker.publish(2, 'b')
+        self.assertEqual([first.get(0), first.get(0), first.get(0)],
+                         ['a', 'b', None])
+        self.assertEqual([second.get(0), second.get(0)], ['b', None])
+        second.close()
+        broker.publish(2, 'c')
+        self.assertIsNone(second.get(0))
+        self.assertEqual(broker.subscriptions, {1: {first}, 2: {first}})
+
+    def test_slow_subscriber_overflows(self):
+        """
+        Test subscriber too far behind is overflowed without blocking
+        """
+        broker = events.LocalBroker()
+        subscription = broker.subscribe([1], max_pending=2)
+        for event in range(3):
+            broker.publish(1, event)
+        self.assertTrue(subscription.overflowed)
+        self.assertIsNone(subscription.get(0))
+
+    def test_async_subscriber(self):
+        """
+        Test events published by threads are awaited on the event loop
+        Test closing wakes the awaiting reader
+        """
+        broker = events.LocalBroker()
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def read():
+            subscription = broker.subscribe([1], max_pending=2, loop=loop)
+            self.assertIsNone(await subscription.get(0.01))
+            thread = threading.Thread(target=broker.publish, args=(1, 'a'))
+            thread.start()
+            self.assertEqual(await subscription.get(5), 'a')
+            thread.join()
+            for event in range(3):
+                broker.publish(1, event)
+            await asyncio.sleep(0)
+            self.assertTrue(subscription.overflowed)
+            self.assertIsNone(await subscription.get(0))
+
+            other = broker.subscribe([2], loop=loop)
+            threading.Timer(0.01, other.close).start()
+            start = time.monotonic()
+            self.assertIsNone(await other.get(5))
+            self.assertLess(time.monotonic() - start, 5,
+                            'Closing did not wake the reader')
+        loop.run_until_complete(read())
+
+    def test_async_stream_rows(self):
+        """
+        Test streams read on the event loop replay through run_sync and
+        await live events on the loop
+        """
+        broker = events.LocalBroker()
+        serializer = mock.Mock(to_representation=lambda values: values)
+        stream = events.StatusStream(
+            {1}, serializer, max_pending=1, heartbeat=0.05)
+        calls = []
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def run_sync(func):
+            calls.append(func)
+            return func()
+
+        async def read():
+            rows = stream.async_rows(run_sync)
+            self.assertIsNone(await rows.__anext__(), 'No keep alive')
+            threading.Thread(target=broker.publish,
+                             args=(1, (3, {'id': 1}))).start()
+            row = None
+            while row is None:
+                row = await rows.__anext__()
+            self.assertEqual(row, (3, 'status', {'id': 1}))
+            broker.publish(1, (4, {'id': 2}))
+            broker.publish(1, (5, {'id': 3}))
+            self.assertEqual(await rows.__anext__(),
+                             (None, 'overflow', {'after': 3}))
+            with self.assertRaises(StopAsyncIteration):
+                await rows.__anext__()
+
+        with mock.patch.object(events, 'BROKER', broker), \
+                mock.patch.object(events.Change.objects,
+                                  'publish') as publish:
+            loop.run_until_complete(read())
+        self.assertEqual(publish.call_count, 1)
+        self.assertEqual(len(calls), 1, 'Replay not run through run_sync')
+        self.assertEqual(broker.subscriptions, {}, 'Subscription not closed')
+
+
+class PackingTest(SimpleTestCase):
+    """
+    Test packed encoding of statuses
+    """
+
+    def test_round_trip(self):
+        """
+        Test statuses unpack to the values packed
+        """
+        rows = [
+            {'id': 7, 'package': 3, 'latitude': decimal.Decimal('-89.5'),
+             'longitude': 179.999999, 'elevation': decimal.Decimal('0.001'),
+             'created': '2018-03-01T10:00:00.000001Z'},
+            {'id': 5, 'package': 3, 'latitude': 0, 'longitude': -180,
+             'elevation': -12.5, 'created': timezone.datetime(
+                 1969, 12, 31, tzinfo=timezone.utc)},
+        ]
+        data = packing.pack(rows, 40, 'http://testserver/next', None)
+        unpacked, count, next_link, previous_link = packing.unpack(data)
+        self.assertEqual((count, next_link, previous_link),
+                         (40, 'http://testserver/next', None))
+        self.assertEqual([row['id'] for row in unpacked], [7, 5])
+        self.assertEqual(unpacked[0]['created'], timezone.datetime(
+            2018, 3, 1, 10, 0, 0, 1, tzinfo=timezone.utc))
+        self.assertEqual(
+            [(row['latitude'], row['longitude'], row['elevation'])
+             for row in unpacked],
+            [(decimal.Decimal('-89.500000'), decimal.Decimal('179.999999'),
+              decimal.Decimal('0.001')),
+             (0, -180, decimal.Decimal('-12.500'))])
+
+    def test_optional_columns(self):
+        """
+        Test hyperlinks and missing columns are left out
+        Test malformed data is rejected
+        """
+        data = packing.pack([{'package': 'http://testserver/packages/1',
+                              'latitude': 1, 'longitude': 2, 'elevation': 3}])
+        self.assertEqual(packing.unpack(data)[0], [
+            {'latitude': 1, 'longitude': 2, 'elevation': 3}])
+        for malformed in (b'', b'{}', data[:-1], data + b'\x00',
+                          data[:-4] + b'\xff'):
+            with self.assertRaises(packing.PackingError):
+                packing.unpack(malformed)
+
+
 class FixtureTestCase(APITestCase):
     """
     Test with defined fixtures to load for testing
     """
     fixtures = ['initial_data_api.json', 'initial_data_auth.json']
 
+    def setUp(self):
+        # cached responses outlive the rolled back test data
+        cache.clear()
+
 
 class PackageModelTest(FixtureTestCase):
     """
@@ -148,6 +587,928 @@ class StatusModelTest(FixtureTestCase):
                     pkg_status.save()
 
 
+class LatestStatusModelTest(FixtureTestCase):
+    """
+    Test latest status projection is kept in sync with statuses
+    """
+
+    def assert_latest(self, package_id, msg=None):
+        """
+        Assert projection matches most recent status of package
+        """
+        latest = Status.objects.filter(package=package_id).first()
+        projection = LatestStatus.objects.filter(
+            package=package_id).first()
+        if latest is None:
+            self.assertIsNone(projection, msg)
+        else:
+            self.assertEqual(projection.status, latest, msg)
+            self.assertEqual(projection.created, latest.created, msg)
+
+    def test_fixtures_tracked(self):
+        """
+        Test every package with statuses has its latest status
+        """
+        for package in Package.objects.all():
+            self.assert_latest(package.id, 'Fixture status not tracked')
+
+    def test_create_tracks_newest(self):
+        """
+        Test creating newer status replaces latest and older does not
+        """
+        pkg_status = Status.objects.create(
+            package_id=3, latitude=1, longitude=1, elevation=1)
+        self.assert_latest(3, 'New status not tracked')
+        self.assertEqual(LatestStatus.objects.get(package=3).status,
+                         pkg_status)
+        Status.objects.create(
+            package_id=3, latitude=1, longitude=1, elevation=1,
+            created=pkg_status.created - timezone.timedelta(days=1))
+        self.assertEqual(LatestStatus.objects.get(package=3).status,
+                         pkg_status, 'Older status tracked as latest')
+
+    def test_delete_recomputes_latest(self):
+        """
+        Test deleting latest status falls back to previous status
+        Test deleting all statuses removes latest status
+        """
+        Status.objects.filter(package=3).first().delete()
+        self.assert_latest(3, 'Latest status not recomputed')
+        Status.objects.filter(package=3).delete()
+        self.assert_latest(3, 'Latest status kept without statuses')
+
+    def test_refresh(self):
+        """
+        Test latest status can be recomputed for many packages
+        """
+        LatestStatus.objects.all().delete()
+        LatestStatus.objects.refresh([1, 2, 3, 4])
+        for package in Package.objects.all():
+            self.assert_latest(package.id, 'Latest status not refreshed')
+
+
+class StatusValuesSerializerTest(FixtureTestCase):
+    """
+    Test fast status serializers render the same as model serializers
+    """
+
+    def test_renders_identical_json(self):
+        """
+        Test json of status values matches hyperlinked serializers
+        """
+        Status.objects.create(package_id=1, latitude='-89.999999',
+                              longitude='179.5', elevation='-0.001')
+        Status.objects.create(package_id=1, latitude=0,
+                              longitude='-0.000001', elevation='99999.999')
+        request = APIRequestFactory().get('/')
+        context = {'request': request}
+        renderer = JSONRenderer()
+        pairs = [
+            (StatusSerializer, StatusValuesSerializer),
+            (PackageStatusSerializer, PackageStatusValuesSerializer),
+        ]
+        for model_serializer, values_serializer in pairs:
+            expected = renderer.render(model_serializer(
+                Status.objects.all(), many=True, context=context).data)
+            actual = renderer.render(values_serializer(
+                Status.objects.values(*values_serializer.values),
+                many=True, context=context).data)
+            self.assertEqual(actual, expected,
+                             '{0} renders differently'.format(
+                                 values_serializer.__name__))
+
+
+class StatusIndexTest(FixtureTestCase):
+    """
+    Test status reads are covered by the package recency index
+    """
+    index = 'api_status_pkg_created_idx'
+
+    @classmethod
+    def setUpTestData(cls):
+        # enough history for the query planner to prefer indexes over scans
+        Status.objects.bulk_create([
+            Status(package_id=pkg, latitude=0, longitude=0, elevation=0)
+            for pkg in range(1, 5) for _ in range(250)
+        ])
+
+    def explain(self, sql):
+        """
+        Get query plan of sql as list of (table, detail) for status reads
+        """
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                return [(None, row[-1]) for row in cursor.fetchall()]
+            cursor.execute('EXPLAIN ' + sql)
+            columns = [col[0].lower() for col in cursor.description]
+            plan = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return [(row['table'], '{type} {key} {extra}'.format(**row))
+                    for row in plan]
+
+    def assert_index_covered(self, sql, ordered=True):
+        """
+        Assert status table is only searched by index
+        and ordering does not need a sort when required
+        """
+        plan = self.explain(sql)
+        fail_msg = 'Status read not covered by index\n{0}\n{1}'.format(
+            sql, plan)
+        self.assertIn(self.index, str(plan), fail_msg)
+        for table, detail in plan:
+            if connection.vendor == 'sqlite':
+                self.assertNotRegex(detail, r'^SCAN (TABLE )?api_status',
+                                    fail_msg)
+                if ordered:
+                    self.assertNotIn('TEMP B-TREE FOR ORDER BY', detail,
+                                     fail_msg)
+            elif table is not None:
+                self.assertFalse(detail.startswith('ALL '), fail_msg)
+                if ordered:
+                    self.assertNotIn('filesort', detail, fail_msg)
+
+    def capture_status_reads(self, url, params=None):
+        """
+        Get sql of status reads made by request
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [q['sql'] for q in queries.captured_queries
+                if re.search(r'FROM [`"]?api_status\b', q['sql'])
+                and 'COUNT(' not in q['sql']]
+
+    def test_tracking_list_uses_index(self):
+        """
+        Test paginated tracking list reads by index without sorting
+        """
+        url = reverse('package-tracking', kwargs={'pk': 3})
+        for params in [{'offset': 100}, {'cursor': ''}]:
+            queries = self.capture_status_reads(url, params)
+            self.assertEqual(len(queries), 1)
+            for sql in queries:
+                self.assert_index_covered(sql)
+
+    def test_latest_status_uses_index(self):
+        """
+        Test latest status lookup seeks the index
+        """
+        with CaptureQueriesContext(connection) as queries:
+            list(Status.objects.filter(package=3)[:1])
+        sql = queries.captured_queries[0]['sql']
+        self.assert_index_covered(sql)
+
+    def test_package_list_uses_index(self):
+        """
+        Test package list finds latest statuses per package by index
+        """
+        queries = self.capture_status_reads(reverse('package-list'))
+        self.assertEqual(len(queries), 1)
+        # sorting is bounded by the embedded tracking limit
+        self.assert_index_covered(queries[0], ordered=False)
+
+
+class ImportTrackingTest(FixtureTestCase):
+    """
+    Test importing tracking history dumps
+    """
+
+    def import_dump(self, content, suffix='.json', **options):
+        """
+        Import dump content, returns command output and errors
+        """
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with tempfile.NamedTemporaryFile('w', suffix=suffix) as dump:
+            dump.write(content)
+            dump.flush()
+            call_command('import_tracking', dump.name, stdout=stdout,
+                         stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_dump(self):
+        """
+        Test statuses imported for existing and new packages
+        Test invalid statuses skipped and coordinates rounded
+        """
+        statuses = Status.objects.count()
+        # small reads split values across the scanner's buffer refills
+        with mock.patch('api.importing.READ_SIZE', 7):
+            output, errors = self.import_dump(json.dumps({
+                'Cesna 120': [
+                    {'created': '2018-10-12T12:00:00-05:00', 'latitude': 45.1,
+                     'longitude': -81.8149807, 'elevation': 500},
+                    {'created': 'noon', 'latitude': 45, 'longitude': 0,
+                     'elevation': 1},
+                ],
+                'Glider': [],
+                'Balloon': [
+                    {'created': '2018-10-12T12:00:00Z', 'latitude': -100,
+                     'longitude': 0, 'elevation': 1},
+                    {'created': '2018-10-12T13:00:00Z', 'latitude': 10,
+                     'longitude': 20, 'elevation': 3000.0005},
+                ],
+            }, indent=4), chunk_size=1)
+        self.assertIn('Imported 2 statuses for 3 packages', output)
+        self.assertIn('skipped 2 invalid', output)
+        self.assertIn("Skipped status 1 of 'Cesna 120'", errors)
+        self.assertEqual(Status.objects.count(), statuses + 2)
+        self.assertTrue(Package.objects.filter(description='Glider').exists())
+
+        imported = Status.objects.get(package=1, created__year=2018)
+        self.assertEqual(imported.longitude, decimal.Decimal('-81.814981'))
+        self.assertEqual(imported.grid, spatial.grid_cell(45.1, -81.814981))
+        self.assertEqual(LatestStatus.objects.get(package=1).status,
+                         imported, 'Latest status not updated by import')
+        balloon = Status.objects.get(package__description='Balloon')
+        self.assertEqual(balloon.elevation, decimal.Decimal('3000.000'))
+
+    def test_import_ndjson(self):
+        """
+        Test statuses imported from lines naming their package
+        Test malformed dumps fail
+        """
+        output, _ = self.import_dump(
+            '{"package": "Piper M600", "created": "2018-01-01T00:00:00Z", '
+            '"latitude": 1, "longitude": 2, "elevation": 3}\n\n'
+            '{"package": "Piper M600", "created": "2018-01-01T00:00:01Z", '
+            '"latitude": 1, "longitude": 2, "elevation": 4}\n', '.ndjson')
+        self.assertIn('Imported 2 statuses for 1 packages', output)
+        self.assertEqual(Status.objects.filter(
+            package=3, created__year=2018).count(), 2)
+        with self.assertRaises(CommandError):
+            self.import_dump('{"Piper M600": [{}}')
+        with self.assertRaises(CommandError):
+            self.import_dump('{"created": "2018-01-01T00:00:00Z"}\n',
+                             format='ndjson')
+
+    def test_import_failure_finishes_committed(self):
+        """
+        Test chunks committed before a failure update latest statuses
+        and are logged as changes
+        """
+        with self.assertRaises(CommandError):
+            self.import_dump(
+                '{"package": "Piper M600", "created": "2030-01-01T00:00:00Z",'
+                ' "latitude": 1, "longitude": 2, "elevation": 3}\n'
+                '{"package": "Piper M600", "created"\n', '.ndjson',
+                chunk_size=1)
+        imported = Status.objects.get(package=3, created__year=2030)
+        self.assertEqual(LatestStatus.objects.get(package=3).status, imported,
+                         'Latest status not updated by failed import')
+        self.assertTrue(Change.objects.filter(
+            package_id=3, object_id__isnull=True).exists(),
+                        'Committed statuses not logged')
+
+
+class ArchiveStatusesTest(FixtureTestCase):
+    """
+    Test moving old statuses to the archive tier
+    """
+
+    def get_reads(self, package_id):
+        """
+        Get tracking pages, cursor pages, export and stats of a package
+        """
+        url = reverse('package-tracking', kwargs={'pk': package_id})
+        reads = [self.client.get(url, {'limit': 2, 'offset': offset}).data
+                 for offset in range(0, 6, 2)]
+        cache.clear()
+        # deep offsets seek where the page starts in each tier
+        with mock.patch.object(TieredStatuses, 'seek_offset', 0):
+            reads.extend(self.client.get(
+                url, {'limit': 2, 'offset': offset}).data
+                         for offset in range(1, 6))
+        reads.append(self.client.get(reverse(
+            'package-detail', kwargs={'pk': package_id})).data['tracking'])
+        reads.append([package['tracking'] for package in self.client.get(
+            reverse('package-list'), {'tracking': 3}).data['results']
+                      if package['id'] == package_id])
+        reads.append(self.client.get(
+            url, {'since': '2016-10-14T17:00:00Z'}).data)
+        page = self.client.get(url, {'cursor': '', 'limit': 2}).data
+        reads.append(page)
+        while page['next']:
+            page = self.client.get(page['next']).data
+            reads.append(page)
+        reads.append(self.client.get(reverse(
+            'package-export', kwargs={'pk': package_id}),
+            HTTP_ACCEPT='application/x-ndjson').getvalue())
+        reads.append(self.client.get(reverse(
+            'package-stats', kwargs={'pk': package_id})).data)
+        cache.clear()
+        return reads
+
+    def test_archive_statuses(self):
+        """
+        Test old statuses archived except the latest of each package
+        Test tracking reads are unchanged once merged with the archive
+        """
+        self.client.force_authenticate(User.objects.get(username='demoer'))
+        self.client.post(
+            reverse('package-tracking', kwargs={'pk': 1}),
+            {'latitude': 45, 'longitude': -75, 'elevation': 10})
+        latest = dict(LatestStatus.objects.values_list(
+            'package_id', 'status_id'))
+        statuses = Status.objects.count()
+        before = {package_id: self.get_reads(package_id)
+                  for package_id in latest}
+        changes = Change.objects.count()
+
+        out = io.StringIO()
+        call_command('archive_statuses', days=90, chunk_size=2, stdout=out)
+        self.assertIn('Archived {0} statuses'.format(statuses - 4),
+                      out.getvalue())
+        self.assertEqual(sorted(Status.objects.values_list('id', flat=True)),
+                         sorted(latest.values()))
+        self.assertEqual(ArchivedStatus.objects.count(), statuses - 4)
+        self.assertEqual(dict(LatestStatus.objects.values_list(
+            'package_id', 'status_id')), latest)
+        self.assertEqual(Change.objects.count(), changes,
+                         'Archiving logged as a change')
+        for package_id, reads in before.items():
+            self.assertEqual(self.get_reads(package_id), reads,
+                             'Package {0} reads changed'.format(package_id))
+
+        response = self.client.get(reverse('status-detail', kwargs={'pk': 2}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['latitude'],
+                         decimal.Decimal('-79.286693'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('package-tracking', kwargs={'pk': 1}),
+                            {'since': timezone.now().isoformat()})
+        self.assertEqual(len([
+            query for query in queries.captured_queries
+            if 'api_archivedstatus' in query['sql']]), 1,
+                         'Archive read for times it has no statuses of')
+
+
+class PermissionCacheTest(FixtureTestCase):
+    """
+    Test permissions of users are cached until assignments change
+    """
+
+    def post_status(self):
+        """
+        Post a status as a freshly loaded demo user
+        Returns response and queries made for it
+        """
+        self.client.force_authenticate(User.objects.get(username='demoer'))
+        url = reverse('package-tracking', kwargs={'pk': 1})
+        data = {'latitude': 45, 'longitude': -75, 'elevation': 10}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data)
+        return response, [query['sql'] for query in queries.captured_queries]
+
+    @mock.patch('api.permissions.is_shared', return_value=True)
+    def test_cached_permissions(self, is_shared):
+        """
+        Test authenticated writes make no permission queries once warm
+        Test changed group and user permissions take effect
+        """
+        response, queries = self.post_status()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue([sql for sql in queries if 'auth_permission' in sql])
+        response, queries = self.post_status()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([sql for sql in queries if 'auth_' in sql], [],
+                         'Permissions queried after warm up')
+
+        group = Group.objects.get(name='demoers')
+        # writes to tracking need permission to add packages
+        add_package = Permission.objects.get(codename='add_package')
+        group.permissions.remove(add_package)
+        response, _ = self.post_status()
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        user = User.objects.get(username='demoer')
+        user.user_permissions.add(add_package)
+        response, _ = self.post_status()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        add_package.user_set.clear()
+        response, _ = self.post_status()
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        group.permissions.add(add_package)
+        group.user_set.remove(user)
+        response, _ = self.post_status()
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        user.groups.add(group)
+        self.assertTrue(User.objects.get(pk=user.pk).has_perm(
+            'api.add_package'), 'Backend permissions not refreshed')
+
+    @mock.patch('api.permissions.is_shared', return_value=True)
+    def test_demoted_user_permissions(self, is_shared):
+        """
+        Test superuser permissions are not cached
+        Test cached permissions are dropped when user flags are saved
+        """
+        admin = User.objects.get(username='admin')
+        self.assertTrue(admin.has_perm('api.delete_package'))
+        self.assertIsNone(cache.get(permissions.permissions_key(admin.pk)),
+                          'Superuser permissions cached')
+        admin.is_superuser = False
+        admin.save()
+        admin = User.objects.get(pk=admin.pk)
+        self.assertFalse(admin.has_perm('api.delete_package'),
+                         'Demoted superuser kept its permissions')
+
+        self.post_status()
+        user = User.objects.get(username='demoer')
+        key = permissions.permissions_key(user.pk)
+        user.last_login = timezone.now()
+        user.save(update_fields=['last_login'])
+        self.assertIsNotNone(cache.get(key), 'Permissions dropped on login')
+        user.is_active = False
+        user.save()
+        self.assertIsNone(cache.get(key), 'Permissions of inactive user kept')
+
+    def test_local_cache_not_used(self):
+        """
+        Test permissions are read on every write with a per process cache
+        """
+        for _ in range(2):
+            response, queries = self.post_status()
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertTrue([sql for sql in queries
+                             if 'auth_permission' in sql],
+                            'Permissions cached in a per process cache')
+
+
+class InstrumentationTest(FixtureTestCase):
+    """
+    Test request timing and profiling per view
+    """
+
+    def setUp(self):
+        super().setUp()
+        metrics.REGISTRY.reset()
+
+    def test_profiled_requests(self):
+        """
+        Test profiled requests report timings in headers and metrics
+        """
+        url = reverse('package-tracking', kwargs={'pk': 1})
+        with self.settings(METRICS_SAMPLE_RATE=1, METRICS_HEADERS=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            count = len(queries)
+            self.client.get(reverse('status-detail', kwargs={'pk': 2}))
+            self.client.get(reverse('package-batch'), {'ids': '1,2,99'})
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('"{0} queries, 0 duplicate"'.format(count), timing)
+        for name in ('serializer;dur=', 'render;dur=', 'total;dur='):
+            self.assertIn(name, timing)
+
+        url = reverse('metrics-list')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN,
+                         "Metrics shown to anonymous users")
+        self.client.force_authenticate(User.objects.get(username='admin'))
+        views = self.client.get(url).data['views']
+        tracking = views['PackageViewSet.tracking']
+        self.assertEqual(tracking['requests'], 1)
+        self.assertEqual(tracking['queries']['max'], count)
+        self.assertEqual(tracking['serializer_ms']['count'], 1)
+        self.assertGreater(tracking['serializer_ms']['max'], 0,
+                           'Serializer time not recorded')
+        self.assertGreater(tracking['render_ms']['max'], 0,
+                           'Render time not recorded')
+        self.assertEqual(views['StatusViewSet.retrieve']['requests'], 1)
+        self.assertGreater(
+            views['PackageViewSet.batch']['serializer_ms']['max'], 0,
+            'Values serializer time not recorded')
+
+        response = self.client.post(reverse('metrics-reset'))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT,
+                         "Can not reset metrics")
+        self.assertEqual(list(metrics.REGISTRY.to_representation()[
+            'views']), ['MetricsViewSet.reset'])
+
+    def test_unsampled_requests(self):
+        """
+        Test requests not sampled are only timed
+        """
+        with self.settings(METRICS_SAMPLE_RATE=0, METRICS_HEADERS=True):
+            response = self.client.get(reverse('package-list'))
+        self.assertNotIn('Server-Timing', response)
+        packages = metrics.REGISTRY.views['PackageViewSet.list']
+        self.assertEqual(packages.wall_ms.count, 1)
+        self.assertEqual(packages.sampled['queries'].count, 0)
+
+    def test_duplicate_queries(self):
+        """
+        Test repeated queries with the same params counted as duplicates
+        """
+        with metrics.Profile() as profile, \
+                connection.execute_wrapper(profile):
+            for pk in (1, 2, 1, 1):
+                Package.objects.filter(pk=pk).exists()
+        self.assertEqual((profile.queries, profile.duplicates), (4, 2))
+
+    def test_histogram(self):
+        """
+        Test histogram quantiles are bucket bounds capped by the max
+        """
+        histogram = metrics.Histogram((1, 10, 100))
+        for value in (0.5, 2, 3, 4, 50, 70, 80, 90, 95, 300):
+            histogram.observe(value)
+        data = histogram.to_representation()
+        self.assertEqual((data['count'], data['max']), (10, 300))
+        self.assertEqual((data['p50'], data['p95'], data['p99']),
+                         (100, 300, 300))
+        self.assertEqual(data['buckets'], {
+            '<=1': 1, '<=10': 3, '<=100': 5, '>100': 1})
+
+
+class BenchmarkApiTest(TransactionTestCase):
+    """
+    Test benchmarking api endpoints against latency budgets
+    """
+
+    def setUp(self):
+        cache.clear()
+        # benchmarks run in the test database instead of one of their own
+        for name in ('create_test_db', 'destroy_test_db'):
+            patcher = mock.patch.object(connection.creation, name)
+            self.addCleanup(patcher.stop)
+            setattr(self, name, patcher.start())
+
+    def test_bench_api(self):
+        """
+        Test results stored as json and budgets and regressions fail
+        Test benchmark writes commit in a database of their own
+        """
+        options = {'scales': '2x5', 'requests': 3, 'stdout': io.StringIO()}
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            with mock.patch.object(Change.objects, 'publish') as publish:
+                call_command('bench_api', output=output, **options)
+            with open(output) as results:
+                results = json.load(results)['results']
+            self.assertEqual([result['endpoint'] for result in results], [
+                'list', 'detail', 'tracking', 'tracking_post',
+                'status_delete'])
+            self.assertEqual(results[0]['requests'], 3)
+            self.assertLessEqual(results[0]['p50_ms'], results[0]['p99_ms'])
+            self.assertEqual(self.create_test_db.call_count, 1)
+            self.assertEqual(self.destroy_test_db.call_count, 1)
+            self.assertGreaterEqual(publish.call_count, 6,
+                                    'Benchmark writes not committed')
+            self.assertFalse(Status.objects.exists(),
+                             'Benchmark data not flushed')
+
+            budgets = os.path.join(directory, 'budgets.json')
+            with open(budgets, 'w') as budget:
+                json.dump({'tracking': 0}, budget)
+            with self.assertRaisesRegex(CommandError, 'tracking p95'):
+                call_command('bench_api', budgets=budgets,
+                             endpoints='tracking', **options)
+            for result in results:
+                result['p95_ms'] = 0.001
+            with open(output, 'w') as previous:
+                json.dump({'results': results}, previous)
+            with self.assertRaisesRegex(CommandError, 'detail .* regressed'):
+                call_command('bench_api', compare=output,
+                             endpoints='detail', **options)
+        options['scales'] = '2x'
+        with self.assertRaises(CommandError):
+            call_command('bench_api', **options)
+
+
+class WriteBehindTest(FixtureTestCase):
+    """
+    Test queueing tracking posts to be saved by drain workers
+    """
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = self.settings(
+            TRACKING_WRITE_BEHIND=True,
+            TRACKING_QUEUE=os.path.join(directory.name, 'queue.sqlite3'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.queue = ingest.get_queue()
+        self.client.force_authenticate(User.objects.get(username='demoer'))
+
+    def post_status(self, package_id, elevation):
+        """
+        Post a status to the tracking of a package
+        """
+        return self.client.post(
+            reverse('package-tracking', kwargs={'pk': package_id}),
+            {'latitude': 45, 'longitude': -75, 'elevation': elevation})
+
+    def test_read_own_writes(self):
+        """
+        Test posts are queued and read back with their token
+        """
+        statuses = Status.objects.count()
+        response = self.post_status(1, 10)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        token = response['X-Tracking-Token']
+        self.assertEqual(response.data['token'], token)
+        self.assertEqual(Status.objects.count(), statuses,
+                         'Status saved before it was drained')
+        self.assertEqual(self.queue.pending(), 1)
+        response = self.post_status(1, 'high')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.queue.pending(), 1, 'Invalid status queued')
+
+        url = reverse('package-tracking', kwargs={'pk': 1})
+        self.assertEqual(self.client.get(url).data['count'], 3)
+        response = self.client.get(url, HTTP_X_TRACKING_TOKEN=token)
+        self.assertEqual(response.data['count'], 4, 'Own write not read')
+        latest = response.data['results'][0]
+        self.assertEqual(latest['elevation'], 10)
+        self.assertEqual(LatestStatus.objects.get(package=1).status_id,
+                         latest['id'])
+        self.assertEqual(self.queue.pending(), 0)
+        for forged in ('x', '1:999999999',
+                       ingest.sign_token(self.queue, 2, 999999999)):
+            response = self.client.get(url, HTTP_X_TRACKING_TOKEN=forged)
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST, forged)
+
+    def test_flush_timeout(self):
+        """
+        Test reads get an error when their writes are not saved in time
+        Test tokens of another queue drain nothing
+        """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        other = ingest.IngestQueue(os.path.join(directory.name, 'other'))
+        self.post_status(1, 10)
+        url = reverse('package-tracking', kwargs={'pk': 1})
+        response = self.client.get(url, HTTP_X_TRACKING_TOKEN=(
+            ingest.sign_token(other, 1, 999999999)))
+        self.assertEqual(response.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(self.queue.pending(), 1,
+                         'Token of another queue drained this queue')
+
+        token = self.post_status(1, 10)['X-Tracking-Token']
+        self.queue.claim(10)
+        with mock.patch.object(PackageViewSet, 'tracking_flush_timeout', 0):
+            response = self.client.get(url, HTTP_X_TRACKING_TOKEN=token)
+        self.assertEqual(response.status_code,
+                         status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(self.queue.pending(), 2)
+
+    def test_drain_tracking(self):
+        """
+        Test workers drain queued statuses in batches
+        Test statuses of packages deleted while queued are dropped
+        """
+        package = Package.objects.create(description='deleted')
+        for elevation in range(3):
+            self.post_status(2, elevation)
+        self.post_status(package.id, 0)
+        package.delete()
+        statuses = Status.objects.count()
+        out = io.StringIO()
+        with mock.patch.object(ingest, 'save_statuses',
+                               wraps=ingest.save_statuses) as save:
+            call_command('drain_tracking', workers=1, batch_size=2,
+                         once=True, stdout=out)
+        self.assertIn('Drained 4 statuses, 0 queued', out.getvalue())
+        self.assertEqual(save.call_count, 2)
+        self.assertEqual(Status.objects.count(), statuses + 3)
+        self.assertEqual(
+            LatestStatus.objects.get(package=2).status.elevation, 2)
+        drained = Status.objects.filter(token__isnull=False)
+        self.assertEqual(
+            set(Change.objects.filter(
+                model='status', object_id__isnull=False).values_list(
+                    'object_id', flat=True)),
+            set(drained.values_list('id', flat=True)),
+            'Drained statuses not logged one by one')
+
+        # the batch of a worker stopped before acknowledging is redrained
+        self.post_status(2, 3)
+        with mock.patch.object(self.queue, 'ack'), \
+                mock.patch('api.events.transaction.on_commit',
+                           side_effect=lambda callback: callback()), \
+                mock.patch.object(events.BROKER, 'publish') as publish:
+            self.assertEqual(ingest.drain(self.queue, 10), 1)
+        (package_id, (position, values)), _ = publish.call_args
+        self.assertEqual((package_id, values['elevation']), (2, 3))
+        self.assertEqual(position, Change.objects.get(
+            model='status', object_id=values['id']).position,
+            'Drained status not published')
+        self.queue.lease = 0
+        self.assertEqual(ingest.drain(self.queue, 10), 1)
+        self.assertEqual(Status.objects.count(), statuses + 4,
+                         'Redrained status saved twice')
+        self.queue.lease = 60
+
+        rows = self.queue.claim(10)
+        self.assertEqual(rows, [], 'Drained statuses left in queue')
+        token = self.queue.put(2, timezone.now(), 1, 2, 3)
+        self.assertEqual([row[0] for row in self.queue.claim(10)], [token])
+        self.assertEqual(self.queue.claim(10), [], 'Claimed status reclaimed')
+        self.queue.lease = 0
+        self.assertEqual(len(self.queue.claim(10)), 1,
+                         'Status of expired claim not reclaimed')
+
+
+class ReplicaRoutingTest(FixtureTestCase):
+    """
+    Test reads are routed to a replica in a separate sqlite database
+    """
+    multi_db = True
+    replica = 'replica'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.databases[cls.replica] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(cls.directory.name, 'replica.sqlite3'),
+        }
+        connections.ensure_defaults(cls.replica)
+        connections.prepare_test_settings(cls.replica)
+        call_command('migrate', database=cls.replica, verbosity=0)
+        # fixtures are loaded into both databases
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.replica].close()
+        del connections[cls.replica]
+        del connections.databases[cls.replica]
+        cls.directory.cleanup()
+
+    def setUp(self):
+        super().setUp()
+        settings = self.settings(
+            DATABASE_REPLICAS=[self.replica], DB_REPLICA_CHECK_INTERVAL=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        routers.MONITOR.reset()
+        self.replicate_heartbeat()
+
+    def replicate_heartbeat(self, **values):
+        """
+        Copy the heartbeat of the primary to the replica
+        """
+        heartbeat = Heartbeat.objects.beat()
+        for name, value in values.items():
+            setattr(heartbeat, name, value)
+        heartbeat.save(using=self.replica)
+
+    def test_replica_reads(self):
+        """
+        Test reads are served by the replica unless it lags or fails
+        Test writes go to the primary
+        """
+        Heartbeat.objects.using(self.replica).all().delete()
+        self.assertIsNone(routers.LagMonitor.measure(self.replica),
+                          'Replica without heartbeat measured')
+        self.replicate_heartbeat()
+        self.assertEqual(routers.LagMonitor.measure(self.replica), 0)
+        package = Package.objects.create(description='not replicated')
+        self.assertFalse(Package.objects.using(self.replica).filter(
+            id=package.id).exists(), 'Write sent to replica')
+        self.assertEqual(routers.ReplicaRouter().db_for_write(Package),
+                         'default')
+        response = self.client.get(reverse('package-list'))
+        self.assertEqual(response.data['count'], 4, 'Not read from replica')
+        url = reverse('package-detail', kwargs={'pk': package.id})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNone(routers.get_read_alias(), 'Replica left routed')
+
+        # the replica last received a beat a minute ago
+        self.replicate_heartbeat(
+            beat=0, created=timezone.now() - timezone.timedelta(minutes=1))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK,
+                         'Lagging replica read from')
+        cache.clear()
+        self.replicate_heartbeat()
+        with mock.patch.object(routers.MONITOR, 'measure',
+                               side_effect=DatabaseError):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK,
+                         'Failing replica read from')
+
+    def test_read_own_writes(self):
+        """
+        Test clients read from the primary after their own writes
+        """
+        self.client.force_authenticate(User.objects.get(username='demoer'))
+        response = self.client.post(
+            reverse('package-list'), {'description': 'own write'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        url = reverse('package-detail', kwargs={'pk': response.data['id']})
+        self.assertIn(routers.STICKY_COOKIE, response.cookies)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = APIClient().get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        other = APIClient()
+        other.force_authenticate(User.objects.get(username='admin'))
+        other.cookies = self.client.cookies
+        response = other.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND,
+                         'Cookie of another user honoured')
+
+
+class CacheBackendTest(SimpleTestCase):
+    """
+    Test the default cache backend and its checks
+    """
+
+    def test_evicts_least_recently_used(self):
+        """
+        Test entries read recently are kept once the cache is full
+        """
+        lru = LRUMemCache('lru-test', {'OPTIONS': {'MAX_ENTRIES': 2}})
+        self.addCleanup(lru.clear)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('c', 3)
+        self.assertIsNone(lru.get('b'), 'Least recently used entry kept')
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('c'), 3)
+
+    def test_shared_cache_check(self):
+        """
+        Test per process cache is flagged outside of debug
+        """
+        with self.settings(DEBUG=True):
+            self.assertEqual(checks.check_shared_cache(None), [])
+        with self.settings(DEBUG=False):
+            warnings = checks.check_shared_cache(None)
+        self.assertEqual([warning.id for warning in warnings], ['api.W001'])
+
+
+class ResponseCacheTest(FixtureTestCase):
+    """
+    Test rendered responses are cached until their packages change
+    """
+
+    def test_cached_read_skips_database(self):
+        """
+        Test repeated read is served without querying
+        """
+        url = reverse('package-detail', kwargs={'pk': 2})
+        response = self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(url)
+        self.assertEqual(len(queries), 0, 'Cached read queried database')
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['Content-Type'], response['Content-Type'])
+
+    def test_etag_not_modified(self):
+        """
+        Test unchanged tracking is not sent again
+        Test adding status changes tracking etag
+        """
+        url = reverse('package-tracking', kwargs={'pk': 3})
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries), 0, 'Not modified check queried')
+
+        user = User.objects.get(username='demoer')
+        self.client.force_authenticate(user)
+        data = {'latitude': 45, 'longitude': 0, 'elevation': 1}
+        self.client.post(url, data)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK,
+                         'Stale tracking reported as not modified')
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['results'][0]['latitude'], 45)
+
+    def test_orm_write_invalidates(self):
+        """
+        Test package list changes when a status is deleted
+        Test other package details stay cached
+        """
+        list_url = reverse('package-list')
+        detail_url = reverse('package-detail', kwargs={'pk': 1})
+        listing = self.client.get(list_url)
+        detail = self.client.get(detail_url)
+        Status.objects.filter(package=2).first().delete()
+        self.assertNotEqual(self.client.get(list_url)['ETag'],
+                            listing['ETag'], 'Package list not invalidated')
+        self.assertEqual(self.client.get(detail_url)['ETag'],
+                         detail['ETag'], 'Unchanged package invalidated')
+
+    def test_browsable_api_not_cached(self):
+        """
+        Test browsable api responses are not cached
+        """
+        url = reverse('package-detail', kwargs={'pk': 2})
+        response = self.client.get(url, {'format': 'api'})
+        self.assertFalse(response.has_header('ETag'))
+
+
 class ApiEndpointsTest(FixtureTestCase):
     """
     Test package url endpoints
@@ -187,6 +1548,73 @@ class ApiEndpointsTest(FixtureTestCase):
                          "Can not access package-list")
         self.assertIsNotNone(response.data['results'])
 
+    def test_get_packages_tracking_limit(self):
+        """
+        Test package list embeds only the latest statuses of each package
+        """
+        url = reverse('package-list')
+        limit = 2
+        response = self.client.get(url, {'tracking': limit})
+        self.assert_http(response, status.HTTP_200_OK,
+                         "Can not access package-list")
+        for pkg in response.data['results']:
+            latest = Status.objects.filter(
+                package=pkg['id']).order_by('-created', '-id')[:limit]
+            self.assertEqual([s['id'] for s in pkg['tracking']],
+                             [s.id for s in latest],
+                             'Package tracking not limited to latest')
+        response = self.client.get(url, {'tracking': 0})
+        for pkg in response.data['results']:
+            self.assertEqual(pkg['tracking'], [],
+                             'Package tracking should be empty')
+
+    def test_get_packages_query_count(self):
+        """
+        Test package list query count does not grow with page size
+        """
+        url = reverse('package-list')
+        counts = []
+        for limit in [1, 4]:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {'limit': limit})
+            self.assert_http(response, status.HTTP_200_OK,
+                             "Can not access package-list")
+            self.assertEqual(len(response.data['results']), limit)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1],
+                         'Package list queries grow with page size')
+
+    def test_get_package_positions(self):
+        """
+        Test latest status of all packages is listed
+        Test package latest status follows status deletion
+        """
+        url = reverse('package-positions')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assert_http(response, status.HTTP_200_OK,
+                         "Can not access package-positions")
+        self.assertEqual(len(queries), 2, 'Positions not read in fixed queries')
+        latest = [Status.objects.filter(package=pkg).first().id
+                  for pkg in Package.objects.all()]
+        self.assertEqual([s['id'] for s in response.data['results']],
+                         latest, 'Wrong package positions')
+
+        detail_url = reverse('package-detail', kwargs={'pk': 2})
+        response = self.client.get(detail_url)
+        self.assertEqual(response.data['latest_status']['id'], latest[1],
+                         'Wrong package latest status')
+        user = User.objects.get(username='admin')
+        self.client.force_authenticate(user)
+        url = reverse('status-detail', kwargs={'pk': latest[1]})
+        response = self.client.delete(url)
+        self.assert_http(response, status.HTTP_204_NO_CONTENT,
+                         "Wrong http status for successful deletion")
+        response = self.client.get(detail_url)
+        self.assertEqual(response.data['latest_status']['id'],
+                         Status.objects.filter(package=2).first().id,
+                         'Package latest status not updated on delete')
+
     def test_create_package(self):
         """
         Test creation of package with proper permissions
@@ -345,6 +1773,251 @@ class ApiEndpointsTest(FixtureTestCase):
         self.assertNotIn('package', response.data['results'][0],
                          'Status has redundant package field')
 
+    def test_get_package_statuses_cursor(self):
+        """
+        Test cursor pagination walks the tracking list without a count
+        Test previous cursor returns only newer statuses
+        """
+        url = reverse('package-tracking', kwargs={'pk': 3})
+        expected = list(Status.objects.filter(package=3).order_by(
+            '-created', '-id').values_list('id', flat=True))
+        seen = []
+        response = self.client.get(url, {'cursor': '', 'limit': 2})
+        first = response
+        while True:
+            self.assert_http(response, status.HTTP_200_OK,
+                             "Can not page package tracking history")
+            self.assertNotIn('count', response.data,
+                             'Cursor pagination should not count')
+            seen.extend(s['id'] for s in response.data['results'])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(seen, expected, 'Cursor pages out of order')
+
+        response = self.client.get(first.data['previous'])
+        self.assertEqual(response.data['results'], [],
+                         'No statuses should be newer than the latest')
+        pkg_status = Status.objects.create(
+            package_id=3, latitude=1, longitude=1, elevation=1)
+        response = self.client.get(first.data['previous'])
+        self.assertEqual([s['id'] for s in response.data['results']],
+                         [pkg_status.id], 'Newer status not returned')
+
+        response = self.client.get(url, {'cursor': 'invalid'})
+        self.assert_http(response, status.HTTP_404_NOT_FOUND,
+                         'Wrong response for invalid cursor')
+
+    def test_export_package_statuses(self):
+        """
+        Test full tracking history is streamed as ndjson and csv
+        Test history is read in fixed size chunks
+        """
+        url = reverse('package-tracking', kwargs={'pk': 3})
+        expected = self.client.get(url, {'limit': 100}).data['results']
+        url = reverse('package-export', kwargs={'pk': 3})
+        with mock.patch.object(PackageViewSet, 'export_chunk_size', 2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+                content = b''.join(response.streaming_content)
+        self.assert_http(response, status.HTTP_200_OK,
+                         "Can not export package tracking history")
+        self.assertEqual(response['Content-Type'],
+                         'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual(rows, json.loads(JSONRenderer().render(expected)),
+                         'Exported history differs from tracking')
+        # package and archive lookups then one query per chunk of two
+        self.assertEqual(len(queries), 2 + len(rows) // 2 + 1)
+
+        for response in (
+                self.client.get(url, {'format': 'csv'}),
+                self.client.get(reverse('package-export', kwargs={
+                    'pk': 3, 'format': 'csv'}))):
+            self.assertEqual(response['Content-Type'],
+                             'text/csv; charset=utf-8')
+            content = b''.join(response.streaming_content).decode()
+            rows = list(csv.DictReader(io.StringIO(content)))
+            self.assertEqual([int(row['id']) for row in rows],
+                             [row['id'] for row in expected])
+
+        url = reverse('package-export', kwargs={'pk': 99})
+        response = self.client.get(url)
+        self.assert_http(response, status.HTTP_404_NOT_FOUND,
+                         "Wrong status code for missing package")
+
+    def test_get_package_statuses_spatial(self):
+        """
+        Test tracking filtered by bounding box and radius
+        """
+        url = reverse('package-tracking', kwargs={'pk': 3})
+        statuses = Status.objects.filter(package=3)
+        response = self.client.get(url, {'bbox': '-83,45,-81,47'})
+        self.assert_http(response, status.HTTP_200_OK,
+                         "Can not filter package tracking by bbox")
+        expected = [s.id for s in statuses
+                    if -83 <= s.latitude <= -81 and 45 <= s.longitude <= 47]
+        self.assertTrue(expected)
+        self.assertEqual([s['id'] for s in response.data['results']],
+                         expected, 'Wrong statuses in bounding box')
+
+        center = statuses[1]
+        response = self.client.get(url, {
+            'near': '{0},{1}'.format(center.latitude, center.longitude),
+            'radius': 50})
+        self.assertEqual([s['id'] for s in response.data['results']],
+                         [center.id], 'Wrong statuses in radius')
+        self.assertEqual(response.data['count'], 1)
+
+        # radius filtered before paging so pages are full and counted
+        radius = 300
+        expected = [s.id for s in statuses if spatial.haversine_km(
+            center.latitude, center.longitude,
+            s.latitude, s.longitude) <= radius]
+        self.assertGreater(len(expected), 1)
+        response = self.client.get(url, {
+            'near': '{0},{1}'.format(center.latitude, center.longitude),
+            'radius': radius, 'limit': len(expected) - 1})
+        self.assertEqual(response.data['count'], len(expected))
+        self.assertEqual([s['id'] for s in response.data['results']],
+                         expected[:-1], 'Radius page not filled')
+        response = self.client.get(url, {'near': '0,0'})
+        self.assert_http(response, status.HTTP_400_BAD_REQUEST,
+                         "Wrong response for radius query without radius")
+
+    def test_get_package_statuses_time_range(self):
+        """
+        Test tracking filtered by creation time
+        """
+        url = reverse('package-tracking', kwargs={'pk': 4})
+        response = self.client.get(url, {'since': '2017-08-04T20:00:00Z'})
+        self.assertEqual([s['id'] for s in response.data['results']], [15],
+                         'Wrong statuses since time')
+        response = self.client.get(url, {'until': '2017-08-04T20:00:00'})
+        self.assertEqual(response.data['count'], 3,
+                         'Wrong statuses until time')
+        response = self.client.get(url, {'since': 'yesterday'})
+        self.assert_http(response, status.HTTP_400_BAD_REQUEST,
+                         "Wrong response for invalid time")
+
+    def test_get_package_statuses_downsampled(self):
+        """
+        Test tracking downsampled by time bucket
+        Test tracking simplified keeping points off the line
+        """
+        url = reverse('package-tracking', kwargs={'pk': 4})
+        response = self.client.get(url, {'resolution': 3600})
+        self.assert_http(response, status.HTTP_200_OK,
+                         "Can not downsample package tracking")
+        self.assertEqual([s['id'] for s in response.data['results']],
+                         [15, 17], 'Wrong statuses for time buckets')
+
+        start = timezone.now()
+        track = [
+            Status.objects.create(
+                package_id=1, latitude=0, longitude=i / 1000,
+                elevation=100 - 20 * abs(i - 5),
+                created=start + timezone.timedelta(seconds=i))
+            for i in range(10)
+        ]
+        url = reverse('package-tracking', kwargs={'pk': 1})
+        response = self.client.get(url, {'simplify': 10, 'since': start})
+        self.assertEqual([s['id'] for s in response.data['results']],
+                         [track[9].id, track[5].id, track[0].id],
+                         'Wrong statuses for simplified track')
+        self.assertEqual(response.data['count'], 3)
+        response = self.client.get(url, {'simplify': -1})
+        self.assert_http(response, status.HTTP_400_BAD_REQUEST,
+                         "Wrong response for invalid tolerance")
+
+        cache.clear()
+        with mock.patch.object(tracks.Downsampler, 'max_simplify_rows', 9):
+            response = self.client.get(url, {'simplify': 10, 'since': start})
+        self.assert_http(response, status.HTTP_400_BAD_REQUEST,
+                         "Simplified track over the cap")
+        self.assertIn('simplify', response.data)
+        with mock.patch.object(tracks.Downsampler, 'max_rows', 2):
+            response = self.client.get(url, {'resolution': 1})
+        self.assert_http(response, status.HTTP_400_BAD_REQUEST,
+                         "Downsampled track over the cap")
+        self.assertIn('resolution', response.data)
+
+    def test_get_package_stats(self):
+        """
+        Test track stats of package
+        Test stats of closed windows reused until a status changes in them
+        """
+        package = Package.objects.create(description='Stats')
+        start = timezone.datetime(2020, 1, 1, tzinfo=timezone.utc)
+        for hours, longitude, elevation in ((0, 0, 0), (1, 1, 100),
+                                            (24, 2, 50)):
+            Status.objects.create(
+                package=package, latitude=0, longitude=longitude,
+                elevation=elevation,
+                created=start + timezone.timedelta(hours=hours))
+        url = reverse('package-stats', kwargs={'pk': package.id})
+        response = self.client.get(url)
+        self.assert_http(response, status.HTTP_200_OK,
+                         "Can not get package stats")
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(response.data['since'], start)
+        self.assertEqual(response.data['duration'], 24 * 60 * 60)
+        self.assertAlmostEqual(response.data['distance'],
+                               2 * spatial.KM_PER_DEGREE, places=3)
+        self.assertAlmostEqual(response.data['max_speed'],
+                               spatial.KM_PER_DEGREE, places=3)
+        self.assertAlmostEqual(response.data['average_speed'],
+                               spatial.KM_PER_DEGREE / 12, places=3)
+        self.assertEqual(response.data['climb'], 100)
+        self.assertEqual(response.data['descent'], 50)
+
+        # time bounds of the hot and archive tiers
+        with self.assertNumQueries(2):
+            stats = tracks.package_stats(package.id)
+        self.assertEqual(stats.count, 3, 'Cached stats not reused')
+        Status.objects.create(
+            package=package, latitude=0, longitude=1, elevation=0,
+            created=start + timezone.timedelta(hours=2))
+        stats = tracks.package_stats(package.id)
+        self.assertEqual((stats.count, stats.climb), (4, 150),
+                         'Changed window not recomputed')
+        self.assertEqual(tracks.window_runs([1, 2, 5, 20, 21]),
+                         [(1, 5), (20, 21)])
+        now = timezone.now()
+        Status.objects.create(package=package, latitude=0, longitude=1,
+                              elevation=0, created=now)
+        tracks.package_stats(package.id)
+        with mock.patch.object(tracks, 'compute_windows',
+                               wraps=tracks.compute_windows) as compute, \
+                mock.patch.object(tracks.transaction, 'on_commit') as commit:
+            tracks.invalidate_stats([(package.id, start)])
+            tracks.package_stats(package.id)
+        self.assertTrue(commit.called, 'Stats not dropped again on commit')
+        first, today = tracks.stats_window(start), tracks.stats_window(now)
+        block_end = (first // tracks.STATS_BLOCK + 1) * tracks.STATS_BLOCK - 1
+        self.assertEqual([call[0][1:] for call in compute.call_args_list],
+                         [(first, block_end), (today, today)],
+                         'Read more than missing windows')
+
+        url = reverse('package-stats', kwargs={'pk': 1})
+        Status.objects.filter(package=1).delete()
+        response = self.client.get(url)
+        self.assertEqual(response.data, {'count': 0})
+
+    def test_get_package_positions_spatial(self):
+        """
+        Test latest positions filtered by radius
+        """
+        url = reverse('package-positions')
+        latest = Status.objects.filter(package=4).first()
+        response = self.client.get(url, {
+            'near': '{0},{1}'.format(latest.latitude, latest.longitude),
+            'radius': 1})
+        self.assert_http(response, status.HTTP_200_OK,
+                         "Can not filter package positions by radius")
+        self.assertEqual([s['id'] for s in response.data['results']],
+                         [latest.id], 'Wrong positions in radius')
+
     def test_update_package_status(self):
         """
         Test add package status
@@ -370,3 +2043,383 @@ class ApiEndpointsTest(FixtureTestCase):
                          "Status not successfully created")
         self.assertEqual(45, response.data['latitude'],
                          'Incorrect tracking details created')
+
+    def test_update_package_status_query_count(self):
+        """
+        Test adding package status does not grow with tracking history
+        """
+        user = User.objects.get(username='demoer')
+        self.client.force_authenticate(user)
+        url = reverse('package-tracking', kwargs={'pk': 3})
+        data = {'latitude': 45, 'longitude': 0, 'elevation': 1}
+        # warm up user permission cache
+        self.client.post(url, data)
+        counts = []
+        for history in [10, 1000]:
+            Status.objects.bulk_create([
+                Status(package_id=3, latitude=0, longitude=0, elevation=0)
+                for _ in range(history)
+            ])
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(url, data)
+            self.assert_http(response, status.HTTP_201_CREATED,
+                             "Status not successfully created")
+            counts.append(len(queries))
+            reads = ' '.join(q['sql'] for q in queries.captured_queries
+                             if not q['sql'].startswith('INSERT'))
+            self.assertNotIn('api_status', reads,
+                             'Status history read on status create')
+        self.assertEqual(counts[0], counts[1],
+                         'Status create queries grow with history')
+        self.assertTrue(response.data['package'].endswith('/packages/3'),
+                        'Status created with wrong package')
+
+    def test_get_packages_batch(self):
+        """
+        Test latest statuses of many packages fetched keyed by id
+        Test query count does not grow with the number of ids
+        """
+        url = reverse('package-batch')
+        package = Package.objects.create(description='no statuses')
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'ids': '1'})
+        self.assert_http(response, status.HTTP_200_OK,
+                         "Can not get packages in batch")
+        ids = [1, 2, 3, 4, package.id, 99]
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                url, {'ids': ','.join(str(pk) for pk in ids)})
+        self.assertEqual(list(response.data), ids)
+        for pk in (1, 2, 3, 4):
+            detail = self.client.get(
+                reverse('package-detail', kwargs={'pk': pk})).data
+            self.assertEqual(response.data[pk]['description'],
+                             detail['description'])
+            self.assertEqual(response.data[pk]['latest_status'],
+                             detail['latest_status'],
+                             'Batch latest status differs from detail')
+        self.assertIsNone(response.data[package.id]['latest_status'])
+        self.assertIsNone(response.data[99], 'Missing package not null')
+
+        for ids in ('1,x', ','.join(str(pk) for pk in range(501))):
+            response = self.client.get(url, {'ids': ids})
+            self.assert_http(response, status.HTTP_400_BAD_REQUEST,
+                             "Invalid batch ids accepted")
+
+    @staticmethod
+    def open_stream(response):
+        """
+        Get the closing iterator the test client wraps streaming content
+        in, closing it closes the response without closing the test
+        database connection as a request finishing would
+        """
+        return response._iterator
+
+    def test_stream_package_statuses(self):
+        """
+        Test committed statuses are pushed to package subscribers
+        Test stream resumes after the last event id from the change log
+        Test slow subscriber is told to resume
+        """
+        url = reverse('package-stream')
+        response = self.client.get(url, {'packages': '1,99'})
+        self.assert_http(response, status.HTTP_400_BAD_REQUEST,
+                         "Wrong response for missing package")
+
+        with mock.patch('api.events.transaction.on_commit',
+                        side_effect=lambda callback: callback()), \
+                mock.patch.object(PackageViewSet, 'stream_heartbeat', 0):
+            response = self.client.get(url, {'packages': '1,2'})
+            self.assert_http(response, status.HTTP_200_OK,
+                             "Can not stream package statuses")
+            self.assertEqual(response['Content-Type'],
+                             'text/event-stream; charset=utf-8')
+            stream = self.open_stream(response)
+            self.assertEqual(next(stream), b':\n\n', 'No keep alive')
+            created = Status.objects.create(
+                package_id=1, latitude=1, longitude=2, elevation=3)
+            Status.objects.create(
+                package_id=3, latitude=1, longitude=2, elevation=3)
+            message = next(stream).decode('utf-8')
+            change = Change.objects.get(model='status', object_id=created.id)
+            self.assertTrue(message.startswith(
+                'id: {0}\nevent: status\ndata: '.format(change.position)))
+            data = json.loads(message.split('data: ', 1)[1])
+            self.assertEqual((data['id'], data['package']),
+                             (created.id, 'http://testserver/packages/1'))
+            stream.close()
+            self.assertEqual(events.BROKER.subscriptions, {},
+                             'Subscription not closed with response')
+
+            response = self.client.get(
+                url, {'packages': '1'},
+                HTTP_LAST_EVENT_ID=str(change.position - 1))
+            stream = self.open_stream(response)
+            message = next(stream).decode('utf-8')
+            self.assertTrue(
+                message.startswith('id: {0}\n'.format(change.position)),
+                'Status not replayed after last event id')
+            late = Status(package_id=1, latitude=1, longitude=2, elevation=3)
+            events.BROKER.publish(1, events.status_event(
+                change.position, late))
+            self.assertEqual(next(stream), b':\n\n',
+                             'Replayed status pushed again')
+            events.BROKER.publish(1, events.status_event(
+                change.position + 2, late))
+            events.BROKER.publish(1, events.status_event(
+                change.position + 1, late))
+            self.assertEqual(
+                [next(stream).decode('utf-8').split('\n', 1)[0]
+                 for _ in range(2)],
+                ['id: {0}'.format(change.position + 2),
+                 'id: {0}'.format(change.position + 1)],
+                'Status committed out of order dropped')
+            stream.close()
+
+            with mock.patch.object(PackageViewSet, 'stream_max_pending', 1):
+                response = self.client.get(url, {'packages': '1'})
+                stream = self.open_stream(response)
+                next(stream)
+            for _ in range(2):
+                Status.objects.create(
+                    package_id=1, latitude=1, longitude=2, elevation=3)
+            self.assertEqual(list(stream), [
+                b'event: overflow\ndata: {"after":null}\n\n'])
+        self.assertEqual(events.BROKER.subscriptions, {},
+                         'Subscription not closed with stream')
+
+    def test_stream_package_statuses_async(self):
+        """
+        Test event streams can be read on an event loop by ASGI servers
+        """
+        with mock.patch.object(PackageViewSet, 'stream_heartbeat', 0.01):
+            response = self.client.get(
+                reverse('package-stream'), {'packages': '1'})
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def run_sync(func):
+            return func()
+
+        async def read():
+            chunks = response.async_stream(run_sync)
+            self.assertEqual(await chunks.__anext__(), b':\n\n',
+                             'No keep alive')
+            events.BROKER.publish(1, events.status_event(7, Status(
+                package_id=1, latitude=1, longitude=2, elevation=3)))
+            chunk = b':\n\n'
+            while chunk == b':\n\n':
+                chunk = await chunks.__anext__()
+            self.assertTrue(chunk.startswith(b'id: 7\nevent: status\n'))
+            await chunks.aclose()
+
+        loop.run_until_complete(read())
+        self.assertEqual(events.BROKER.subscriptions, {},
+                         'Subscription not closed with stream')
+
+    def test_batch_create_statuses(self):
+        """
+        Test creating statuses for many packages in one request
+        Test invalid statuses are reported by index
+        """
+        url = reverse('status-batch')
+        data = [
+            {'package': 1, 'latitude': 45, 'longitude': 0, 'elevation': 1},
+            {'package': 99, 'latitude': 45, 'longitude': 0, 'elevation': 1},
+            {'package': 2, 'latitude': -100, 'longitude': 0, 'elevation': 1},
+            {'package': 3, 'latitude': 10, 'longitude': 20, 'elevation': 3,
+             'created': '2018-01-01T00:00:00Z'},
+        ]
+        response = self.client.post(url, data, format='json')
+        self.assert_http(response, status.HTTP_403_FORBIDDEN,
+                         "Should have gotten a forbidden status")
+        user = User.objects.get(username='demoer')
+        self.client.force_authenticate(user)
+        count = Status.objects.count()
+        response = self.client.post(url, data, format='json')
+        self.assert_http(response, status.HTTP_201_CREATED,
+                         "Statuses not successfully created")
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([e['index'] for e in response.data['errors']],
+                         [1, 2], 'Invalid statuses not reported')
+        self.assertIn('package', response.data['errors'][0]['errors'])
+        self.assertIn('latitude', response.data['errors'][1]['errors'])
+        self.assertEqual(Status.objects.count(), count + 2)
+        self.assertEqual(LatestStatus.objects.get(package=1).status,
+                         Status.objects.filter(package=1).first(),
+                         'Latest status not updated by batch')
+        self.assertTrue(
+            Status.objects.filter(package=3, created__year=2018).exists(),
+            'Status reading time not kept')
+
+        response = self.client.post(url, data[1:3], format='json')
+        self.assert_http(response, status.HTTP_400_BAD_REQUEST,
+                         "Wrong response for all invalid statuses")
+        response = self.client.post(url, data[0], format='json')
+        self.assert_http(response, status.HTTP_400_BAD_REQUEST,
+                         "Wrong response for non list batch")
+
+    def test_get_changes(self):
+        """
+        Test change feed lists writes after the token in order
+        Test change feed filtered by package
+        """
+        url = reverse('change-list')
+        response = self.client.get(url)
+        self.assert_http(response, status.HTTP_200_OK,
+                         "Can not access change-list")
+        self.assertEqual(response.data['results'], [],
+                         'Fixtures logged as changes')
+        after = response.data['after']
+
+        user = User.objects.get(username='admin')
+        self.client.force_authenticate(user)
+        response = self.client.post(reverse('package-list'),
+                                    {'description': 'Feed'})
+        package = response.data['id']
+        tracking = reverse('package-tracking', kwargs={'pk': package})
+        response = self.client.post(tracking, {
+            'latitude': 1, 'longitude': 2, 'elevation': 3})
+        pkg_status = response.data['id']
+        self.client.patch(reverse('package-detail', kwargs={'pk': package}),
+                          {'description': 'Feed updated'})
+        self.client.delete(reverse('status-detail', kwargs={'pk': pkg_status}))
+        self.client.post(reverse('status-batch'), [
+            {'package': 2, 'latitude': 0, 'longitude': 0, 'elevation': 0},
+        ], format='json')
+        self.client.delete(reverse('package-detail', kwargs={'pk': package}))
+
+        response = self.client.get(url, {'after': after, 'limit': 5})
+        changes = [(c['model'], c['object_id'], c['package'], c['action'])
+                   for c in response.data['results']]
+        self.assertEqual(changes, [
+            ('package', package, package, Change.CREATE),
+            ('status', pkg_status, package, Change.CREATE),
+            ('package', package, package, Change.UPDATE),
+            ('status', pkg_status, package, Change.DELETE),
+            ('status', None, 2, Change.CREATE),
+        ], 'Wrong changes after token')
+        self.assertTrue(response.data['more'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(
+            [(c['object_id'], c['action']) for c in response.data['results']],
+            [(package, Change.DELETE)], 'Wrong changes after next token')
+        self.assertFalse(response.data['more'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.data['results'], [],
+                         'Changes repeated after last token')
+
+        response = self.client.get(url, {'after': after, 'package': 2})
+        self.assertEqual(len(response.data['results']), 1,
+                         'Wrong changes for package')
+        response = self.client.get(url, {'after': 'latest'})
+        self.assert_http(response, status.HTTP_400_BAD_REQUEST,
+                         "Wrong response for invalid token")
+
+    def test_get_changes_commit_order(self):
+        """
+        Test change committed after a token with a lower id is not skipped
+        Test tokens older than pruned changes are gone
+        """
+        url = reverse('change-list')
+        first = Change.objects.create(
+            id=1000, model='package', object_id=1, package_id=1,
+            action=Change.UPDATE)
+        response = self.client.get(url)
+        self.assertEqual([c['id'] for c in response.data['results']],
+                         [first.id], 'Wrong changes before token')
+        after = response.data['after']
+        late = Change.objects.create(
+            id=500, model='package', object_id=2, package_id=2,
+            action=Change.UPDATE)
+        response = self.client.get(url, {'after': after})
+        self.assertEqual(
+            [(c['id'], c['position']) for c in response.data['results']],
+            [(late.id, after + 1)], 'Late commit skipped after token')
+
+        out = io.StringIO()
+        call_command('prune_changes', days=0, stdout=out)
+        self.assertIn('Pruned 2 changes', out.getvalue())
+        self.assertFalse(Change.objects.exists())
+        response = self.client.get(url, {'after': after})
+        self.assert_http(response, status.HTTP_410_GONE,
+                         "Wrong response for pruned token")
+        response = self.client.get(url, {'after': after + 1})
+        self.assert_http(response, status.HTTP_200_OK,
+                         "Can not poll after pruned changes")
+
+    def test_get_package_statuses_packed(self):
+        """
+        Test tracking negotiated as packed statuses
+        Test errors still rendered as json
+        """
+        url = reverse('package-tracking', kwargs={'pk': 4})
+        json_response = self.client.get(url, {'limit': 2})
+        response = self.client.get(
+            url, {'limit': 2}, HTTP_ACCEPT=PackedStatusRenderer.media_type)
+        self.assert_http(response, status.HTTP_200_OK,
+                         "Can not get packed package tracking")
+        self.assertEqual(response['Content-Type'],
+                         PackedStatusRenderer.media_type)
+        self.assertLess(len(response.content), len(json_response.content))
+        rows, count, next_link, _ = packing.unpack(response.content)
+        self.assertEqual((count, next_link), (json_response.data['count'],
+                                              json_response.data['next']))
+        for row, expected in zip(rows, json_response.data['results']):
+            self.assertEqual(row['id'], expected['id'])
+            self.assertEqual(row['latitude'], expected['latitude'])
+            self.assertEqual(row['created'].isoformat().replace(
+                '+00:00', 'Z'), expected['created'])
+
+        response = self.client.get(url + '.packed', {'since': 'yesterday'})
+        self.assert_http(response, status.HTTP_400_BAD_REQUEST,
+                         "Wrong response for invalid time")
+        self.assertIn('since', json.loads(response.content.decode()))
+
+    def test_batch_create_statuses_packed(self):
+        """
+        Test creating statuses uploaded as packed statuses
+        """
+        user = User.objects.get(username='demoer')
+        self.client.force_authenticate(user)
+        url = reverse('status-batch')
+        data = packing.pack([
+            {'package': 1, 'latitude': 45, 'longitude': 0, 'elevation': 1,
+             'created': '2018-01-01T00:00:00Z'},
+            {'package': 3, 'latitude': 46, 'longitude': 1, 'elevation': 2,
+             'created': '2018-01-01T00:00:01Z'},
+        ])
+        response = self.client.post(
+            url, data, content_type=PackedStatusRenderer.media_type)
+        self.assert_http(response, status.HTTP_201_CREATED,
+                         "Statuses not successfully created")
+        self.assertEqual(response.data['created'], 2)
+        self.assertTrue(Status.objects.filter(
+            package=3, latitude=46, created__year=2018).exists())
+        response = self.client.post(
+            url, b'TRK', content_type=PackedStatusRenderer.media_type)
+        self.assert_http(response, status.HTTP_400_BAD_REQUEST,
+                         "Wrong response for malformed packed statuses")
+
+    def test_batch_create_statuses_ndjson(self):
+        """
+        Test creating statuses from newline delimited json
+        """
+        user = User.objects.get(username='demoer')
+        self.client.force_authenticate(user)
+        url = reverse('status-batch')
+        lines = [
+            json.dumps({'package': pkg, 'latitude': 1,
+                        'longitude': 2, 'elevation': 3})
+            for pkg in [1, 2, 3, 4]
+        ]
+        count = Status.objects.count()
+        response = self.client.post(url, '\n'.join(lines) + '\n',
+                                    content_type='application/x-ndjson')
+        self.assert_http(response, status.HTTP_201_CREATED,
+                         "Statuses not successfully created")
+        self.assertEqual(Status.objects.count(), count + len(lines))
+        response = self.client.post(url, '{"package": 1,\n',
+                                    content_type='application/x-ndjson')
+        self.assert_http(response, status.HTTP_400_BAD_REQUEST,
+                         "Wrong response for malformed ndjson")
@@ -0,0 +1,427 @@
+"""
+Define processing of package tracks
+"""
+
+import math
+from collections import OrderedDict
+from datetime import datetime
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import (
+    Max,
+    Min,
+)
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .models import (
+    ArchivedStatus,
+    Status,
+    TieredStatuses,
+)
+from .spatial import (
+    EARTH_RADIUS_KM,
+    KM_PER_DEGREE,
+)
+
+METRES_PER_DEGREE = KM_PER_DEGREE * 1000
+# track stats of each closed window of this many seconds are cached
+STATS_WINDOW = 24 * 60 * 60
+# windows cached together in one entry, so sparse tracks take few entries
+STATS_BLOCK = 32
+# seconds cached window stats are kept, so they do not pin the cache
+STATS_TIMEOUT = 7 * 24 * 60 * 60
+# cached windows between missing ones read again rather than split reads
+STATS_MAX_GAP = 7
+STATS_CHUNK_SIZE = 5000
+
+
+def parse_time(query_params, name):
+    """
+    Parse ISO 8601 datetime query param, naive times are in current zone
+    """
+    value = query_params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: ['Expected an ISO 8601 datetime.']})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def filter_time_range(queryset, query_params):
+    """
+    Filter statuses created from `since` up to and including `until`
+    """
+    since = parse_time(query_params, 'since')
+    until = parse_time(query_params, 'until')
+    if since is not None:
+        queryset = queryset.filter(created__gte=since)
+    if until is not None:
+        queryset = queryset.filter(created__lte=until)
+    return queryset
+
+
+def parse_positive(query_params, name):
+    """
+    Parse positive number query param
+    """
+    value = query_params.get(name)
+    if value is None:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        number = 0
+    if not number > 0 or not math.isfinite(number):
+        raise ValidationError({name: ['Expected a positive number.']})
+    return number
+
+
+class Downsampler:
+    """
+    Reduce status rows of a track ordered by recency
+    `resolution=seconds` keeps the most recent status in each time bucket
+    `simplify=metres` keeps statuses the Douglas-Peucker algorithm needs to
+    stay within the distance of the full track by lat, lng and elevation
+    Tracks are held in memory so longer ones are rejected, simplifying is
+    quadratic at worst so is capped lower
+    """
+    resolution_query_param = 'resolution'
+    simplify_query_param = 'simplify'
+    max_rows = 50000
+    max_simplify_rows = 5000
+
+    def __init__(self, resolution=None, tolerance=None):
+        self.resolution = resolution
+        self.tolerance = tolerance
+
+    @classmethod
+    def from_params(cls, query_params):
+        """
+        Get downsampler from request params or None if not downsampled
+        """
+        resolution = parse_positive(query_params, cls.resolution_query_param)
+        tolerance = parse_positive(query_params, cls.simplify_query_param)
+        if resolution is None and tolerance is None:
+            return None
+        return cls(resolution, tolerance)
+
+    def apply(self, rows):
+        """
+        Downsample iterable of status values
+        """
+        rows = self.limit(rows, self.max_rows)
+        if self.resolution is not None:
+            rows = self.bucket(rows, self.resolution)
+        if self.tolerance is not None:
+            rows = self.simplify(list(self.limit(
+                rows, self.max_simplify_rows)), self.tolerance)
+        return list(rows)
+
+    def limit(self, rows, limit):
+        """
+        Pass rows through, rejecting tracks of more than limit rows
+        """
+        for count, row in enumerate(rows, 1):
+            if count > limit:
+                name = self.simplify_query_param \
+                    if self.resolution is None else \
+                    self.resolution_query_param
+                raise ValidationError({name: [
+                    'Track has more than {0} statuses, narrow it with '
+                    'since and until or a coarser resolution.'.format(
+                        limit)]})
+            yield row
+
+    @staticmethod
+    def bucket(rows, resolution):
+        """
+        Keep the first row seen in each time bucket
+        """
+        previous = None
+        for row in rows:
+            key = math.floor(row['created'].timestamp() / resolution)
+            if key != previous:
+                previous = key
+                yield row
+
+    @staticmethod
+    def simplify(rows, tolerance):
+        """
+        Douglas-Peucker simplification keeping the track ends
+        """
+        if len(rows) < 3:
+            return rows
+        origin = math.cos(math.radians(float(rows[0]['latitude'])))
+        points = [(float(row['longitude']) * METRES_PER_DEGREE * origin,
+                   float(row['latitude']) * METRES_PER_DEGREE,
+                   float(row['elevation'])) for row in rows]
+        keep = [False] * len(rows)
+        keep[0] = keep[-1] = True
+        stack = [(0, len(rows) - 1)]
+        while stack:
+            first, last = stack.pop()
+            distance, index = 0, None
+            for middle in range(first + 1, last):
+                offset = segment_distance(
+                    points[middle], points[first], points[last])
+                if offset > distance:
+                    distance, index = offset, middle
+            if index is not None and distance > tolerance:
+                keep[index] = True
+                stack.append((first, index))
+                stack.append((index, last))
+        return [row for row, kept in zip(rows, keep) if kept]
+
+
+def segment_distance(point, start, end):
+    """
+    Distance from point to the segment from start to end
+    """
+    segment = [e - s for s, e in zip(start, end)]
+    relative = [p - s for s, p in zip(start, point)]
+    length = sum(d * d for d in segment)
+    if length:
+        ratio = sum(r * d for r, d in zip(relative, segment)) / length
+        ratio = min(max(ratio, 0), 1)
+        relative = [r - ratio * d for r, d in zip(relative, segment)]
+    return math.sqrt(sum(r * r for r in relative))
+
+
+class TrackStats:
+    """
+    Distance, speed and elevation change of a track segment
+    Segments next to each other in time can be merged
+    .first, .last = (timestamp, latitude, longitude, elevation) of the ends
+    .distance = Great circle distance travelled in kilometres
+    .max_speed = Fastest speed between two statuses in kilometres per hour
+    .climb, .descent = Total elevation gained and lost in metres
+    """
+    __slots__ = ('count', 'first', 'last', 'distance',
+                 'max_speed', 'climb', 'descent')
+
+    def __init__(self, count, first, last, distance=0.0,
+                 max_speed=0.0, climb=0.0, descent=0.0):
+        self.count = count
+        self.first = first
+        self.last = last
+        self.distance = distance
+        self.max_speed = max_speed
+        self.climb = climb
+        self.descent = descent
+
+    @classmethod
+    def from_columns(cls, times, lats, lngs, elevs):
+        """
+        Compute stats of a segment from columns of its statuses in time order
+        """
+        if not times:
+            return None
+        rlats = [math.radians(lat) for lat in lats]
+        rlngs = [math.radians(lng) for lng in lngs]
+        cosines = [math.cos(rlat) for rlat in rlats]
+        legs = [
+            2 * EARTH_RADIUS_KM * math.asin(min(1, math.sqrt(
+                math.sin((lat2 - lat1) / 2) ** 2 +
+                cos1 * cos2 * math.sin((lng2 - lng1) / 2) ** 2)))
+            for lat1, lat2, cos1, cos2, lng1, lng2 in zip(
+                rlats, rlats[1:], cosines, cosines[1:], rlngs, rlngs[1:])
+        ]
+        durations = [end - start for start, end in zip(times, times[1:])]
+        rises = [end - start for start, end in zip(elevs, elevs[1:])]
+        speeds = [leg * 3600 / duration
+                  for leg, duration in zip(legs, durations) if duration > 0]
+        return cls(
+            count=len(times),
+            first=(times[0], lats[0], lngs[0], elevs[0]),
+            last=(times[-1], lats[-1], lngs[-1], elevs[-1]),
+            distance=math.fsum(legs),
+            max_speed=max(speeds, default=0.0),
+            climb=math.fsum(rise for rise in rises if rise > 0),
+            descent=-math.fsum(rise for rise in rises if rise < 0),
+        )
+
+    @classmethod
+    def from_tuple(cls, values):
+        """
+        Load stats from the tuple they are cached as
+        """
+        return cls(*values) if values else None
+
+    def to_tuple(self):
+        """
+        Get stats as a tuple to cache
+        """
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def merge(self, later):
+        """
+        Stats of this segment followed by a later one
+        """
+        if later is None:
+            return self
+        bridge = self.from_columns(*zip(self.last, later.first))
+        return TrackStats(
+            count=self.count + later.count,
+            first=self.first,
+            last=later.last,
+            distance=self.distance + bridge.distance + later.distance,
+            max_speed=max(self.max_speed, bridge.max_speed, later.max_speed),
+            climb=self.climb + bridge.climb + later.climb,
+            descent=self.descent + bridge.descent + later.descent,
+        )
+
+    def to_representation(self):
+        """
+        Get stats with times and rates for the response
+        """
+        duration = self.last[0] - self.first[0]
+        return OrderedDict([
+            ('count', self.count),
+            ('since', datetime.fromtimestamp(self.first[0], timezone.utc)),
+            ('until', datetime.fromtimestamp(self.last[0], timezone.utc)),
+            ('duration', round(duration, 6)),
+            ('distance', round(self.distance, 6)),
+            ('average_speed', round(
+                self.distance * 3600 / duration, 6) if duration else 0.0),
+            ('max_speed', round(self.max_speed, 6)),
+            ('climb', round(self.climb, 3)),
+            ('descent', round(self.descent, 3)),
+        ])
+
+
+def stats_key(package_id, block):
+    """
+    Cache key of stats for block of windows of package
+    """
+    return 'api:stats:{0}:{1}'.format(package_id, block)
+
+
+def stats_window(created):
+    """
+    Window of a status creation time
+    """
+    return int(created.timestamp() // STATS_WINDOW)
+
+
+def invalidate_stats(statuses):
+    """
+    Drop cached stats of the windows of changed (package_id, created)
+    again on commit so readers can not cache stats from before the write
+    """
+    keys = {stats_key(package_id, stats_window(created) // STATS_BLOCK)
+            for package_id, created in statuses}
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def window_runs(windows, gap=STATS_MAX_GAP):
+    """
+    Group sorted windows into (first, last) runs, windows at most gap
+    apart are read in the same run
+    """
+    runs = []
+    for window in windows:
+        if runs and window - runs[-1][1] <= gap + 1:
+            runs[-1][1] = window
+        else:
+            runs.append([window, window])
+    return [tuple(run) for run in runs]
+
+
+def compute_windows(package_id, first, last):
+    """
+    Compute stats of each window from first to last in one pass
+    Returns map of window to stats, None for windows with no statuses
+    """
+    windows = {window: None for window in range(first, last + 1)}
+    since = datetime.fromtimestamp(first * STATS_WINDOW, timezone.utc)
+    statuses = TieredStatuses.of_package(
+        package_id, 'id', 'created', 'latitude', 'longitude', 'elevation',
+        since=since).filter(
+            created__gte=since,
+            created__lt=datetime.fromtimestamp(
+                (last + 1) * STATS_WINDOW, timezone.utc))
+    current, columns = None, None
+    for row in statuses.iterate_recent(STATS_CHUNK_SIZE, oldest_first=True):
+        timestamp = row['created'].timestamp()
+        window = int(timestamp // STATS_WINDOW)
+        if window != current:
+            if columns is not None:
+                windows[current] = TrackStats.from_columns(*columns)
+            current, columns = window, ([], [], [], [])
+        columns[0].append(timestamp)
+        columns[1].append(float(row['latitude']))
+        columns[2].append(float(row['longitude']))
+        columns[3].append(float(row['elevation']))
+    if columns is not None:
+        windows[current] = TrackStats.from_columns(*columns)
+    return windows
+
+
+def package_stats(package_id):
+    """
+    Get track stats of a package, None if it has no statuses
+    Stats of closed windows are cached in blocks each holding the stats
+    of its windows with statuses up to the last window it covers, so
+    only windows since then or of changed blocks are read
+    """
+    # first and last status times of the hot and archive tiers
+    bounds = [
+        model.objects.filter(package=package_id).aggregate(
+            first=Min('created'), last=Max('created'))
+        for model in (Status, ArchivedStatus)
+    ]
+    bounds = [bound for bound in bounds if bound['first'] is not None]
+    if not bounds:
+        return None
+    first = stats_window(min(bound['first'] for bound in bounds))
+    last = stats_window(max(bound['last'] for bound in bounds))
+    closed = stats_window(timezone.now())
+
+    keys = {block: stats_key(package_id, block) for block in range(
+        first // STATS_BLOCK, last // STATS_BLOCK + 1)}
+    cached = cache.get_many(keys.values())
+    blocks, windows, missing = {}, {}, []
+    for block, key in keys.items():
+        start = max(block * STATS_BLOCK, first)
+        end = min((block + 1) * STATS_BLOCK - 1, last)
+        through, stats = cached.get(key, (start - 1, {}))
+        blocks[block] = (through, stats)
+        windows.update(
+            (window, TrackStats.from_tuple(values))
+            for window, values in stats.items())
+        missing.extend(range(max(through + 1, start), end + 1))
+
+    # only runs of missing windows are read, not all since the oldest
+    updated = set()
+    for run_first, run_last in window_runs(missing):
+        for window, stats in compute_windows(
+                package_id, run_first, run_last).items():
+            windows.setdefault(window, stats)
+            if window < closed:
+                updated.add(window // STATS_BLOCK)
+    entries = {}
+    for block in updated:
+        through = min((block + 1) * STATS_BLOCK, closed) - 1
+        entries[keys[block]] = (through, {
+            window: windows[window].to_tuple()
+            for window in range(block * STATS_BLOCK, through + 1)
+            if windows.get(window) is not None
+        })
+    cache.set_many(entries, STATS_TIMEOUT)
+
+    total = None
+    for window in sorted(windows):
+        stats = windows[window]
+        if stats is not None:
+            total = stats if total is None else total.merge(stats)
+    return total
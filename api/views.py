@@ -2,36 +2,235 @@
 Api views module
 """
 
-from django.db.models import ProtectedError
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.http import (
+    Http404,
+    StreamingHttpResponse,
+)
+from django.db.models import (
+    Prefetch,
+    ProtectedError,
+)
+from django.utils import timezone
 from rest_framework import (
     mixins,
+    permissions,
     status,
     viewsets,
 )
-from rest_framework.exceptions import APIException
-from rest_framework.decorators import detail_route
+from rest_framework.exceptions import (
+    APIException,
+    ValidationError,
+)
+from rest_framework.decorators import (
+    detail_route,
+    list_route,
+)
+from rest_framework.generics import get_object_or_404
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import exception_handler
 
+from .cache import cached_response
+from .events import StatusStream
+from .ingest import (
+    flush,
+    get_queue,
+    save_statuses,
+    sign_token,
+    unsign_token,
+)
 from .models import (
+    ArchivedStatus,
+    Change,
+    LatestStatus,
     Package,
     Status,
+    TieredStatuses,
+)
+from .pagination import (
+    ChangeFeedPagination,
+    StatusCursorPagination,
+)
+from .parsers import (
+    NDJSONParser,
+    PackedStatusParser,
+)
+from .renderers import (
+    CSVRenderer,
+    EventStreamRenderer,
+    NDJSONRenderer,
+    PackedStatusRenderer,
+)
+from .routers import (
+    choose_replica,
+    is_sticky,
+    set_read_alias,
+    stick_to_primary,
 )
 from .serializers import (
+    ChangeSerializer,
     PackageSerializer,
     PackageStatusSerializer,
+    PackageStatusValuesSerializer,
+    StatusBatchItemSerializer,
     StatusSerializer,
+    StatusValuesSerializer,
 )
+from .spatial import SpatialQuery
+from .tracks import (
+    Downsampler,
+    filter_time_range,
+    package_stats,
+    parse_time,
+)
+
+
+class TrackingNotSaved(APIException):
+    """
+    Error for tracking reads whose queued writes were not saved in time
+    or were queued in another queue than the one of this server
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = ('Queued statuses are still being saved, '
+                      'try again shortly.')
+    default_code = 'tracking_not_saved'
 
 
-class PackageViewSet(viewsets.ModelViewSet):
+class ReplicaReadMixin:
+    """
+    Serve safe requests of read actions from a read replica unless the
+    user wrote in the last DB_REPLICA_STICKY seconds
+    """
+    replica_actions = ()
+
+    def get_read_alias(self, request):
+        """
+        Replica to read from for the request, None for the primary
+        """
+        if not settings.DATABASE_REPLICAS or \
+                request.method not in permissions.SAFE_METHODS or \
+                self.action not in self.replica_actions:
+            return None
+        if request.user.is_authenticated and \
+                is_sticky(request, request.user.pk):
+            return None
+        return choose_replica()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        set_read_alias(self.get_read_alias(request))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        set_read_alias(None)
+        if settings.DATABASE_REPLICAS and \
+                request.method not in permissions.SAFE_METHODS and \
+                response.status_code < status.HTTP_400_BAD_REQUEST and \
+                request.user.is_authenticated:
+            stick_to_primary(response, request.user.pk)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class PackageViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows packages to be tracked or updated.
     """
     queryset = Package.objects.all()
     serializer_class = PackageSerializer
     pagination_class = LimitOffsetPagination
+    export_chunk_size = 2000
+    tracking_limit_query_param = 'tracking'
+    default_tracking_limit = 10
+    max_tracking_limit = 100
+    batch_ids_query_param = 'ids'
+    max_batch_packages = 500
+    stream_packages_query_param = 'packages'
+    stream_after_query_param = 'after'
+    max_stream_packages = 100
+    stream_max_pending = 100
+    stream_duration = 300
+    stream_heartbeat = 15
+    tracking_token_header = 'HTTP_X_TRACKING_TOKEN'
+    tracking_flush_limit = 1000
+    tracking_flush_timeout = 5
+    # export and stream read lazily after the view returns, stats have
+    # their own cache
+    replica_actions = ('list', 'retrieve', 'tracking', 'positions', 'batch')
+
+    def get_tracking_limit(self):
+        """
+        Number of latest statuses embedded per package in list responses
+        """
+        try:
+            limit = int(self.request.query_params[
+                self.tracking_limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_tracking_limit
+        return min(max(limit, 0), self.max_tracking_limit)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ('tracking', 'export', 'stats'):
+            queryset = queryset.select_related('latest_status__status')
+        if self.action == 'list':
+            limit = self.get_tracking_limit()
+            queryset = queryset.prefetch_related(*[
+                Prefetch(name, queryset=model.objects.latest_per_package(
+                    limit) if limit else model.objects.none())
+                for name, model in [('tracking', Status),
+                                    ('archived_tracking', ArchivedStatus)]])
+        return queryset
+
+    def get_read_alias(self, request):
+        # queued writes sent back with a token are flushed to the primary
+        if request.META.get(self.tracking_token_header):
+            return None
+        return super().get_read_alias(request)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # before cached responses are looked up
+        if self.action == 'tracking' and request.method == 'GET':
+            self.flush_tracking(kwargs.get('pk'))
+
+    def flush_tracking(self, pk):
+        """
+        Save queued writes of the package up to the tracking token sent
+        so clients read their own write behind posts
+        Only tokens issued for the package are honoured
+        """
+        token = self.request.META.get(self.tracking_token_header)
+        if not token or not settings.TRACKING_WRITE_BEHIND:
+            return
+        try:
+            package_id, queue_id, through = unsign_token(token)
+            if str(package_id) != pk:
+                raise ValueError('Token of another package')
+        except ValueError:
+            raise ValidationError({'token': ['Invalid tracking token']})
+        if not flush(get_queue(), queue_id, package_id, through,
+                     limit=self.tracking_flush_limit,
+                     timeout=self.tracking_flush_timeout):
+            raise TrackingNotSaved()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'list':
+            context['tracking_limit'] = self.get_tracking_limit()
+        return context
+
+    @cached_response(package_scoped=False)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response()
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
 
     def destroy(self, request, *args, **kwargs):
         try:
@@ -43,39 +242,252 @@ class PackageViewSet(viewsets.ModelViewSet):
             response = exception_handler(exc, None)
             return response
 
+    @property
+    def paginator(self):
+        """
+        Use keyset pagination for tracking when a cursor is requested
+        """
+        cursor_param = StatusCursorPagination.cursor_query_param
+        if not hasattr(self, '_paginator') and self.action == 'tracking' \
+                and cursor_param in self.request.query_params:
+            self._paginator = StatusCursorPagination()
+        return super().paginator
+
     def get_serializer_class(self):
         if self.action == 'tracking':
             serializer_class = PackageStatusSerializer
+        elif self.action == 'positions':
+            serializer_class = StatusSerializer
         else:
             serializer_class = super().get_serializer_class()
         return serializer_class
 
-    @detail_route(methods=['GET', 'POST'], url_path='tracking')
-    def tracking(self, request, pk=None):
+    @detail_route(methods=['GET', 'POST'], url_path='tracking',
+                  renderer_classes=api_settings.DEFAULT_RENDERER_CLASSES + [
+                      PackedStatusRenderer])
+    @cached_response()
+    def tracking(self, request, pk=None, format=None):
         """
         Handle showing and updating of tracking information
         """
         if request.method == 'GET':
-            statuses = self.paginate_queryset(
-                Status.objects.filter(package=pk))
-            serializer = PackageStatusSerializer(
+            statuses = filter_time_range(
+                TieredStatuses.of_package(
+                    pk, *PackageStatusValuesSerializer.values,
+                    since=parse_time(request.query_params, 'since')),
+                request.query_params)
+            spatial = SpatialQuery.from_params(request.query_params)
+            if spatial is not None:
+                statuses = spatial.filter(statuses)
+            downsampler = Downsampler.from_params(request.query_params)
+            if downsampler is not None:
+                statuses = statuses.iterate_recent(self.export_chunk_size)
+            else:
+                statuses = self.paginate_queryset(statuses)
+            if downsampler is not None:
+                statuses = downsampler.apply(statuses)
+            serializer = PackageStatusValuesSerializer(
                 statuses, many=True, context={'request': request})
-            response = self.get_paginated_response(serializer.data)
-        elif request.method == 'POST':
-            data = request.data.copy()
-            data['package'] = PackageSerializer(
-                self.get_object(), context={'request': request}).data['url']
-            serializer = StatusSerializer(
-                data=data, context={'request': request})
-            if serializer.is_valid():
-                serializer.save()
-                response = Response(serializer.data, status=status.HTTP_201_CREATED)
+            if downsampler is not None:
+                response = Response(OrderedDict([
+                    ('count', len(statuses)),
+                    ('results', serializer.data),
+                ]))
             else:
+                response = self.get_paginated_response(serializer.data)
+        elif request.method == 'POST':
+            package = self.get_object()
+            serializer = PackageStatusSerializer(
+                data=request.data, context={'request': request})
+            if not serializer.is_valid():
                 response = Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            elif settings.TRACKING_WRITE_BEHIND:
+                response = self.enqueue_status(package, serializer)
+            else:
+                with transaction.atomic():
+                    instance = serializer.save(package=package)
+                serializer = StatusSerializer(
+                    instance, context={'request': request})
+                response = Response(serializer.data, status=status.HTTP_201_CREATED)
+        return response
+
+    def enqueue_status(self, package, serializer):
+        """
+        Queue a valid status to be saved by the drain workers
+        Responds with the token to send back in the X-Tracking-Token
+        header of tracking reads to see the status
+        """
+        values = serializer.validated_data
+        created = timezone.now()
+        queue = get_queue()
+        token = sign_token(queue, package.pk, queue.put(
+            package.pk, created, values['latitude'], values['longitude'],
+            values['elevation']))
+        data = OrderedDict([('token', token)])
+        for name in ('latitude', 'longitude', 'elevation'):
+            data[name] = values[name]
+        data['created'] = serializer.fields['created'].to_representation(
+            created)
+        return Response(data, status=status.HTTP_202_ACCEPTED,
+                        headers={'X-Tracking-Token': token})
+
+    @detail_route(methods=['GET'], url_path='tracking/export',
+                  url_name='export',
+                  renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request, pk=None, format=None):
+        """
+        Handle streaming the full tracking history as NDJSON or CSV
+        """
+        package = self.get_object()
+        statuses = filter_time_range(
+            TieredStatuses.of_package(
+                package.pk, *PackageStatusValuesSerializer.values,
+                since=parse_time(request.query_params, 'since')),
+            request.query_params).iterate_recent(self.export_chunk_size)
+        serializer = PackageStatusValuesSerializer(
+            context={'request': request})
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(
+                serializer.to_representation(row) for row in statuses),
+            content_type='{0}; charset={1}'.format(
+                renderer.media_type, renderer.charset))
+        response['Content-Disposition'] = \
+            'attachment; filename="package-{0}-tracking.{1}"'.format(
+                package.pk, renderer.format)
+        return response
+
+    @detail_route(methods=['GET'], url_path='stats')
+    @cached_response()
+    def stats(self, request, pk=None):
+        """
+        Handle showing distance, speed and elevation stats of the track
+        """
+        package = self.get_object()
+        stats = package_stats(package.pk)
+        if stats is None:
+            return Response(OrderedDict([('count', 0)]))
+        return Response(stats.to_representation())
+
+    @list_route(methods=['GET'], url_path='positions')
+    @cached_response(package_scoped=False)
+    def positions(self, request):
+        """
+        Handle showing the latest status of all packages
+        """
+        latest = LatestStatus.objects.select_related(
+            'status').order_by('package')
+        spatial = SpatialQuery.from_params(request.query_params)
+        if spatial is not None:
+            latest = spatial.filter(latest, prefix='status__')
+        latest = self.paginate_queryset(latest)
+        serializer = StatusSerializer(
+            [position.status for position in latest],
+            many=True, context={'request': request})
+        return self.get_paginated_response(serializer.data)
+
+    @list_route(methods=['GET'], url_path='batch')
+    @cached_response(package_scoped=False)
+    def batch(self, request, format=None):
+        """
+        Handle showing the latest status of many packages at once
+        keyed by id, null for packages that do not exist
+        """
+        package_ids = self.get_package_ids(
+            self.batch_ids_query_param, self.max_batch_packages)
+        prefix = 'latest_status__status__'
+        fields = [name for name in PackageStatusValuesSerializer.values
+                  if name != 'package_id']
+        # one query joining each package to its latest status
+        rows = list(Package.objects.filter(id__in=package_ids).values(
+            'id', 'description', *(prefix + name for name in fields)))
+        latest = iter(PackageStatusValuesSerializer([
+            {name: row[prefix + name] for name in fields}
+            for row in rows if row[prefix + 'id'] is not None
+        ], many=True, context={'request': request}).data)
+        packages = OrderedDict(
+            (package_id, None) for package_id in sorted(package_ids))
+        for row in rows:
+            packages[row['id']] = OrderedDict([
+                ('description', row['description']),
+                ('latest_status', next(latest)
+                 if row[prefix + 'id'] is not None else None),
+            ])
+        return Response(packages)
+
+    @list_route(methods=['GET'], url_path='stream',
+                renderer_classes=[EventStreamRenderer])
+    def stream(self, request):
+        """
+        Handle pushing statuses of packages as server sent events
+        once they are committed, resuming after the change position in the
+        `Last-Event-ID` header or `after` query param
+        """
+        package_ids = self.get_stream_packages()
+        after = self.get_stream_after()
+        serializer = StatusValuesSerializer(context={'request': request})
+        renderer = request.accepted_renderer
+        statuses = StatusStream(
+            package_ids, serializer, after, self.stream_max_pending,
+            self.stream_duration, self.stream_heartbeat)
+        response = StreamingHttpResponse(
+            renderer.stream(statuses.rows()),
+            content_type='{0}; charset={1}'.format(
+                renderer.media_type, renderer.charset))
+
+        def async_stream(run_sync):
+            # ASGI servers await the events on their event loop instead
+            return renderer.stream_async(statuses.async_rows(run_sync))
+        response.async_stream = async_stream
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
         return response
 
+    def get_package_ids(self, name, limit):
+        """
+        Get set of at most limit package ids from comma separated param
+        """
+        try:
+            package_ids = {int(package_id) for package_id in
+                           self.request.query_params.get(name, '').split(',')}
+        except ValueError:
+            raise ValidationError({name: ['Expected comma separated ids.']})
+        if len(package_ids) > limit:
+            raise ValidationError({name: [
+                'Expected at most {0} packages.'.format(limit)]})
+        return package_ids
+
+    def get_stream_packages(self):
+        """
+        Get existing package ids to stream from comma separated param
+        """
+        name = self.stream_packages_query_param
+        package_ids = self.get_package_ids(name, self.max_stream_packages)
+        missing = package_ids - set(Package.objects.filter(
+            id__in=package_ids).values_list('id', flat=True))
+        if missing:
+            raise ValidationError({name: [
+                'Invalid package {0}.'.format(package_id)
+                for package_id in sorted(missing)]})
+        return package_ids
 
-class StatusViewSet(mixins.RetrieveModelMixin,
+    def get_stream_after(self):
+        """
+        Get change position the client last received if any
+        """
+        after = self.request.META.get('HTTP_LAST_EVENT_ID') or \
+            self.request.query_params.get(self.stream_after_query_param)
+        if not after:
+            return None
+        try:
+            return int(after)
+        except ValueError:
+            raise ValidationError({self.stream_after_query_param: [
+                'Invalid change token']})
+
+
+class StatusViewSet(ReplicaReadMixin,
+                    mixins.RetrieveModelMixin,
                     mixins.DestroyModelMixin,
                     viewsets.GenericViewSet):
     """
@@ -83,3 +495,106 @@ class StatusViewSet(mixins.RetrieveModelMixin,
     """
     queryset = Status.objects.all()
     serializer_class = StatusSerializer
+    replica_actions = ('retrieve',)
+    batch_chunk_size = 1000
+    max_batch_size = 100000
+
+    def get_object(self):
+        """
+        Get status, looking in the archive once it is archived when shown
+        """
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action != 'retrieve':
+                raise
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        instance = get_object_or_404(ArchivedStatus.objects.all(), **{
+            self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(self.request, instance)
+        return instance
+
+    @list_route(methods=['POST'], url_path='batch',
+                parser_classes=[JSONParser, NDJSONParser,
+                                PackedStatusParser])
+    def batch(self, request):
+        """
+        Handle creating statuses for one or many packages in bulk
+        Valid statuses are saved and invalid ones reported by index
+        """
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError('Expected a list of statuses')
+        if len(items) > self.max_batch_size:
+            raise ValidationError('Batch exceeds {0} statuses'.format(
+                self.max_batch_size))
+
+        statuses, errors = self.validate_batch(items)
+        for start in range(0, len(statuses), self.batch_chunk_size):
+            chunk = statuses[start:start + self.batch_chunk_size]
+            save_statuses(chunk)
+
+        data = {'created': len(statuses), 'errors': errors}
+        if statuses or not errors:
+            return Response(data, status=status.HTTP_201_CREATED)
+        return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+    @staticmethod
+    def validate_batch(items):
+        """
+        Validate batch of statuses reusing one serializer
+        and checking all referenced packages with a single query
+        Returns unsaved statuses and list of errors by item index
+        """
+        serializer = StatusBatchItemSerializer()
+        valid, errors = [], []
+        for index, item in enumerate(items):
+            try:
+                valid.append((index, serializer.run_validation(item)))
+            except ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+
+        package_ids = set(Package.objects.filter(
+            id__in={data['package'] for _, data in valid}).values_list(
+                'id', flat=True))
+        statuses = []
+        for index, data in valid:
+            package_id = data.pop('package')
+            if package_id not in package_ids:
+                detail = 'Invalid pk "{0}" - object does not exist.'.format(
+                    package_id)
+                errors.append({
+                    'index': index, 'errors': {'package': [detail]}})
+            else:
+                pkg_status = Status(package_id=package_id, **data)
+                pkg_status.locate()
+                statuses.append(pkg_status)
+        errors.sort(key=lambda error: error['index'])
+        return statuses, errors
+
+
+class ChangeViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    API endpoint listing package and status changes after a token.
+    """
+    queryset = Change.objects.all()
+    serializer_class = ChangeSerializer
+    pagination_class = ChangeFeedPagination
+    package_query_param = 'package'
+
+    def list(self, request, *args, **kwargs):
+        # changes whose writers stopped before publishing get positions
+        Change.objects.publish()
+        return super().list(request, *args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        package = self.request.query_params.get(self.package_query_param)
+        if package:
+            try:
+                queryset = queryset.filter(package_id=int(package))
+            except ValueError:
+                raise ValidationError({self.package_query_param: [
+                    'Expected a package id.']})
+        return queryset
+
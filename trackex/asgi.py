@@ -0,0 +1,329 @@
+"""
+ASGI config for trackex project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+setting up Django on the first connection so importing it has no effect.
+Requests are handled by the same Django application as ``trackex.wsgi`` so
+settings, middleware and url routing are shared, run on a bounded pool of
+threads so the event loop is never blocked on the database. Event streams
+await their events on the event loop.
+
+Serve with any ASGI 3 server, e.g. ``uvicorn trackex.asgi:application``
+"""
+
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "trackex.settings")
+
+
+class ASGIHandler:
+    """
+    ASGI application running a WSGI application on bounded thread pools
+    At most `threads` requests run at once, each thread keeping its own
+    persistent database connection. Streaming responses are iterated on
+    a separate pool of `stream_threads` so long lived streams do not hold
+    up requests, their chunks passed to the event loop through a bounded
+    queue so a slow client pauses its stream instead of buffering it.
+    Streams beyond the stream threads are refused with 503 rather than
+    left waiting for a thread after their headers are sent.
+    Responses with an `async_stream(run_sync)` of chunks, such as event
+    streams, are iterated on the event loop instead and only take a stream
+    thread for the blocking calls they pass to run_sync, so idle ones hold
+    no thread and are not limited by the stream threads.
+    """
+    max_pending_chunks = 16
+    max_body_in_memory = 1024 * 1024
+    streams_retry_after = 5
+
+    def __init__(self, wsgi_application, threads, stream_threads):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.stream_executor = ThreadPoolExecutor(max_workers=stream_threads)
+        self.stream_threads = stream_threads
+        # streams iterating, only changed on the event loop
+        self.streams = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        else:
+            raise ValueError(
+                'Unsupported ASGI scope type {0}'.format(scope['type']))
+
+    async def lifespan(self, receive, send):
+        """
+        Handle server startup and shutdown
+        """
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                self.stream_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        """
+        Handle request on the request pool then send its response
+        """
+        body = await self.read_body(receive)
+        if body is None:
+            return
+        loop = asyncio.get_event_loop()
+        with body:
+            status, headers, content, stream = await loop.run_in_executor(
+                self.executor, self.respond, self.environ(scope, body))
+        async_stream = getattr(stream and stream[1], 'async_stream', None)
+        if stream is not None and async_stream is None and \
+                self.streams >= self.stream_threads:
+            await loop.run_in_executor(self.executor, self.close, stream)
+            status, headers, content, stream = self.streams_unavailable()
+        await send({'type': 'http.response.start',
+                    'status': status, 'headers': headers})
+        if async_stream is not None:
+            await self.stream_async(loop, stream, receive, send)
+        elif stream is not None:
+            await self.stream(loop, stream, receive, send)
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def read_body(self, receive):
+        """
+        Read request body into a file, None if the client disconnects
+        """
+        body = tempfile.SpooledTemporaryFile(max_size=self.max_body_in_memory)
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body', False):
+                body.seek(0)
+                return body
+
+    async def stream(self, loop, stream, receive, send):
+        """
+        Send chunks of streaming response iterated on the stream pool
+        """
+        queue = asyncio.Queue(maxsize=self.max_pending_chunks)
+        disconnected = threading.Event()
+        watcher = asyncio.ensure_future(
+            self.watch_disconnect(receive, disconnected))
+        self.streams += 1
+        iterating = loop.run_in_executor(
+            self.stream_executor, self.iterate,
+            stream, loop, queue, disconnected)
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                if disconnected.is_set():
+                    continue
+                try:
+                    await send({'type': 'http.response.body',
+                                'body': chunk, 'more_body': True})
+                except Exception:
+                    # servers may raise on sending once the client is gone
+                    disconnected.set()
+            await iterating
+        finally:
+            self.streams -= 1
+            watcher.cancel()
+
+    async def stream_async(self, loop, stream, receive, send):
+        """
+        Send chunks of a streaming response iterated on the event loop
+        running its blocking calls on the stream pool
+        """
+        disconnected = threading.Event()
+        watcher = asyncio.ensure_future(
+            self.watch_disconnect(receive, disconnected))
+        chunks = stream[1].async_stream(
+            lambda func: loop.run_in_executor(
+                self.stream_executor, self.call, func))
+        try:
+            async for chunk in chunks:
+                if disconnected.is_set():
+                    break
+                if not chunk:
+                    continue
+                try:
+                    await send({'type': 'http.response.body',
+                                'body': chunk, 'more_body': True})
+                except Exception:
+                    # servers may raise on sending once the client is gone
+                    break
+        finally:
+            watcher.cancel()
+            try:
+                await chunks.aclose()
+            finally:
+                await loop.run_in_executor(self.executor, self.close, stream)
+
+    @staticmethod
+    def call(func):
+        """
+        Call a blocking function of a stream iterated on the event loop
+        on a stream thread
+        """
+        try:
+            return func()
+        finally:
+            # stream threads serve no requests to reuse connections
+            connections.close_all()
+
+    def streams_unavailable(self):
+        """
+        Get status, headers and content of the response refusing a stream
+        """
+        return [503, [(b'content-type', b'application/json'),
+                      (b'retry-after', str(self.streams_retry_after).encode(
+                          'latin1'))],
+                b'{"detail":"Too many open streams, retry later."}', None]
+
+    @staticmethod
+    async def watch_disconnect(receive, disconnected):
+        """
+        Flag when the client disconnects
+        """
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected.set()
+                return
+
+    def respond(self, environ):
+        """
+        Call the WSGI application, on a request thread
+        Returns status, headers and either the content or the
+        (chunks, result) left to iterate of a streaming response
+        """
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [int(status.split(' ', 1)[0]), [
+                (name.lower().encode('latin1'), value.encode('latin1'))
+                for name, value in headers]]
+
+        result = self.wsgi_application(environ, start_response)
+        # django responses say if they stream, other iterables may not end
+        if getattr(result, 'streaming',
+                   not isinstance(result, (list, tuple))):
+            chunks = iter(result)
+            if not started:
+                # generator applications start the response when iterated
+                chunks = itertools.chain([next(chunks, b'')], chunks)
+            return started + [b'', (chunks, result)]
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return started + [content, None]
+
+    @staticmethod
+    def close(stream):
+        """
+        Close a streaming result that will not be iterated
+        """
+        result = stream[1]
+        if hasattr(result, 'close'):
+            result.close()
+
+    @staticmethod
+    def iterate(stream, loop, queue, disconnected):
+        """
+        Pass chunks of a streaming result to the event loop, on a stream
+        thread, waiting while the queue is full and stopping on disconnect
+        """
+        def put(chunk):
+            asyncio.run_coroutine_threadsafe(queue.put(chunk), loop).result()
+
+        chunks, result = stream
+        try:
+            for chunk in chunks:
+                if disconnected.is_set():
+                    break
+                if chunk:
+                    put(chunk)
+        finally:
+            try:
+                if hasattr(result, 'close'):
+                    result.close()
+            finally:
+                # stream threads serve no requests to reuse connections
+                connections.close_all()
+                put(None)
+
+    @staticmethod
+    def environ(scope, body):
+        """
+        Build WSGI environ from an ASGI http scope
+        """
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode(
+                'utf-8').decode('latin1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'REMOTE_ADDR': client[0],
+            'SERVER_PROTOCOL': 'HTTP/{0}'.format(
+                scope.get('http_version', '1.1')),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            key = name.decode('latin1').upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            value = value.decode('latin1')
+            if key in environ:
+                value = '{0},{1}'.format(environ[key], value)
+            environ[key] = value
+        return environ
+
+
+def get_asgi_application():
+    """
+    Set up django and get the ASGI handler sized by settings
+    """
+    wsgi_application = get_wsgi_application()
+    return ASGIHandler(wsgi_application, settings.ASGI_THREADS,
+                       settings.ASGI_STREAM_THREADS)
+
+
+_handler = None
+
+
+async def application(scope, receive, send):
+    """
+    ASGI entry point, getting the handler on the first connection
+    """
+    global _handler
+    if _handler is None:
+        _handler = get_asgi_application()
+    await _handler(scope, receive, send)
@@ -0,0 +1,36 @@
+"""
+Define project cache backends
+"""
+
+from collections import OrderedDict
+
+from django.core.cache.backends import locmem
+
+
+class LRUMemCache(locmem.LocMemCache):
+    """
+    Local memory cache evicting the least recently used entries once
+    MAX_ENTRIES is reached instead of culling arbitrary ones
+    Entries are held per process so it only suits a single worker
+    """
+
+    def __init__(self, name, params):
+        locmem._caches.setdefault(name, OrderedDict())
+        super().__init__(name, params)
+
+    def get(self, key, default=None, version=None, acquire_lock=True):
+        value = super().get(key, default, version, acquire_lock)
+        key = self.make_key(key, version=version)
+        with (self._lock.writer() if acquire_lock else locmem.dummy()):
+            if key in self._cache:
+                self._cache.move_to_end(key)
+        return value
+
+    def _set(self, key, value, timeout=locmem.DEFAULT_TIMEOUT):
+        super()._set(key, value, timeout)
+        self._cache.move_to_end(key)
+
+    def _cull(self):
+        # make room for one entry
+        while self._cache and len(self._cache) >= self._max_entries:
+            self._delete(next(iter(self._cache)))
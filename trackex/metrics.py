@@ -0,0 +1,281 @@
+"""
+Define request instrumentation
+Each request is timed per view. Sampled requests also record database
+query count and time, repeated queries, serializer and render time, into
+per view histograms held in process memory.
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+from rest_framework.serializers import BaseSerializer
+
+# upper bounds of histogram buckets, the last bucket is unbounded
+MS_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+UNRESOLVED = 'unresolved'
+
+_local = threading.local()
+
+
+def current():
+    """
+    Profile of the sampled request being served on this thread if any
+    """
+    return getattr(_local, 'profile', None)
+
+
+def view_name(view_func, method):
+    """
+    Name of a view, the viewset and action for api views
+    """
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return '{0}.{1}'.format(view_func.__module__, view_func.__name__)
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(method.lower(), method.lower())
+    return '{0}.{1}'.format(cls.__name__, action)
+
+
+class Histogram:
+    """
+    Count of observations in fixed buckets with their sum and max
+    """
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        """
+        Add a value to its bucket
+        """
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, fraction):
+        """
+        Upper bound of the bucket holding the fraction of observations
+        the max when in the unbounded bucket
+        """
+        rank, seen = fraction * self.count, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_representation(self):
+        buckets = ['<={0}'.format(bound) for bound in self.bounds] + [
+            '>{0}'.format(self.bounds[-1])]
+        return OrderedDict([
+            ('count', self.count),
+            ('mean', round(self.sum / self.count, 3) if self.count else 0),
+            ('max', round(self.max, 3)),
+            ('p50', round(self.quantile(0.5), 3)),
+            ('p95', round(self.quantile(0.95), 3)),
+            ('p99', round(self.quantile(0.99), 3)),
+            ('buckets', OrderedDict(
+                (bucket, count) for bucket, count
+                in zip(buckets, self.counts) if count)),
+        ])
+
+
+class ViewMetrics:
+    """
+    Request counts and histograms of one view
+    wall time covers every request, the rest only sampled requests
+    """
+    SAMPLED = (('db_ms', MS_BUCKETS), ('queries', COUNT_BUCKETS),
+               ('duplicate_queries', COUNT_BUCKETS),
+               ('serializer_ms', MS_BUCKETS), ('render_ms', MS_BUCKETS))
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.wall_ms = Histogram(MS_BUCKETS)
+        self.sampled = OrderedDict(
+            (name, Histogram(bounds)) for name, bounds in self.SAMPLED)
+
+    def record(self, wall, status_code, profile=None):
+        """
+        Add a request of wall seconds and its profile if sampled
+        """
+        self.requests += 1
+        if status_code >= 500:
+            self.errors += 1
+        self.wall_ms.observe(wall * 1000)
+        if profile is not None:
+            for name, value in profile.values():
+                self.sampled[name].observe(value)
+
+    def to_representation(self):
+        ret = OrderedDict([
+            ('requests', self.requests),
+            ('errors', self.errors),
+            ('wall_ms', self.wall_ms.to_representation()),
+        ])
+        for name, histogram in self.sampled.items():
+            ret[name] = histogram.to_representation()
+        return ret
+
+
+class Registry:
+    """
+    Metrics of each view served by this process
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Drop all metrics
+        """
+        with self.lock:
+            self.views = {}
+            self.started = time.time()
+
+    def record(self, view, wall, status_code, profile=None):
+        """
+        Add a request served by a view
+        """
+        with self.lock:
+            metrics = self.views.get(view)
+            if metrics is None:
+                metrics = self.views[view] = ViewMetrics()
+            metrics.record(wall, status_code, profile)
+
+    def to_representation(self):
+        with self.lock:
+            return OrderedDict([
+                ('pid', os.getpid()),
+                ('since', self.started),
+                ('views', OrderedDict(
+                    (view, self.views[view].to_representation())
+                    for view in sorted(self.views))),
+            ])
+
+
+REGISTRY = Registry()
+
+
+class Profile:
+    """
+    Database, serializer and render time of one sampled request
+    Installed as an execute wrapper on each database connection to
+    count and time queries, repeats of a query with the same params
+    are counted as duplicates
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.duplicates = 0
+        self.db = 0.0
+        self.serializer = 0.0
+        self.render = 0.0
+        self.render_started = None
+        self.serializing = False
+        self.statements = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+            if not many:
+                try:
+                    statement = (sql, tuple(params or ()))
+                    if statement in self.statements:
+                        self.duplicates += 1
+                    else:
+                        self.statements.add(statement)
+                except TypeError:
+                    pass
+
+    def start_render(self):
+        """
+        Mark start of rendering a template response
+        """
+        self.render_started = time.perf_counter()
+
+    def finish_render(self, response):
+        """
+        Post render callback of a template response
+        """
+        if self.render_started is not None:
+            self.render += time.perf_counter() - self.render_started
+            self.render_started = None
+
+    def values(self):
+        """
+        Generate (name, value) of each sampled histogram
+        """
+        yield 'db_ms', self.db * 1000
+        yield 'queries', self.queries
+        yield 'duplicate_queries', self.duplicates
+        yield 'serializer_ms', self.serializer * 1000
+        yield 'render_ms', self.render * 1000
+
+    def server_timing(self, wall):
+        """
+        Server-Timing header value of the profile and wall seconds
+        """
+        return ', '.join([
+            'db;dur={0:.3f};desc="{1} queries, {2} duplicate"'.format(
+                self.db * 1000, self.queries, self.duplicates),
+            'serializer;dur={0:.3f}'.format(self.serializer * 1000),
+            'render;dur={0:.3f}'.format(self.render * 1000),
+            'total;dur={0:.3f}'.format(wall * 1000),
+        ])
+
+    def __enter__(self):
+        _local.profile = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.profile = None
+
+
+def timed_data(data):
+    """
+    Wrap serializer data property to add its time to the profile
+    nested serializers are only timed as part of the outermost one
+    """
+
+    def wrapper(serializer):
+        profile = current()
+        if profile is None or profile.serializing:
+            return data.fget(serializer)
+        profile.serializing = True
+        start = time.perf_counter()
+        try:
+            return data.fget(serializer)
+        finally:
+            profile.serializer += time.perf_counter() - start
+            profile.serializing = False
+
+    wrapper.timed = True
+    return property(wrapper)
+
+
+def instrument_serializers():
+    """
+    Time serializing data of every serializer, once per process
+    Serializer and ListSerializer data both defer to the base property
+    """
+    if not getattr(BaseSerializer.data.fget, 'timed', False):
+        BaseSerializer.data = timed_data(BaseSerializer.data)
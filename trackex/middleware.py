@@ -0,0 +1,75 @@
+"""
+Define project wide middleware
+"""
+
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from . import metrics
+
+
+class ConnectionHealthMiddleware:
+    """
+    Close persistent database connections that are no longer usable
+    so a connection dropped by the server while idle between requests
+    is reopened instead of failing the next request
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'DB_HEALTH_CHECKS', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        for conn in connections.all():
+            if conn.connection is not None and not conn.is_usable():
+                conn.close()
+        return self.get_response(request)
+
+
+class InstrumentationMiddleware:
+    """
+    Record wall time of each request against the view serving it
+    and profile a sample of requests for database queries, serializer
+    and render time, sent back as a Server-Timing header when enabled
+    Streaming responses are timed until they start streaming
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.METRICS_SAMPLE_RATE
+        self.headers = settings.METRICS_HEADERS
+        metrics.instrument_serializers()
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        if random.random() >= self.sample_rate:
+            profile = None
+            response = self.get_response(request)
+        else:
+            with metrics.Profile() as profile, ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(profile))
+                response = self.get_response(request)
+        wall = time.perf_counter() - start
+        metrics.REGISTRY.record(
+            getattr(request, 'metrics_view', metrics.UNRESOLVED), wall,
+            response.status_code, profile)
+        if profile is not None and self.headers:
+            response['Server-Timing'] = profile.server_timing(wall)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view = metrics.view_name(view_func, request.method)
+
+    def process_template_response(self, request, response):
+        profile = metrics.current()
+        if profile is not None:
+            profile.start_render()
+            response.add_post_render_callback(profile.finish_render)
+        return response
@@ -43,7 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'trackex.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'trackex.middleware.ConnectionHealthMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -89,9 +91,80 @@ DATABASES = {
         'OPTIONS': {
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES', innodb_strict_mode=1",
         },
+        # seconds to keep connections open between requests, 0 closes them
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
     }
 }
 
+# read replicas of the database, comma separated hosts sharing its name
+# and credentials, serving safe requests of api read actions
+for index, host in enumerate(
+        filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(','))):
+    DATABASES['replica{0}'.format(index)] = dict(
+        DATABASES['default'], HOST=host.strip(), TEST={'MIRROR': 'default'})
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+# seconds a replica may lag the primary and still serve reads
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 5))
+# seconds between measuring the lag of each replica
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 1))
+# seconds a user reads from the primary after writing
+DB_REPLICA_STICKY = int(os.getenv('DB_REPLICA_STICKY', 10))
+
+# check persistent connections are usable before each request
+DB_HEALTH_CHECKS = bool(int(os.getenv('DB_HEALTH_CHECKS', 1)))
+
+# fraction of requests profiled for query, serializer and render time
+METRICS_SAMPLE_RATE = float(os.getenv(
+    'METRICS_SAMPLE_RATE', 1 if DEBUG else 0.1))
+# send Server-Timing headers with profiled responses
+METRICS_HEADERS = bool(int(os.getenv('METRICS_HEADERS', DEBUG)))
+
+# broker of live status events, the local default only reaches subscribers
+# of the process that saved the status, set a shared one for more workers
+EVENT_BROKER = os.getenv('EVENT_BROKER', 'api.events.LocalBroker')
+
+# threads serving requests under trackex.asgi, each may hold a connection
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', 10))
+# threads iterating exports and replaying event streams under trackex.asgi
+ASGI_STREAM_THREADS = int(os.getenv('ASGI_STREAM_THREADS', 20))
+
+# queue tracking posts to be saved by drain_tracking workers
+TRACKING_WRITE_BEHIND = bool(int(os.getenv('TRACKING_WRITE_BEHIND', 0)))
+# sqlite file of the queue, local to the workers draining it
+TRACKING_QUEUE = os.getenv(
+    'TRACKING_QUEUE', os.path.join(BASE_DIR, 'tracking_queue.sqlite3'))
+
+# days statuses stay in the status table before archive_statuses moves them
+STATUS_HOT_DAYS = int(os.getenv('STATUS_HOT_DAYS', 90))
+
+# days changes stay in the change log before prune_changes deletes them
+CHANGE_RETENTION_DAYS = int(os.getenv('CHANGE_RETENTION_DAYS', 30))
+
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+
+# the local memory default is per process, share a backend between workers
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'trackex.cache.LRUMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'trackex'),
+        'TIMEOUT': int(os.getenv('CACHE_TIMEOUT', 300)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 1000)),
+        },
+    }
+}
+
+
+# Authentication
+# https://docs.djangoproject.com/en/2.0/topics/auth/customizing/
+
+# resolve permissions of users from the cache, see api/permissions.py
+AUTHENTICATION_BACKENDS = [
+    'api.permissions.CachedModelBackend',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -112,10 +185,10 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 REST_FRAMEWORK = {
-    # Use Django's standard `django.contrib.auth` permissions,
-    # or allow read-only access for unauthenticated users.
+    # Use Django's standard `django.contrib.auth` permissions, cached per
+    # user, or allow read-only access for unauthenticated users.
     'DEFAULT_PERMISSION_CLASSES': [
-        'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
+        'api.permissions.CachedModelPermissionsOrAnonReadOnly'
     ],
     'COERCE_DECIMAL_TO_STRING': False,
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
@@ -9,9 +9,13 @@ from django.conf.urls import (
 from rest_framework import routers
 from api import views as api_views
 
+from . import views
+
 ROUTER = routers.DefaultRouter(trailing_slash=False)
 ROUTER.register(r'status', api_views.StatusViewSet)
 ROUTER.register(r'packages', api_views.PackageViewSet)
+ROUTER.register(r'changes', api_views.ChangeViewSet)
+ROUTER.register(r'metrics', views.MetricsViewSet, base_name='metrics')
 
 # Wire up our API using automatic URL routing.
 # Additionally, we include login URLs for the browsable API.
@@ -0,0 +1,31 @@
+"""
+Define project views
+"""
+
+from rest_framework import (
+    permissions,
+    status,
+    viewsets,
+)
+from rest_framework.decorators import list_route
+from rest_framework.response import Response
+
+from .metrics import REGISTRY
+
+
+class MetricsViewSet(viewsets.ViewSet):
+    """
+    API endpoint showing request metrics of the serving process per view.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def list(self, request, format=None):
+        return Response(REGISTRY.to_representation())
+
+    @list_route(methods=['POST'], url_path='reset')
+    def reset(self, request, format=None):
+        """
+        Handle dropping collected metrics
+        """
+        REGISTRY.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)